@@ -2,17 +2,28 @@ from collections import OrderedDict
 from typing import List
 from hash import *
 from jwt import *
-import itertools
 
-import contextlib
-import logging.config
+import json
+import logging
 import sqlite3
 import datetime
 
-from fastapi import FastAPI, Depends, Request, HTTPException, status
-from pydantic import BaseModel
+from fastapi import FastAPI, Request, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
 from pydantic_settings import BaseSettings
 
+import log_pipeline
+import metrics
+from bulk_io import BulkFormatError, aiter_records, format_validation_error
+from db_pool import DEFAULT_PRAGMAS, PoolTimeout, get_pool, pool_stats
+from hash_executor import HashExecutor, HashQueueFull
+from login_cache import VerificationCache
+from replica_router import ReplicaRouter
+from slow_queries import slow_query_log
+from user_directory import DataVersionWatch, UserDirectory
+
 class UserRegister(BaseModel):
     username: str
     password: str
@@ -27,32 +38,154 @@ class Settings(BaseSettings, env_file=".env", extra="ignore"):
     auth_secondary_database_1: str
     auth_secondary_database_2: str
     auth_logging_config: str
+    auth_db_pool_size: int = 8
+    auth_db_pool_timeout: float = 5.0
+    auth_hash_workers: int = 0
+    auth_hash_max_pending: int = 64
+    auth_hash_bulk_workers: int = 0
+    auth_login_cache_size: int = 10000
+    auth_login_cache_ttl: float = 60.0
+    auth_replica_max_lag: int = 10
+    auth_replica_check_interval: float = 1.0
+    auth_user_directory_snapshot: str = ""
+    auth_metrics: bool = False
+    auth_slow_query_ms: float = 0.0
+    auth_log_queue_size: int = 10000
+    auth_log_debug_sample_rate: float = 1.0
 
 settings = Settings()
 app = FastAPI()
 
+# Prometheus text on /metrics, per worker. Off, requests and connections aren't instrumented at all.
+if settings.auth_metrics:
+    metrics.enable(app)
+
+# Every request gets an ID, set on the records logged while handling it and returned as X-Request-ID
+app.add_middleware(log_pipeline.RequestIdMiddleware)
+
+# Statements slower than this go to the slow_queries logger, with their plan. 0 turns it off.
+# Parameters are never logged here, they hold usernames and password hashes.
+if settings.auth_slow_query_ms > 0:
+    for path in (settings.auth_database, settings.auth_secondary_database_1, settings.auth_secondary_database_2):
+        slow_query_log.watch(path, settings.auth_slow_query_ms / 1000, redact=True)
+
 # List of database paths
 database_paths = [settings.auth_secondary_database_1, settings.auth_secondary_database_2]
 
-# Create a cycle iterator for the database paths
-database_cycle = itertools.cycle(database_paths)
+# Route reads to healthy, caught-up replicas, or to the primary when none are
+replica_router = ReplicaRouter(
+    settings.auth_database,
+    database_paths,
+    max_lag=settings.auth_replica_max_lag,
+    check_interval=settings.auth_replica_check_interval,
+)
+
+data_version_watch = DataVersionWatch(settings.auth_database)
+
+def auth_database_version():
+    # The LiteFS position when replicating, otherwise SQLite's data_version
+    txid = replica_router.primary.txid
+    return ("litefs", txid) if txid is not None else data_version_watch()
+
+# Username -> (password hash, roles), dropped whenever the auth database changes
+user_directory = UserDirectory(auth_database_version, check_interval=settings.auth_replica_check_interval)
 
 def get_logger():
     return logging.getLogger(__name__)
 
-logging.config.fileConfig(settings.auth_logging_config, disable_existing_loggers=False)
+# Handlers from the .ini write on a listener thread, requests only queue their records, and
+# drop them when the queue is full. DEBUG records are kept for this share of requests.
+log_pipeline.configure(
+    settings.auth_logging_config,
+    debug_sample_rate=settings.auth_log_debug_sample_rate,
+    queue_size=settings.auth_log_queue_size,
+)
+
+# PBKDF2 runs in its own processes so logins don't hold the GIL or the request threadpool
+hash_executor = HashExecutor(
+    workers=settings.auth_hash_workers,
+    max_pending=settings.auth_hash_max_pending,
+    bulk_workers=settings.auth_hash_bulk_workers,
+)
+
+# Recent successful logins, so retries inside the TTL skip PBKDF2
+login_cache = VerificationCache(max_entries=settings.auth_login_cache_size, ttl=settings.auth_login_cache_ttl)
+
+@app.on_event("startup")
+def warm_user_directory():
+    replica_router.start()
+    user_directory.start()
+    if settings.auth_user_directory_snapshot:
+        with auth_pool(settings.auth_database).connection() as db:
+            source = user_directory.warm(db, settings.auth_user_directory_snapshot)
+        get_logger().info("User directory warmed from %s", source)
+
+@app.on_event("shutdown")
+def shutdown_hash_executor():
+    hash_executor.shutdown()
+
+@app.exception_handler(HashQueueFull)
+def hash_queue_full_handler(request: Request, exc: HashQueueFull):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, try again."},
+        headers={"Retry-After": "1"},
+    )
+
+# The auth databases are served through LiteFS FUSE mounts, so skip memory-mapped I/O
+primary_pragmas = {**DEFAULT_PRAGMAS, "mmap_size": 0}
+
+# Replicas are read-only, their journal mode is replicated from the primary
+secondary_pragmas = {k: v for k, v in primary_pragmas.items() if k != "journal_mode"}
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": "Database busy, try again."}
+    )
 
-# Define a function to get a database connection
-def get_primary_db():
-    with contextlib.closing(sqlite3.connect(settings.auth_database)) as db:
-        db.row_factory = sqlite3.Row
-        yield db
+def auth_pool(path):
+    # Every pool on an auth database is asked for here, so all callers pass the same options
+    return get_pool(
+        path,
+        size=settings.auth_db_pool_size,
+        timeout=settings.auth_db_pool_timeout,
+        pragmas=primary_pragmas if path == settings.auth_database else secondary_pragmas,
+    )
 
-def get_secondary_db():
-    db_path = next(database_cycle)
-    with contextlib.closing(sqlite3.connect(db_path)) as db:
-        db.row_factory = sqlite3.Row
-        yield db
+def on_primary(func, *args):
+    # Runs func(db, *args) on a primary connection checked out for just this call. Called on
+    # the threadpool, so no connection is held while a request waits on password hashing.
+    with auth_pool(settings.auth_database).connection() as db:
+        return func(db, *args)
+
+def read_version(db_path):
+    # What a read from db_path is at least as new as. Taken before the read: the primary is at
+    # the directory's version, a LiteFS replica at its own position, any other replica unknown.
+    if db_path == settings.auth_database:
+        return user_directory.version
+    txid = replica_router.txid(db_path)
+    return ("litefs", txid) if txid is not None else None
+
+def lookup_user(username):
+    # A user directory miss, read from a replica
+    with replica_router.route() as db_path:
+        version = read_version(db_path)
+        with auth_pool(db_path).connection() as db:
+            return user_directory.load(db, username, version)
+
+# Example: GET http://localhost:5000/stats
+@app.get("/stats")
+def get_stats():
+    return {
+        "pools": pool_stats(),
+        "hashing": hash_executor.stats(),
+        "login_cache": login_cache.stats(),
+        "replicas": replica_router.stats(),
+        "user_directory": user_directory.stats(),
+        "slow_queries": slow_query_log.stats(),
+        "logging": log_pipeline.stats(),
+    }
 
 
 # Task 1: Register a new user
@@ -63,39 +196,179 @@ def get_secondary_db():
 #     "roles": ["student"]
 # }
 @app.post("/register")
-def register(new_register: UserRegister, request: Request, db: sqlite3.Connection = Depends(get_primary_db)):
+async def register(new_register: UserRegister, request: Request):
 
     new_user = dict(new_register)
-    print(db)
-    
-    username_exists = db.execute("""
-                SELECT *
-                FROM User
-                WHERE username=:username
-            """, new_user).fetchall()
+
+    # Reads on the primary can wait on its lock too, keep them off the event loop
+    if await run_in_threadpool(on_primary, username_exists, new_user["username"]):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Username already in use."
+        )
     
-    if username_exists:
+    hashed_password = await hash_executor.hash_password(new_user["password"])
+
+    # The write can wait on the database lock, keep it off the event loop
+    try:
+        await run_in_threadpool(on_primary, insert_user, new_user["username"], hashed_password, new_user["roles"])
+    except sqlite3.IntegrityError:
+        # Registered by another request while we hashed
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Username already in use."
         )
     
-    hashed_password = hash_password(new_user["password"])
+    return {"detail": "successfully registered"}
+
+def username_exists(db, username):
+    return db.execute("""
+                SELECT 1
+                FROM User
+                WHERE username=:username
+            """, {"username": username}).fetchone() is not None
 
+def insert_user(db, username, hashed_password, roles):
     db.execute("""
         INSERT INTO User (username, password)
         VALUES (:username, :hashed_password)
-        """, {"username": new_user["username"], "hashed_password": hashed_password})
+        """, {"username": username, "hashed_password": hashed_password})
     
-    for role in new_user["roles"]:
+    for role in dict.fromkeys(roles):
             db.execute("""
                 INSERT INTO Roles (r_username, role)
                 VALUES (:username, :role)
-        """, {"username": new_user["username"], "role": role})
+        """, {"username": username, "role": role})
 
     # Commit the changes
     db.commit()
-    
-    return {"detail": "successfully registered"}
+
+# Users checked, hashed and inserted at a time by /register/bulk, so a large upload is never
+# held in memory whole
+BULK_REGISTER_BATCH = 256
+
+# Bulk register users from a streamed JSON array or NDJSON body. Each batch of
+# BULK_REGISTER_BATCH users is committed on its own, so a request that fails partway is
+# partial: the users of the batches before the failure stay registered. The error response
+# says how many in "registered", with a status for every record read so far; records that
+# were not registered can be sent again.
+# Example: POST http://localhost:5000/register/bulk
+# Content-Type: application/x-ndjson
+# body:
+# {"username": "TheRealSamDoe", "password": "SamyDoeSo123!", "roles": ["student"]}
+# {"username": "IreneDoe100", "password": "IreneDoe123!", "roles": ["instructor"]}
+@app.post("/register/bulk")
+async def register_bulk(request: Request):
+
+    results = []
+    seen = set()
+    batch = {}
+    registered = 0
+
+    try:
+        async for record in aiter_records(request):
+            result = {"index": len(results), "username": record.get("username") if isinstance(record, dict) else None}
+            results.append(result)
+
+            try:
+                new_user = UserRegister.model_validate(record)
+            except ValidationError as e:
+                result.update(status="invalid", detail=format_validation_error(e))
+                continue
+
+            if new_user.username in seen:
+                result.update(status="duplicate", detail="Username repeated in request.")
+                continue
+
+            seen.add(new_user.username)
+            batch[new_user.username] = (new_user, result)
+            if len(batch) == BULK_REGISTER_BATCH:
+                registered += await register_batch(batch)
+                batch = {}
+
+        registered += await register_batch(batch)
+    except (BulkFormatError, HashQueueFull, PoolTimeout, sqlite3.OperationalError) as e:
+        # Earlier batches are stored, so report them with the error; the rest can be sent again
+        for _, result in batch.values():
+            if "status" not in result:
+                result.update(status="not_registered", detail="Not registered, the request was stopped.")
+        busy = not isinstance(e, BulkFormatError)
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE if busy else status.HTTP_400_BAD_REQUEST,
+            content={
+                "detail": "Server busy, try again." if busy else str(e),
+                "registered": registered,
+                "rejected": len(results) - registered,
+                "results": results,
+            },
+            headers={"Retry-After": "1"} if busy else None,
+        )
+
+    return {"registered": registered, "rejected": len(results) - registered, "results": results}
+
+async def register_batch(batch):
+    # Checks, hashes and inserts one batch of {username: (new_user, result)}, returns how many
+    # were registered. A connection is checked out for the lookup and for the insert, never
+    # across the hashing in between.
+    if not batch:
+        return 0
+
+    # One set-based lookup instead of a SELECT per user, so we don't hash passwords we won't store
+    existing = await run_in_threadpool(on_primary, find_existing_usernames, list(batch))
+    for username in existing:
+        _, result = batch.pop(username)
+        result.update(status="conflict", detail="Username already in use.")
+
+    users = list(batch.values())
+    hashed_passwords = await hash_executor.hash_passwords([new_user.password for new_user, _ in users])
+
+    rows = [(new_user.username, hashed, new_user.roles) for (new_user, _), hashed in zip(users, hashed_passwords)]
+    existing = await run_in_threadpool(on_primary, insert_users, rows)
+
+    registered = 0
+    for new_user, result in users:
+        if new_user.username in existing:
+            result.update(status="conflict", detail="Username already in use.")
+        else:
+            result.update(status="registered")
+            registered += 1
+    return registered
+
+def find_existing_usernames(db, usernames):
+    if not usernames:
+        return set()
+    existing = db.execute("""
+            SELECT username
+            FROM User
+            WHERE username IN (SELECT value FROM json_each(?))
+        """, (json.dumps(usernames),)).fetchall()
+    return {row["username"] for row in existing}
+
+def insert_users(db, rows):
+    if not rows:
+        return set()
+
+    # Single write transaction for the whole batch
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # Check again under the write lock, in case any were registered while we hashed
+        existing = find_existing_usernames(db, [username for username, _, _ in rows])
+        rows = [row for row in rows if row[0] not in existing]
+
+        db.executemany("""
+            INSERT INTO User (username, password)
+            VALUES (?, ?)
+            """, [(username, hashed_password) for username, hashed_password, _ in rows])
+
+        db.executemany("""
+            INSERT INTO Roles (r_username, role)
+            VALUES (?, ?)
+            """, [(username, role) for username, _, roles in rows for role in dict.fromkeys(roles)])
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return existing
 
 # Task 2: Check a user’s password
 # Example: POST http://localhost:5000/signin
@@ -104,37 +377,32 @@ def register(new_register: UserRegister, request: Request, db: sqlite3.Connectio
 #     "password": "SamyDoeSo123!",
 # }
 @app.post("/login")
-def token_issuer(user_sign_in: UserSignIn, request: Request, db: sqlite3.Connection = Depends(get_secondary_db)):    
+async def token_issuer(user_sign_in: UserSignIn, request: Request):
     user = dict(user_sign_in)
 
-    user_info = db.execute("""
-            SELECT *
-            FROM User
-            WHERE username=:username
-        """, user).fetchall()[0]
+    # Hits are answered without SQL, only a miss reads a replica, on the threadpool
+    user_info = user_directory.cached(user["username"])
+    if user_info is None:
+        user_info = await run_in_threadpool(lookup_user, user["username"])
     
     if not user_info:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid credentials."
         ) 
     
-    verified = verify_password(user["password"], user_info["password"])
+    password_hash, roles = user_info
+
+    verified = login_cache.check(user["username"], user["password"], password_hash)
+    if not verified:
+        verified = await hash_executor.verify_password(user["password"], password_hash)
+        if verified:
+            login_cache.add(user["username"], user["password"], password_hash)
 
     if not verified:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid credentials."
         )   
 
-    user_roles = db.execute("""
-                SELECT *
-                FROM Roles
-                WHERE r_username=:username
-            """, user).fetchall()
-    
-    roles = []
-    for role in user_roles:
-        roles.append(role["role"])
-
-    token = generate_claims(user_info["username"], roles)
+    token = generate_claims(user["username"], list(roles))
     
     return token
\ No newline at end of file
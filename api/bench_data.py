@@ -0,0 +1,226 @@
+import bisect
+import datetime
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import migrate
+from hash import hash_password
+
+SHARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "share")
+
+ENROLLMENT_DATABASE = "enrollmentDatabase.db"
+AUTH_DATABASE = "authDatabase.db"
+DATASET = "dataset.json"
+
+# Every generated user signs in with this, so loading 200k users doesn't run PBKDF2 200k times
+PASSWORD = "Benchmark123!"
+
+DEPARTMENTS = [
+    ("CPSC", "Computer Science"), ("MATH", "Mathematics"), ("PHYS", "Physics"), ("CHEM", "Chemistry"),
+    ("BIOL", "Biology"), ("ENGL", "English"), ("HIST", "History"), ("ECON", "Economics"),
+    ("PSYC", "Psychology"), ("PHIL", "Philosophy"), ("POSC", "Political Science"), ("SOCI", "Sociology"),
+    ("GEOG", "Geography"), ("BUSI", "Business"), ("MUSC", "Music"), ("ARTS", "Art"),
+]
+
+# (max_enrollment, weight): mostly small sections, a few lecture halls
+CAPACITIES = [(20, 3), (30, 5), (40, 3), (60, 2), (120, 1)]
+
+# Classes each student tries to take
+CLASSES_PER_STUDENT = (3, 6)
+
+# Section popularity follows a Zipf law with this exponent, so a few sections fill at once and
+# grow long waitlists while most have seats left
+POPULARITY_SKEW = 0.8
+
+# Share of picks that end up as a drop instead of an enrollment
+DROP_RATE = 0.02
+
+DEFAULTS = {"sections": 20000, "students": 200000, "instructors": 2000, "seed": 449}
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} DIRECTORY [--sections N] [--students N] [--instructors N] [--seed N]", file=sys.stderr)
+    print(f"Writes {ENROLLMENT_DATABASE}, {AUTH_DATABASE} and {DATASET} to DIRECTORY", file=sys.stderr)
+
+
+def student_username(i):
+    return f"s{i:07d}"
+
+
+def instructor_username(i):
+    return f"i{i:05d}"
+
+
+def section_keys(count, taken):
+    # (class_code, section_number) in catalog order, one to four sections per course, leaving
+    # out the sample sections already in the schema
+    rng = random.Random(0)
+    keys = []
+    for number in range(100, 1000):
+        for prefix, _ in DEPARTMENTS:
+            for section in range(1, rng.randint(1, 4) + 1):
+                if (f"{prefix}{number}", f"{section:02d}") in taken:
+                    continue
+                keys.append((f"{prefix}{number}", f"{section:02d}"))
+                if len(keys) == count:
+                    return keys
+    raise ValueError(f"At most {len(keys)} sections can be generated")
+
+
+def sample_sections():
+    db = sqlite3.connect(":memory:")
+    with open(os.path.join(SHARE, "enrollmentDatabase.sql")) as f:
+        db.executescript(f.read())
+    return set(db.execute("SELECT class_code, section_number FROM Class"))
+
+
+def generate(sections, students, instructors, seed):
+    rng = random.Random(seed)
+    departments = dict(DEPARTMENTS)
+    capacities, capacity_weights = zip(*CAPACITIES)
+
+    classes = []
+    for class_code, section_number in section_keys(sections, sample_sections()):
+        classes.append((
+            class_code,
+            section_number,
+            f"{departments[class_code[:4]]} {class_code[4:]}",
+            departments[class_code[:4]],
+            rng.random() < 0.9,
+            rng.choices(capacities, capacity_weights)[0],
+            15,
+            instructor_username(rng.randrange(instructors)),
+        ))
+
+    # Popularity ranks are shuffled, so the hot sections aren't all in one department
+    ranks = list(range(1, sections + 1))
+    rng.shuffle(ranks)
+    cum_weights = list(itertools.accumulate(rank ** -POPULARITY_SKEW for rank in ranks))
+
+    enrolled = [0] * sections
+    waitlisted = [0] * sections
+    enroll, waitlist, dropped = [], [], []
+    opened = datetime.datetime(2026, 4, 1, 8, 0)
+    for i in range(students):
+        username = student_username(i)
+        wanted = rng.randint(*CLASSES_PER_STUDENT)
+        picks = {bisect.bisect(cum_weights, rng.random() * cum_weights[-1]) for _ in range(wanted)}
+        waitlists = 0
+        for pick in sorted(picks):
+            class_code, section_number, _, _, _, max_enrollment, max_waitlist, _ = classes[pick]
+            if rng.random() < DROP_RATE:
+                dropped.append((username, class_code, section_number))
+            elif enrolled[pick] < max_enrollment:
+                enrolled[pick] += 1
+                enroll.append((username, class_code, section_number))
+            elif waitlisted[pick] < max_waitlist and waitlists < 3:
+                waitlisted[pick] += 1
+                waitlists += 1
+                timestamp = opened + datetime.timedelta(seconds=len(waitlist))
+                waitlist.append((username, class_code, section_number, timestamp.isoformat(" ")))
+
+    return classes, enroll, waitlist, dropped
+
+
+def write_enrollment_database(path, classes, enroll, waitlist, dropped, students, instructors):
+    db = sqlite3.connect(path)
+    with open(os.path.join(SHARE, "enrollmentDatabase.sql")) as f:
+        db.executescript(f.read())
+    # Migrated first, so the section counts are kept by the triggers as the rows go in
+    migrate.migrate(db, "enrollment")
+
+    db.execute("BEGIN")
+    db.executemany("INSERT INTO Instructor VALUES (?, ?, ?)", (
+        (instructor_username(i), f"First{i}", f"Last{i}") for i in range(instructors)
+    ))
+    db.executemany("INSERT INTO Student VALUES (?, ?, ?)", (
+        (f"First{i}", f"Last{i}", student_username(i)) for i in range(students)
+    ))
+    db.executemany("INSERT INTO Class VALUES (?, ?, ?, ?, ?, ?, ?, ?)", classes)
+    db.executemany("INSERT INTO Enroll VALUES (?, ?, ?)", enroll)
+    db.executemany("INSERT INTO Waitlist VALUES (?, ?, ?, ?)", waitlist)
+    db.executemany("INSERT INTO Dropped VALUES (?, ?, ?)", dropped)
+    db.commit()
+
+    db.execute("ANALYZE")
+    db.commit()
+    db.close()
+
+
+def write_auth_database(path, students, instructors, seed):
+    db = sqlite3.connect(path)
+    with open(os.path.join(SHARE, "authDatabase.sql")) as f:
+        db.executescript(f.read())
+
+    password_hash = hash_password(PASSWORD, salt=f"benchmark{seed}")
+    users = [(student_username(i), "student") for i in range(students)]
+    users += [(instructor_username(i), "instructor") for i in range(instructors)]
+    db.executemany("INSERT INTO User VALUES (?, ?)", ((username, password_hash) for username, _ in users))
+    db.executemany("INSERT INTO Roles VALUES (?, ?)", users)
+    db.commit()
+
+    migrate.migrate(db, "auth")
+    db.close()
+
+
+def build(directory, sections, students, instructors, seed):
+    os.makedirs(directory, exist_ok=True)
+    for name in (ENROLLMENT_DATABASE, AUTH_DATABASE):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(os.path.join(directory, name + suffix)):
+                os.remove(os.path.join(directory, name + suffix))
+
+    classes, enroll, waitlist, dropped = generate(sections, students, instructors, seed)
+    write_enrollment_database(
+        os.path.join(directory, ENROLLMENT_DATABASE), classes, enroll, waitlist, dropped, students, instructors
+    )
+    write_auth_database(os.path.join(directory, AUTH_DATABASE), students, instructors, seed)
+
+    dataset = {
+        "seed": seed,
+        "sections": sections,
+        "students": students,
+        "instructors": instructors,
+        "enrolled": len(enroll),
+        "waitlisted": len(waitlist),
+        "dropped": len(dropped),
+        "password": PASSWORD,
+    }
+    with open(os.path.join(directory, DATASET), "w") as f:
+        json.dump(dataset, f, indent=2)
+    return dataset
+
+
+def parse_options(args, defaults):
+    # --name N pairs, every value an int
+    options = dict(defaults)
+    if len(args) % 2:
+        raise ValueError("Options come in --name N pairs")
+    for name, value in zip(args[::2], args[1::2]):
+        key = name.removeprefix("--").replace("-", "_")
+        if not name.startswith("--") or key not in options:
+            raise ValueError(f"Unknown option {name}")
+        options[key] = type(options[key])(value)
+    return options
+
+
+if __name__ == "__main__":
+    try:
+        if len(sys.argv) < 2 or sys.argv[1].startswith("--"):
+            raise ValueError("Missing DIRECTORY")
+        options = parse_options(sys.argv[2:], DEFAULTS)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    start = time.perf_counter()
+    dataset = build(sys.argv[1], **options)
+    print(json.dumps(dataset, indent=2))
+    print(f"Generated in {time.perf_counter() - start:.1f}s", file=sys.stderr)
@@ -0,0 +1,258 @@
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import bench_data
+from pagination import encode_cursor
+
+DEFAULTS = {
+    "workloads": "catalog_browsing,enroll_storm,login_burst",
+    "requests": 0,
+    "concurrency": 64,
+    "seed": 1,
+    "output": "",
+    "log_level": "WARNING",
+}
+
+PAGE_SIZE = 100
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} run DIRECTORY [--workloads {DEFAULTS['workloads']}] [--requests N] [--concurrency N] [--seed N] [--output FILE] [--log-level LEVEL]", file=sys.stderr)
+    print(f"       {program} compare BASELINE.json RESULTS.json", file=sys.stderr)
+    print("DIRECTORY holds a dataset written by bench_data.py, runs use a copy of it", file=sys.stderr)
+
+
+class Dataset:
+    # What the workloads pick from: usernames by number, sections as loaded
+    def __init__(self, directory):
+        with open(os.path.join(directory, bench_data.DATASET)) as f:
+            self.info = json.load(f)
+        with sqlite3.connect(os.path.join(directory, bench_data.ENROLLMENT_DATABASE)) as db:
+            self.sections = db.execute("SELECT class_code, section_number FROM Class ORDER BY 1, 2").fetchall()
+
+    def student(self, rng):
+        return bench_data.student_username(rng.randrange(self.info["students"]))
+
+
+# Each workload yields (endpoint, method, url, json) in a seeded order
+
+def catalog_browsing(rng, dataset, count):
+    # Half the catalog reads are first pages, which every student shares, the rest jump in
+    for _ in range(count):
+        choice = rng.random()
+        if choice < 0.5:
+            after = "" if rng.random() < 0.5 else f"&after={encode_cursor(rng.choice(dataset.sections))}"
+            yield "GET /all_classes", "GET", f"/all_classes?limit={PAGE_SIZE}{after}", None
+        elif choice < 0.7:
+            after = "" if rng.random() < 0.5 else f"&after={encode_cursor(rng.choice(dataset.sections))}"
+            yield "GET /student/available_classes", "GET", f"/student/available_classes?limit={PAGE_SIZE}{after}", None
+        elif choice < 0.9:
+            yield "GET /student_enrollment", "GET", f"/student_enrollment/{dataset.student(rng)}", None
+        else:
+            yield "GET /student/waitlist_positions", "GET", f"/student/waitlist_positions/student/{dataset.student(rng)}", None
+
+
+def enroll_storm(rng, dataset, count):
+    # Registration opens and most students go for the same few sections
+    sections = list(dataset.sections)
+    rng.shuffle(sections)
+    cum_weights = list(itertools.accumulate(rank ** -1.2 for rank in range(1, len(sections) + 1)))
+    for _ in range(count):
+        class_code, section_number = rng.choices(sections, cum_weights=cum_weights)[0]
+        url = f"/student/enroll_in_class/student/{dataset.student(rng)}/class/{class_code}/section/{section_number}"
+        yield "POST /student/enroll_in_class", "POST", url, None
+
+
+def login_burst(rng, dataset, count):
+    # Everyone signs in at once, some mistype and some retry within the login cache's TTL
+    recent = []
+    for _ in range(count):
+        if recent and rng.random() < 0.2:
+            username = rng.choice(recent)
+        else:
+            username = dataset.student(rng)
+            recent.append(username)
+        password = dataset.info["password"] if rng.random() < 0.95 else "wrong-password"
+        yield "POST /login", "POST", "/login", {"username": username, "password": password}
+
+
+# name: (app, requests, default request count)
+WORKLOADS = {
+    "catalog_browsing": ("enrollment", catalog_browsing, 5000),
+    "enroll_storm": ("enrollment", enroll_storm, 5000),
+    "login_burst": ("auth", login_burst, 500),
+}
+
+
+def percentile(ordered, p):
+    # Nearest rank
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, statuses, duration):
+    ordered = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if status == "error" or int(status) >= 500)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput": round(len(ordered) / duration, 1),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+async def drive(client, requests, concurrency):
+    latencies = {}
+    statuses = {}
+
+    async def user():
+        # Every user takes the next request from the shared plan
+        for endpoint, method, url, body in requests:
+            start = time.perf_counter()
+            try:
+                status = str((await client.request(method, url, json=body)).status_code)
+            except httpx.HTTPError:
+                status = "error"
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+            endpoint_statuses = statuses.setdefault(endpoint, {})
+            endpoint_statuses[status] = endpoint_statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    endpoints = {endpoint: summarize(latencies[endpoint], statuses[endpoint], duration) for endpoint in sorted(latencies)}
+    total = sum(summary["requests"] for summary in endpoints.values())
+    return {
+        "requests": total,
+        "errors": sum(summary["errors"] for summary in endpoints.values()),
+        "duration": round(duration, 3),
+        "throughput": round(total / duration, 1),
+        "endpoints": endpoints,
+    }
+
+
+async def run_workloads(apps, dataset, names, options):
+    results = {}
+    for name in names:
+        app, plan, count = WORKLOADS[name]
+        # Seeded per workload, so one workload's plan doesn't depend on which ran before it
+        rng = random.Random(f"{options['seed']}:{name}")
+        requests = plan(rng, dataset, options["requests"] or count)
+        transport = httpx.ASGITransport(app=apps[app])
+        async with apps[app].router.lifespan_context(apps[app]):
+            async with httpx.AsyncClient(transport=transport, base_url=f"http://{app}", timeout=60) as client:
+                results[name] = await drive(client, requests, options["concurrency"])
+        print(f"{name}: {results[name]['throughput']} req/s, {results[name]['errors']} errors", file=sys.stderr)
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run(directory, options):
+    names = options["workloads"].split(",")
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        raise ValueError(f"Unknown workloads: {', '.join(unknown)}")
+
+    dataset = Dataset(directory)
+    scratch = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        # Every run starts from the dataset as generated, writes go to the copy
+        for name in (bench_data.ENROLLMENT_DATABASE, bench_data.AUTH_DATABASE):
+            shutil.copy(os.path.join(directory, name), scratch)
+        auth_database = os.path.join(scratch, bench_data.AUTH_DATABASE)
+        os.environ["ENROLLMENT_DATABASE"] = os.path.join(scratch, bench_data.ENROLLMENT_DATABASE)
+        os.environ["AUTH_DATABASE"] = auth_database
+        os.environ["AUTH_SECONDARY_DATABASE_1"] = auth_database
+        os.environ["AUTH_SECONDARY_DATABASE_2"] = auth_database
+
+        # Imported only now, they read their settings on import
+        import auth_api
+        import enrollment_api
+        logging.getLogger().setLevel(options["log_level"])
+
+        results = asyncio.run(run_workloads({"enrollment": enrollment_api.app, "auth": auth_api.app}, dataset, names, options))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "started": datetime.datetime.now().isoformat(" ", "seconds"),
+        "python": platform.python_version(),
+        "dataset": dataset.info,
+        "options": {key: options[key] for key in ("concurrency", "seed", "requests")},
+        "settings": {
+            "enrollment_db_mode": enrollment_api.settings.enrollment_db_mode,
+            "enrollment_group_commit": enrollment_api.settings.enrollment_group_commit,
+            "enrollment_repository_backend": enrollment_api.settings.enrollment_repository_backend,
+            "enrollment_waitlist_backend": enrollment_api.settings.enrollment_waitlist_backend,
+            "auth_hash_workers": auth_api.hash_executor.workers,
+        },
+        "workloads": results,
+    }
+
+
+def compare(baseline, results):
+    # Latency change in percent for each endpoint both runs measured, negative is faster
+    print(f"{'workload / endpoint':<52}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}")
+    for name, workload in results["workloads"].items():
+        for endpoint, summary in workload["endpoints"].items():
+            before = baseline["workloads"].get(name, {}).get("endpoints", {}).get(endpoint)
+            if before is None:
+                continue
+            changes = [
+                (summary[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+                for key in ("p50_ms", "p95_ms", "p99_ms", "throughput")
+            ]
+            print(f"{name + ' ' + endpoint:<52}" + "".join(f"{change:>+8.1f}%" for change in changes))
+
+
+if __name__ == "__main__":
+    try:
+        if len(sys.argv) == 4 and sys.argv[1] == "compare":
+            with open(sys.argv[2]) as f, open(sys.argv[3]) as g:
+                compare(json.load(f), json.load(g))
+            sys.exit(0)
+        if len(sys.argv) < 3 or sys.argv[1] != "run":
+            raise ValueError("Expected run DIRECTORY or compare BASELINE RESULTS")
+        options = bench_data.parse_options(sys.argv[3:], DEFAULTS)
+        report = run(sys.argv[2], options)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        usage()
+        sys.exit(1)
+
+    text = json.dumps(report, indent=2)
+    if options["output"]:
+        with open(options["output"], "w") as f:
+            f.write(text + "\n")
+    print(text)
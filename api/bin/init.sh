@@ -1,5 +1,7 @@
 #!/bin/sh
 
 sqlite3 ./var/enrollmentDatabase.db < ./share/enrollmentDatabase.sql
+python migrate.py enrollment ./var/enrollmentDatabase.db
 # sqlite3 ./var/authDatabase.db < ./share/authDatabase.sql
 sqlite3 ./var/primary/fuse/authDatabase.db < ./share/authDatabase.sql
+python migrate.py auth ./var/primary/fuse/authDatabase.db
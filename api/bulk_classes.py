@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+
+from bulk_io import CSV_TYPES, NDJSON_TYPES, BulkFormatError, iter_records
+from class_import import Class, ClassImport
+from db_pool import connect
+from enrollment_repository import instructor_usernames
+from enrollment_settings import Settings
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} FILE [--dry-run]", file=sys.stderr)
+    print("Adds or updates the sections in a .csv, .ndjson/.jsonl or .json file, using the backends configured in .env", file=sys.stderr)
+
+
+def content_type(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return CSV_TYPES[0]
+    if extension in (".ndjson", ".jsonl"):
+        return NDJSON_TYPES[0]
+    return "application/json"
+
+
+def import_classes(db, repository, waitlist, file, content_type, dry_run):
+    importer = ClassImport(Class, instructor_usernames(db))
+    for record in iter_records(file, content_type):
+        if chunk := importer.add(record):
+            importer.upserted(repository.upsert_classes(db, waitlist, chunk, dry_run))
+    if chunk := importer.take():
+        importer.upserted(repository.upsert_classes(db, waitlist, chunk, dry_run))
+    return importer.report(dry_run)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    dry_run = "--dry-run" in args
+    if dry_run:
+        args.remove("--dry-run")
+    if len(args) != 1:
+        usage()
+        sys.exit(1)
+
+    path = args[0]
+    settings = Settings()
+    db = connect(settings.enrollment_database)
+    try:
+        with open(path, "rb") as file:
+            report = import_classes(db, settings.repository(), settings.waitlist_store(), file, content_type(path), dry_run)
+    except BulkFormatError as e:
+        print(f"{path}: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db.close()
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["rejected"] else 0)
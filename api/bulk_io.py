@@ -0,0 +1,180 @@
+import codecs
+import csv
+import json
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+CSV_TYPES = ("text/csv", "application/csv")
+
+# Bytes read from a file at a time by iter_records
+READ_SIZE = 64 * 1024
+
+# Upper bound on a single buffered record, so a malformed body can't grow without limit
+MAX_RECORD_SIZE = 1024 * 1024
+
+
+class BulkFormatError(ValueError):
+    pass
+
+
+def format_validation_error(e):
+    # A pydantic ValidationError as one line, for the report on a rejected record
+    return "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+
+def media_type(content_type):
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def is_ndjson(content_type):
+    return media_type(content_type) in NDJSON_TYPES
+
+
+def is_csv(content_type):
+    return media_type(content_type) in CSV_TYPES
+
+
+class NDJSONDecoder:
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        if len(self._buffer) > MAX_RECORD_SIZE:
+            raise BulkFormatError("Record too large.")
+        return [self._decode(line) for line in lines if line.strip()]
+
+    def close(self):
+        line, self._buffer = self._buffer, ""
+        return [self._decode(line)] if line.strip() else []
+
+    @staticmethod
+    def _decode(line):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError as e:
+            raise BulkFormatError(f"Invalid JSON line: {e}") from None
+
+
+class JSONArrayDecoder:
+    # Decodes a top-level JSON array of objects one element at a time
+    def __init__(self):
+        self._buffer = ""
+        self._started = False
+        self._finished = False
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        self._buffer += text
+        records = []
+        while True:
+            self._buffer = self._buffer.lstrip()
+            if not self._buffer:
+                break
+            if not self._started:
+                if self._buffer[0] != "[":
+                    raise BulkFormatError("Expected a JSON array.")
+                self._started = True
+                self._buffer = self._buffer[1:]
+                continue
+            if self._finished:
+                raise BulkFormatError("Unexpected data after the JSON array.")
+            if self._buffer[0] == ",":
+                self._buffer = self._buffer[1:]
+                continue
+            if self._buffer[0] == "]":
+                self._finished = True
+                self._buffer = self._buffer[1:]
+                continue
+            try:
+                record, end = self._decoder.raw_decode(self._buffer)
+            except json.JSONDecodeError:
+                # Most likely a record split across chunks, wait for more
+                if len(self._buffer) > MAX_RECORD_SIZE:
+                    raise BulkFormatError("Record too large.") from None
+                break
+            records.append(record)
+            self._buffer = self._buffer[end:]
+        return records
+
+    def close(self):
+        if self._buffer.strip() or not self._finished:
+            raise BulkFormatError("Truncated or invalid JSON array.")
+        return []
+
+
+class CSVDecoder:
+    # Decodes CSV with a header row into one dict per row, keyed by the header. Missing fields
+    # are left out and extra ones are listed under None, as csv.DictReader does.
+    def __init__(self):
+        self._buffer = ""
+        self._header = None
+
+    def feed(self, text):
+        buffer = self._buffer + text
+        lines = []
+        start = scanned = quotes = 0
+        while (end := buffer.find("\n", scanned)) != -1:
+            quotes += buffer.count('"', scanned, end)
+            scanned = end + 1
+            # A newline inside a quoted field doesn't end the row
+            if quotes % 2:
+                continue
+            lines.append(buffer[start:end])
+            start, quotes = scanned, 0
+        self._buffer = buffer[start:]
+        if len(self._buffer) > MAX_RECORD_SIZE:
+            raise BulkFormatError("Record too large.")
+        return self._decode(lines)
+
+    def close(self):
+        line, self._buffer = self._buffer, ""
+        records = self._decode([line])
+        if self._header is None:
+            raise BulkFormatError("Missing CSV header row.")
+        return records
+
+    def _decode(self, lines):
+        records = []
+        try:
+            for row in csv.reader(lines, strict=True):
+                if not row:
+                    continue
+                if self._header is None:
+                    self._header = [name.strip() for name in row]
+                    self._header[0] = self._header[0].removeprefix("\ufeff")
+                    continue
+                record = dict(zip(self._header, row))
+                if len(row) > len(self._header):
+                    record[None] = row[len(self._header):]
+                records.append(record)
+        except csv.Error as e:
+            raise BulkFormatError(f"Invalid CSV: {e}") from None
+        return records
+
+
+def make_decoder(content_type):
+    if is_csv(content_type):
+        return CSVDecoder()
+    return NDJSONDecoder() if is_ndjson(content_type) else JSONArrayDecoder()
+
+
+def iter_records(file, content_type):
+    # aiter_records for a file opened in binary mode, read a block at a time
+    decoder = make_decoder(content_type)
+    text = codecs.getincrementaldecoder("utf-8")()
+    while chunk := file.read(READ_SIZE):
+        yield from decoder.feed(text.decode(chunk))
+    yield from decoder.feed(text.decode(b"", final=True)) + decoder.close()
+
+
+async def aiter_records(request):
+    # Yields decoded records from a streamed JSON array, NDJSON or CSV request body
+    decoder = make_decoder(request.headers.get("content-type"))
+    # Incremental, so a multi-byte character split across chunks still decodes
+    text = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in request.stream():
+        for record in decoder.feed(text.decode(chunk)):
+            yield record
+    for record in decoder.feed(text.decode(b"", final=True)) + decoder.close():
+        yield record
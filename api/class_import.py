@@ -0,0 +1,95 @@
+from pydantic import BaseModel, ValidationError
+
+from bulk_io import format_validation_error
+
+# Sections upserted per transaction
+CHUNK_SIZE = 500
+
+# Rejected rows reported in full, the rest are only counted
+MAX_REPORTED_REJECTIONS = 1000
+
+
+class Class(BaseModel):
+    # One section, as the registrar adds it
+    class_code: str
+    section_number: str
+    class_name: str
+    department: str
+    auto_enrollment: bool
+    max_enrollment: int
+    max_waitlist: int
+    c_instructor_username: str
+
+
+class ClassImport:
+    # Validates a stream of class records and hands them back a chunk at a time to upsert.
+    # Only the current chunk and the first rejections are kept, so memory doesn't grow with
+    # the size of the import.
+
+    def __init__(self, model, instructors, chunk_size=CHUNK_SIZE, max_reported=MAX_REPORTED_REJECTIONS):
+        self.model = model
+        self.instructors = instructors
+        self.chunk_size = chunk_size
+        self.max_reported = max_reported
+
+        self.chunk = {}
+        self.records = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.rejections = []
+
+    def add(self, record):
+        # Returns a full chunk to upsert, or None
+        index = self.records
+        self.records += 1
+
+        if isinstance(record, dict) and None in record:
+            self._reject(index, record, "Row has more fields than the header.")
+            return None
+        try:
+            new_class = self.model.model_validate(record)
+        except ValidationError as e:
+            self._reject(index, record, format_validation_error(e))
+            return None
+        if new_class.c_instructor_username not in self.instructors:
+            self._reject(index, record, "Instructor does not exist.")
+            return None
+
+        # A section repeated within a chunk is written once, with its last row
+        self.chunk[(new_class.class_code, new_class.section_number)] = dict(new_class)
+        if len(self.chunk) >= self.chunk_size:
+            return self.take()
+        return None
+
+    def take(self):
+        # The sections not yet handed back, possibly none
+        chunk, self.chunk = list(self.chunk.values()), {}
+        return chunk
+
+    def upserted(self, counts):
+        inserted, updated = counts
+        self.inserted += inserted
+        self.updated += updated
+
+    def _reject(self, index, record, detail):
+        self.rejected += 1
+        if len(self.rejections) < self.max_reported:
+            section = record if isinstance(record, dict) else {}
+            self.rejections.append({
+                "index": index,
+                "class_code": section.get("class_code"),
+                "section_number": section.get("section_number"),
+                "detail": detail,
+            })
+
+    def report(self, dry_run):
+        return {
+            "dry_run": dry_run,
+            "records": self.records,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "rejections": self.rejections,
+            "rejections_truncated": self.rejected > len(self.rejections),
+        }
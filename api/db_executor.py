@@ -0,0 +1,163 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+
+from db_pool import DEFAULT_PRAGMAS, connect
+
+
+class DatabaseQueueFull(Exception):
+    pass
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+def _settle(future, result, error):
+    # Runs on the event loop. The caller may have given up on the future already.
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+class _Job:
+    def __init__(self, loop, func, args):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.func = func
+        self.args = args
+        # Run in the caller's context, so per-request state follows the job onto the worker
+        self.context = contextvars.copy_context()
+        self.queued_at = time.perf_counter()
+
+        # The connection the job is running on, so a timeout can interrupt it
+        self.db = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.db is not None:
+                self.db.interrupt()
+
+
+class DatabaseExecutor:
+    # A fixed set of threads, each owning one connection, fed from a bounded queue. Callers
+    # await their results on the event loop, so a slow query or a busy wait holds one of these
+    # threads and never a request.
+    def __init__(self, path, threads=8, max_queue=1024, timeout=5.0, pragmas=None, cached_statements=256):
+        self.path = path
+        self.threads = threads
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # Waiting for the write lock longer than the caller waits for the result is wasted work
+        self.pragmas = {**DEFAULT_PRAGMAS, "busy_timeout": int(timeout * 1000)} if pragmas is None else pragmas
+        self.cached_statements = cached_statements
+
+        self._jobs = queue.Queue(max_queue)
+        self._workers = []
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.run_time = 0.0
+
+    def _start(self):
+        # Threads are started on first use, in the worker process that uses them
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.threads):
+                worker = threading.Thread(target=self._work, name=f"db-executor-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        db = connect(self.path, self.pragmas, self.cached_statements)
+        while (job := self._jobs.get()) is not None:
+            with job.lock:
+                if job.cancelled:
+                    continue
+                job.db = db
+
+            start = time.perf_counter()
+            result, error = None, None
+            try:
+                result = job.context.run(job.func, db, *job.args)
+            except BaseException as e:
+                error = e
+            finally:
+                with job.lock:
+                    job.db = None
+                # Never start the next job inside this one's transaction
+                if db.in_transaction:
+                    db.rollback()
+
+            end = time.perf_counter()
+            with self._lock:
+                self.completed += 1
+                self.queue_time += start - job.queued_at
+                self.max_queue_time = max(self.max_queue_time, start - job.queued_at)
+                self.run_time += end - start
+
+            try:
+                job.loop.call_soon_threadsafe(_settle, job.future, result, error)
+            except RuntimeError:
+                # The event loop is gone, nobody is waiting
+                pass
+        db.close()
+
+    async def run(self, func, *args):
+        # func(db, *args) runs on one of the executor's connections and must return plain
+        # values, not a cursor or generator still reading from it. The timeout covers time
+        # spent queued as well as running.
+        self._start()
+        job = _Job(asyncio.get_running_loop(), func, args)
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise DatabaseQueueFull() from None
+
+        try:
+            return await asyncio.wait_for(job.future, self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise QueryTimeout() from None
+        finally:
+            # Timed out, or the client went away: drop the job if it is still queued,
+            # abort its statement if it is running
+            if job.future.cancelled():
+                job.cancel()
+
+    def shutdown(self):
+        for _ in self._workers:
+            self._jobs.put(None)
+        self._workers = []
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "threads": self.threads,
+            "max_queue": self.max_queue,
+            "queued": self._jobs.qsize(),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_queue_time": round(self.queue_time / self.completed, 6) if self.completed else 0.0,
+            "max_queue_time": round(self.max_queue_time, 6),
+            "avg_run_time": round(self.run_time / self.completed, 6) if self.completed else 0.0,
+        }
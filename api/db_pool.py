@@ -0,0 +1,149 @@
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+import sql_timing
+
+# PRAGMAs applied once, when a pooled connection is first opened
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connect(path, pragmas=DEFAULT_PRAGMAS, cached_statements=256):
+    # Connections are checked out by one thread and may be released by another
+    start = time.perf_counter()
+    db = sqlite3.connect(
+        path, check_same_thread=False, cached_statements=cached_statements, factory=sql_timing.connection_factory()
+    )
+    db.row_factory = sqlite3.Row
+    for name, value in pragmas.items():
+        db.execute(f"PRAGMA {name}={value}")
+    sql_timing.connection_opened(db, path)
+    metrics.connection_opened(db, path, time.perf_counter() - start)
+    return db
+
+
+class ConnectionPool:
+    def __init__(self, path, size=8, pragmas=None, timeout=5.0, cached_statements=256):
+        self.path = path
+        self.size = size
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+
+        # LIFO so the most recently used (warmest) connection is handed out first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        return connect(self.path, self.pragmas, self.cached_statements)
+
+    def acquire(self):
+        try:
+            db = self._idle.get_nowait()
+            self.hits += 1
+            return db
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+
+        if create:
+            self.misses += 1
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool exhausted, wait for another request to give a connection back
+        self.waits += 1
+        start = time.perf_counter()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self.timeouts += 1
+            raise PoolTimeout(f"No connection to {self.path} available after {self.timeout}s")
+        finally:
+            self.wait_time += time.perf_counter() - start
+
+    def release(self, db):
+        try:
+            # Never hand out a connection with a transaction left open
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            db.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(db)
+
+    @contextlib.contextmanager
+    def connection(self):
+        db = self.acquire()
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "size": self.size,
+            "open": self._created,
+            "idle": self._idle.qsize(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "wait_time": round(self.wait_time, 6),
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path, **kwargs):
+    # One pool per database path, created lazily in each worker process. Every caller must
+    # ask for it with the same options, a pool is never silently reused with other ones.
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = ConnectionPool(path, **kwargs)
+                pool.options = kwargs
+                _pools[path] = pool
+    if pool.options != kwargs:
+        raise ValueError(f"The pool for {path} was created with {pool.options}, not {kwargs}")
+    return pool
+
+
+def pool_stats():
+    return [pool.stats() for pool in list(_pools.values())]
@@ -1,32 +1,66 @@
-from collections import OrderedDict
+import itertools
+import logging
+from typing import Literal
 
-import contextlib
-import logging.config
-import sqlite3
-import datetime
-
-from fastapi import FastAPI, Depends, Request, HTTPException, status
+from fastapi import FastAPI, Query, Request, HTTPException, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from pydantic_settings import BaseSettings
-
-class Class(BaseModel):
+from starlette.concurrency import run_in_threadpool
+
+import enrollment_engine
+import log_pipeline
+import metrics
+from bulk_io import BulkFormatError, aiter_records
+from class_import import Class, ClassImport
+from db_executor import DatabaseExecutor, DatabaseQueueFull, QueryTimeout
+from db_pool import PoolTimeout, connect, get_pool, pool_stats
+from enrollment_engine import DatabaseBusy
+from enrollment_repository import instructor_exists, instructor_usernames, student, student_names
+from enrollment_settings import Settings
+from pagination import InvalidCursor, decode_cursor, page
+from response_cache import ResponseCache
+from slow_queries import slow_query_log
+from row_json import RowShape, dumps
+from waitlist_events import WaitlistNotifier
+from waitlist_store import WAITLIST_FULL, WAITLIST_LIMIT
+from write_coalescer import WriteCoalescer
+
+class Section(BaseModel):
     class_code: str
     section_number: str
-    class_name: str
-    department: str
-    auto_enrollment: bool
-    max_enrollment: int
-    max_waitlist: int
-    c_instructor_username: str
-
-class Settings(BaseSettings, env_file=".env", extra="ignore"):
-    enrollment_database: str
-    enrollment_logging_config: str
-
-def get_db():
-    with contextlib.closing(sqlite3.connect(settings.enrollment_database)) as db:
-        db.row_factory = sqlite3.Row
-        yield db
+
+class BatchEnrollment(BaseModel):
+    sections: list[Section]
+    mode: Literal["best_effort", "all_or_nothing"] = "best_effort"
+
+# Rows in a list endpoint's page when the client doesn't ask for a size, and the most it may ask for
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Most sections one batch enrollment may name
+MAX_BATCH_SECTIONS = 50
+NDJSON = "application/x-ndjson"
+
+# Rows read per executor job while streaming NDJSON
+STREAM_CHUNK = 500
+
+# What each list endpoint returns per row, in order
+CLASS = RowShape(
+    "class_code", "section_number", "class_name", "department",
+    "auto_enrollment", "max_enrollment", "max_waitlist", "c_instructor_username",
+)
+AVAILABLE_CLASS = RowShape("class_code", "section_number", "class_name", "i_first_name", "i_last_name")
+ENROLLMENT = RowShape("e_student_username", "e_class_code", "e_section_number")
+WAITLIST = RowShape("w_student_username", "w_class_code", "w_section_number", "timestamp")
+ROSTER = RowShape("student_username", "s_first_name", "s_last_name", "class_code", "section_number", "class_name")
+DROPPED = RowShape("student_username", "s_first_name", "s_last_name", "class_code", "section_number")
+SECTION_WAITLIST = RowShape("student_username", "s_first_name", "s_last_name", "class_code", "section_number", "timestamp")
+
+def enrollment_pool():
+    return get_pool(
+        settings.enrollment_database,
+        size=settings.enrollment_db_pool_size,
+        timeout=settings.enrollment_db_pool_timeout,
+    )
 
 def get_logger():
     return logging.getLogger(__name__)
@@ -34,10 +68,232 @@ def get_logger():
 settings = Settings()
 app = FastAPI()
 
-logging.config.fileConfig(settings.enrollment_logging_config, disable_existing_loggers=False)
+# Prometheus text on /metrics, per worker. Off, requests and connections aren't instrumented at all.
+if settings.enrollment_metrics:
+    metrics.enable(app)
+
+# Every request gets an ID, set on the records logged while handling it and returned as X-Request-ID
+app.add_middleware(log_pipeline.RequestIdMiddleware)
+
+# Statements slower than this go to the slow_queries logger, with their plan. 0 turns it off.
+if settings.enrollment_slow_query_ms > 0:
+    slow_query_log.watch(settings.enrollment_database, settings.enrollment_slow_query_ms / 1000)
+
+waitlist = settings.waitlist_store()
+repository = settings.repository()
+
+# The SQLite waitlist reads its counts from the Class table, which DynamoDB replaces
+if settings.enrollment_repository_backend != "sqlite" and settings.enrollment_waitlist_backend == "sqlite":
+    raise RuntimeError("The dynamodb enrollment backend needs ENROLLMENT_WAITLIST_BACKEND=redis")
+
+# Where handlers run their database work: pooled connections on the shared request threadpool,
+# or a dedicated set of connection-owning threads with a bounded queue and a per-query timeout
+if settings.enrollment_db_mode == "threadpool":
+    executor = None
+elif settings.enrollment_db_mode == "executor":
+    executor = DatabaseExecutor(
+        settings.enrollment_database,
+        threads=settings.enrollment_db_executor_threads,
+        max_queue=settings.enrollment_db_executor_queue,
+        timeout=settings.enrollment_db_query_timeout,
+    )
+else:
+    raise RuntimeError(f"Unknown ENROLLMENT_DB_MODE: {settings.enrollment_db_mode}")
+
+# Enrolls, drops and waitlist changes from every request go to one writer thread, which commits
+# them in batches: one commit per window or per max_batch writes instead of one per request
+if settings.enrollment_group_commit:
+    # Each write rolls back alone through a savepoint, which Redis and DynamoDB writes don't follow
+    if settings.enrollment_repository_backend != "sqlite" or settings.enrollment_waitlist_backend != "sqlite":
+        raise RuntimeError("ENROLLMENT_GROUP_COMMIT needs the sqlite enrollment and waitlist backends")
+    coalescer = WriteCoalescer(
+        settings.enrollment_database,
+        window=settings.enrollment_group_commit_window,
+        max_batch=settings.enrollment_group_commit_max_batch,
+        max_queue=settings.enrollment_group_commit_queue,
+        timeout=settings.enrollment_db_query_timeout,
+    )
+else:
+    coalescer = None
+
+# Pushes waitlist changes made by any worker to the event streams open on this one
+notifier = WaitlistNotifier(
+    waitlist,
+    repository,
+    lambda: connect(settings.enrollment_database),
+    poll_interval=settings.enrollment_events_poll_interval,
+)
+
+# Catalog responses, valid for as long as the shared catalog version doesn't change
+catalog_cache = ResponseCache(settings.enrollment_response_cache_size)
+
+# Handlers from the .ini write on a listener thread, requests only queue their records, and
+# drop them when the queue is full. DEBUG records are kept for this share of requests.
+log_pipeline.configure(
+    settings.enrollment_logging_config,
+    debug_sample_rate=settings.enrollment_log_debug_sample_rate,
+    queue_size=settings.enrollment_log_queue_size,
+)
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    if executor is not None:
+        executor.shutdown()
+    if coalescer is not None:
+        coalescer.shutdown()
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": "Database busy, try again."}
+    )
+
+@app.exception_handler(InvalidCursor)
+def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST, content={"detail": "Invalid cursor."}
+    )
+
+@app.exception_handler(DatabaseBusy)
+@app.exception_handler(DatabaseQueueFull)
+@app.exception_handler(QueryTimeout)
+def database_busy_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Database busy, try again."},
+        headers={"Retry-After": "1"},
+    )
+
+# HTTP errors for the enrollment engine's failure outcomes
+OUTCOME_ERRORS = {
+    enrollment_engine.SECTION_NOT_FOUND: (status.HTTP_404_NOT_FOUND, "Section does not exist."),
+    enrollment_engine.ALREADY_ENROLLED: (status.HTTP_409_CONFLICT, "Student already enrolled"),
+    enrollment_engine.ALREADY_WAITLISTED: (status.HTTP_409_CONFLICT, "Student already on waitlist"),
+    WAITLIST_FULL: (status.HTTP_409_CONFLICT, "Class enrollment full and waitlist full"),
+    WAITLIST_LIMIT: (status.HTTP_409_CONFLICT, "Class enrollment full and student has exceeded their max number of waitlisted classes"),
+    enrollment_engine.NOT_ENROLLED: (status.HTTP_404_NOT_FOUND, "Student is not enrolled."),
+    enrollment_engine.NOT_WAITLISTED: (status.HTTP_404_NOT_FOUND, "Student not on waitlist."),
+}
+
+# What a batch enrollment reports for each section
+BATCH_DETAILS = {
+    enrollment_engine.ENROLLED: "Student successfully enrolled in class",
+    enrollment_engine.WAITLISTED: "Class enrollment full, Student added to waitlist",
+    enrollment_engine.NOT_ATTEMPTED: "Not attempted, an earlier section could not be enrolled",
+    **{outcome: detail for outcome, (_, detail) in OUTCOME_ERRORS.items()},
+}
+
+def raise_for_outcome(outcome):
+    status_code, detail = OUTCOME_ERRORS[outcome]
+    raise HTTPException(status_code=status_code, detail=detail)
+
+def run_pooled(func, *args):
+    with enrollment_pool().connection() as db:
+        return func(db, *args)
+
+async def run_db(func, *args):
+    # func(db, *args) does all of a step's database work and returns plain values
+    if executor is not None:
+        return await executor.run(func, *args)
+    return await run_in_threadpool(run_pooled, func, *args)
+
+async def run_write(func, *args):
+    # A write made in one run_transaction, committed on its own or in a group commit batch
+    if coalescer is not None:
+        return await coalescer.run(func, *args)
+    return await run_db(func, *args)
+
+def wants_ndjson(request):
+    return NDJSON in request.headers.get("accept", "")
+
+def ndjson_chunk(db, shape, columns, rows_for, after, size):
+    rows = list(rows_for(db, after, size))
+    last = tuple(rows[-1][column] for column in columns) if rows else None
+    return b"".join(dumps(row) + b"\n" for row in shape.dicts(rows)), last, len(rows)
+
+def stream_ndjson(shape, columns, rows_for, after, limit):
+    if executor is None:
+        # One line per row as the cursor yields it, on a pooled connection held until the
+        # client has read the whole stream
+        def lines():
+            with enrollment_pool().connection() as db:
+                for row in shape.dicts(rows_for(db, after, limit)):
+                    yield dumps(row) + b"\n"
+        return StreamingResponse(lines(), media_type=NDJSON)
+
+    # Executor threads are shared by every request, so a slow reader must not hold one. Each
+    # chunk is its own job and carries on from the last row's key, as the next page would.
+    async def chunks():
+        key, remaining = after, limit
+        while remaining is None or remaining > 0:
+            size = STREAM_CHUNK if remaining is None else min(STREAM_CHUNK, remaining)
+            body, key, count = await executor.run(ndjson_chunk, shape, columns, rows_for, key, size)
+            if body:
+                yield body
+            if count < size:
+                break
+            if remaining is not None:
+                remaining -= count
+    return StreamingResponse(chunks(), media_type=NDJSON)
+
+def list_body(db, name, shape, columns, rows_for, after, limit):
+    rows, next_cursor = page(rows_for(db, after, limit + 1), columns, limit)
+    return dumps({name: list(shape.dicts(rows)), "next": next_cursor})
+
+async def list_response(request, name, shape, columns, rows_for, limit, after):
+    # rows_for(db, after, limit) returns rows ordered by columns, after is the decoded cursor.
+    # A JSON response is one page, DEFAULT_PAGE_SIZE rows unless the client asks for another
+    # size. An NDJSON stream holds the rest of the list unless limited, it is never buffered.
+    # The body is encoded in one pass, rows never go through FastAPI's jsonable_encoder.
+    after = decode_cursor(after, len(columns)) if after else None
+    if wants_ndjson(request):
+        return stream_ndjson(shape, columns, rows_for, after, limit)
+    body = await run_db(list_body, name, shape, columns, rows_for, after, limit or DEFAULT_PAGE_SIZE)
+    return Response(body, media_type="application/json")
+
+def etag_matches(request, etag):
+    # If-None-Match uses the weak comparison, so W/"1" matches "1"
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag.removeprefix("W/") for tag in tags]
+
+async def cached_catalog_response(request, build):
+    # Streams are never cached
+    if wants_ndjson(request):
+        return await build()
+
+    # The ETag is the catalog version, so a revalidation is answered before any catalog
+    # query runs or anything is serialized, even by a worker that never built the response
+    version = await run_db(repository.catalog_version)
+    etag = f'"{version}"'
+    if etag_matches(request, etag):
+        catalog_cache.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    key = (request.url.path, str(request.query_params))
+    body = catalog_cache.get(key, version)
+    if body is None:
+        body = (await build()).body
+        catalog_cache.put(key, version, body)
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+# Example: GET http://localhost:5000/stats
+@app.get("/stats")
+async def get_stats():
+    return {
+        "pools": pool_stats(),
+        "executor": executor.stats() if executor is not None else None,
+        "group_commit": coalescer.stats() if coalescer is not None else None,
+        "waitlist_events": notifier.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "slow_queries": slow_query_log.stats(),
+        "logging": log_pipeline.stats(),
+    }
 
 @app.get("/enrollment_test")
-def enrollment_api_test(db: sqlite3.Connection = Depends(get_db)):
+async def enrollment_api_test():
     return {"Test" : "success"}
 
 
@@ -45,49 +301,40 @@ def enrollment_api_test(db: sqlite3.Connection = Depends(get_db)):
 
 # Example: GET http://localhost:5000/all_classes
 @app.get("/all_classes")
-def get_available_classes(db: sqlite3.Connection = Depends(get_db)):
-    classes = db.execute("""
-                SELECT *
-                FROM Class
-            """)    
-    return {"classes": classes.fetchall()}
+async def get_available_classes(request: Request, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE), after: str | None = None):
+    return await cached_catalog_response(request, lambda: list_response(
+        request, "classes", CLASS, ("class_code", "section_number"), repository.all_classes, limit, after
+    ))
 
 # Example: GET http://localhost:5000/student_details/SamDoe123
 @app.get("/student_details/{student_username}")
-def get_student_details(student_username: str, db: sqlite3.Connection = Depends(get_db)):
+async def get_student_details(student_username: str):
 
     # Get student details
-    student_details = db.execute("""
-        SELECT *
-        FROM Student
-        WHERE student_username=?
-    """, (student_username,)).fetchall()[0]
+    student_details = await run_db(student, student_username)
+    if student_details is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student does not exist.")
 
     return {"student": student_details}
 
 # Example: GET http://localhost:5000/student_enrollment/SamDoe123
 @app.get("/student_enrollment/{student_username}")
-def get_student_enrollment(student_username: str, db: sqlite3.Connection = Depends(get_db)):
+async def get_student_enrollment(student_username: str, request: Request, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE), after: str | None = None):
 
-    # Get student details
-    student_enrollment = db.execute("""
-        SELECT *
-        FROM Enroll
-        WHERE e_student_username=?
-    """, (student_username,)).fetchall()
-
-    return {"enrollment": student_enrollment}
+    return await list_response(
+        request, "enrollment", ENROLLMENT, ("e_class_code", "e_section_number"),
+        lambda db, after, limit: repository.student_enrollment(db, student_username, after, limit),
+        limit, after,
+    )
 
+# Example: GET http://localhost:5000/waitlist?limit=100
 @app.get("/waitlist")
-def get_waitlist(db: sqlite3.Connection = Depends(get_db)):
+async def get_waitlist(request: Request, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE), after: str | None = None):
 
-    # Check to see if student on waitlist
-    waitlist = db.execute("""
-                SELECT *
-                FROM Waitlist
-            """).fetchall()
-    
-    return {"waitlist": waitlist}
+    return await list_response(
+        request, "waitlist", WAITLIST, ("w_class_code", "w_section_number", "timestamp", "w_student_username"),
+        waitlist.all_entries, limit, after,
+    )
 
 
 # ---------------------- Tasks -----------------------------
@@ -95,310 +342,119 @@ def get_waitlist(db: sqlite3.Connection = Depends(get_db)):
 # Task 1: Student can list all available classes
 # Example: GET http://localhost:5000/student/available_classes
 @app.get("/student/available_classes")
-def student_get_available_classes(db: sqlite3.Connection = Depends(get_db)):    
-    classes = db.execute("""
-                SELECT class_code, section_number, class_name, i_first_name, i_last_name
-                FROM Class, Instructor
-                WHERE (
-                    SELECT Count(*)
-                    FROM Enroll
-                    WHERE class_code = e_class_code
-                    AND section_number = e_section_number
-                ) < max_enrollment
-                AND c_instructor_username = instructor_username
-            """)    
-    return {"classes": classes.fetchall()}
+async def student_get_available_classes(request: Request, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE), after: str | None = None):    
+    return await cached_catalog_response(request, lambda: list_response(
+        request, "classes", AVAILABLE_CLASS, ("class_code", "section_number"), repository.available_classes, limit, after
+    ))
 
 # Task 2: Student can attempt to enroll in a class
 # Example: POST http://localhost:5000/student/enroll_in_class/student/SamDoe123/class/CHEM101/section/01
 @app.post("/student/enroll_in_class/student/{student_username}/class/{class_code}/section/{section_number}")
-def student_enroll_self_in_class(student_username: str, class_code:str, section_number:str, db: sqlite3.Connection = Depends(get_db)):
-    # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-    
-    if not section_exists:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Section does not exist."
-        )   
-        
-    # Check to see if student already enrolled
-    student_is_enrolled = db.execute("""
-        SELECT *
-        FROM Enroll
-        WHERE e_student_username=? 
-        AND e_class_code=? 
-        AND e_section_number=?
-    """, (student_username, class_code, section_number)).fetchall()
-
-    if student_is_enrolled:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT, detail="Student already enrolled"
-        )
-    
-    # Check to see if student already on waitlist
-    student_on_waitlist = db.execute("""
-        SELECT *
-        FROM Waitlist
-        Where w_student_username=?
-        AND w_class_code=?
-        AND w_section_number=?
-    """, (student_username, class_code, section_number)).fetchall()
-
-    if student_on_waitlist:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT, detail="Student already on waitlist"
-        )
-
-    # Get number of students enrolled in the class
-    num_enrollments = db.execute("""
-        SELECT COUNT(*) as num_enrollments
-        FROM Enroll
-        WHERE e_class_code=?
-        AND e_section_number=?
-    """, (class_code, section_number)).fetchall()[0]
-
-    # Get class max information
-    class_details = db.execute("""
-        SELECT max_enrollment, max_waitlist
-        FROM Class
-        WHERE class_code=?
-        AND section_number=?
-    """, (class_code, section_number)).fetchall()[0]
-    
-    # If the classes is not full then enroll the student into the class
-    if num_enrollments["num_enrollments"] < class_details['max_enrollment']:
-        # Enroll the student into the class
-        db.execute("""
-            INSERT INTO Enroll (e_student_username, e_class_code, e_section_number)
-            VALUES (?, ?, ?)
-        """, (student_username, class_code, section_number))
-
-        # Remove them from the drop list if they previously dropped the class
-        db.execute("""
-            DELETE 
-            FROM Dropped
-            Where d_student_username=?
-            AND d_class_code=?
-            AND d_section_number=?
-        """, (student_username, class_code, section_number))
-
-        # Commit the changes
-        db.commit()
+async def student_enroll_self_in_class(student_username: str, class_code:str, section_number:str):
+    # The whole enroll-or-waitlist decision runs in one write transaction, or one savepoint of a
+    # group commit batch
+    outcome = await run_write(repository.enroll, waitlist, student_username, class_code, section_number)
 
+    if outcome == enrollment_engine.ENROLLED:
         return {"detail": "Student successfully enrolled in class"}
+    if outcome == enrollment_engine.WAITLISTED:
+        return {"detail": "Class enrollment full, Student added to waitlist"}
+    raise_for_outcome(outcome)
 
-    else:
+# Student can enroll in several sections in one request. best_effort applies every section it
+# can, all_or_nothing applies none of them unless all succeed (enrolled or waitlisted).
+# Example: POST http://localhost:5000/student/enroll_in_classes/student/SamDoe123
+# body: {
+#     "sections": [
+#         {"class_code": "CPSC449", "section_number": "01"},
+#         {"class_code": "MATH101", "section_number": "02"}
+#     ],
+#     "mode": "all_or_nothing"
+# }
+@app.post("/student/enroll_in_classes/student/{student_username}")
+async def student_enroll_self_in_classes(student_username: str, batch: BatchEnrollment):
 
-        # Get number of students on waitlist for the class
-        num_waitlist = db.execute("""
-            SELECT COUNT(*) as num_waitlist
-            FROM Waitlist
-            WHERE w_class_code=?
-            AND w_section_number=?
-        """, (class_code, section_number)).fetchall()[0]
-
-        # If the waitlist is also full
-        if num_waitlist["num_waitlist"] >= class_details['max_waitlist']:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT, detail="Class enrollment full and waitlist full"
-            )
-
-
-        # Enroll the student into the class
-        db.execute("""
-            INSERT INTO Enroll (e_student_username, e_class_code, e_section_number)
-            VALUES (?, ?, ?)
-        """, (student_username, class_code, section_number))
-
-        # Get number of classes a student is waitlisted for
-        num_student_waitlists = db.execute("""
-            SELECT COUNT(*) as num_waitlist
-            FROM Waitlist
-            WHERE w_student_username=?
-        """, (student_username,)).fetchall()[0]
-    
-        # Student reached the max number of classes they can be waitlisted for
-        if num_student_waitlists['num_waitlist'] >= 3:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT, detail="Class enrollment full and student has exceeded their max number of waitlisted classes"
-            )   
-        
-        # Add student to the waitlist
-        currentDateTime = datetime.datetime.now()
-        db.execute("""
-            INSERT INTO Waitlist (w_student_username, w_class_code, w_section_number, timestamp)
-            VALUES (?, ?, ?, ?);
-        """, (student_username, class_code, section_number, currentDateTime))
-
-        # Remove them from the drop list if they previously dropped the class
-        db.execute("""
-            DELETE 
-            FROM Dropped
-            Where d_student_username=?
-            AND d_class_code=?
-            AND d_section_number=?
-        """, (student_username, class_code, section_number))
-
-        # Commit the changes
-        db.commit()
+    sections = [(section.class_code, section.section_number) for section in batch.sections]
+    if not sections or len(sections) > MAX_BATCH_SECTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Between 1 and {MAX_BATCH_SECTIONS} sections required."
+        )
+    if len(set(sections)) != len(sections):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate section in request."
+        )
 
-        return {"detail": "Class enrollment full, Student added to waitlist"}
+    all_or_nothing = batch.mode == "all_or_nothing"
+    results = await run_write(repository.enroll_many, waitlist, student_username, sections, all_or_nothing)
+
+    applied = not all_or_nothing or all(
+        outcome in (enrollment_engine.ENROLLED, enrollment_engine.WAITLISTED) for _, _, outcome in results
+    )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if applied else status.HTTP_409_CONFLICT,
+        content={
+            "mode": batch.mode,
+            "applied": applied,
+            "results": [
+                {
+                    "class_code": class_code,
+                    "section_number": section_number,
+                    "outcome": outcome,
+                    "detail": BATCH_DETAILS[outcome],
+                }
+                for class_code, section_number, outcome in results
+            ],
+        },
+    )
 
 # Task 3: Student can drop a class
 # Example: DELETE http://localhost:5000/student/drop_class/student/SamDoe123/class/MATH101/section/01
 @app.delete("/student/drop_class/student/{student_username}/class/{class_code}/section/{section_number}")
-def student_drop_self_from_class(student_username: str, class_code:str, section_number:str, db: sqlite3.Connection = Depends(get_db)):
+async def student_drop_self_from_class(student_username: str, class_code:str, section_number:str):
 
-    # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-    
-    if not section_exists:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Section does not exist."
-        )   
-
-    # Check to see if student already enrolled
-    student_is_enrolled = db.execute("""
-        SELECT *
-        FROM Enroll
-        WHERE e_student_username=? 
-        AND e_class_code=? 
-        AND e_section_number=?
-    """, (student_username, class_code, section_number)).fetchall()
-
-    # If they are enrolled, unroll them
-    if student_is_enrolled:
-        db.execute("""
-        DELETE 
-        FROM Enroll 
-        Where e_student_username=?
-        AND e_class_code=?
-        AND e_section_number=?
-        """, (student_username, class_code, section_number))
-
-        # Add them to drop list
-        db.execute("""
-        INSERT INTO Dropped (d_student_username, d_class_code, d_section_number)
-        VALUES(?, ?, ?);
-        """, (student_username, class_code, section_number))
-
-        # Commit the changes
-        db.commit()
+    outcome = await run_write(repository.drop, waitlist, student_username, class_code, section_number)
 
+    if outcome == enrollment_engine.DROPPED:
         return {"detail": "Class successfully dropped."}
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled."
-        )   
+    raise_for_outcome(outcome)
 
     
 # Task 4: Instructor can view current enrollment for their classes
 # Example: GET http://localhost:5000/instructor/enrollment/instructor/100
 @app.get("/instructor/enrollment/instructor/{instructor_username}")
-def instructor_get_enrollment_for_classes(instructor_username: str, db: sqlite3.Connection = Depends(get_db)):
-    enrollment = db.execute("""
-        SELECT student_username, s_first_name, s_last_name, class_code, section_number, class_name
-        FROM Instructor, Class, Enroll, Student
-        WHERE Instructor.instructor_username=?
-        AND Instructor.instructor_username=Class.c_instructor_username
-        AND  Class.class_code=Enroll.e_class_code
-        AND Class.section_number=Enroll.e_section_number
-        AND Enroll.e_student_username=student_username
-        """, (instructor_username,)).fetchall()
-    
-    return {"enrollment": enrollment}
+async def instructor_get_enrollment_for_classes(instructor_username: str, request: Request, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE), after: str | None = None):
+    return await list_response(
+        request, "enrollment", ROSTER, ("class_code", "section_number", "student_username"),
+        lambda db, after, limit: repository.instructor_enrollment(db, instructor_username, after, limit),
+        limit, after,
+    )
 
 # Task 5: Instructor can view students who have dropped the class
 # Example: GET http://localhost:5000/instructor/dropped/instructor/100/class/CPSC449/section/01
 @app.get("/instructor/dropped/instructor/{instructor_username}/class/{class_code}/section/{section_number}")
-def instructor_get_students_that_dropped_class(instructor_username: str,  class_code:str, section_number:str, db: sqlite3.Connection = Depends(get_db)):
+async def instructor_get_students_that_dropped_class(instructor_username: str,  class_code:str, section_number:str, request: Request, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE), after: str | None = None):
     # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-    
-    if not section_exists:
+    if not await run_db(repository.section_exists, class_code, section_number):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Section does not exist."
         )   
     
-    dropped = db.execute("""
-        SELECT student_username, s_first_name, s_last_name, class_code, section_number
-        FROM Instructor, Class, Dropped, Student
-        WHERE Instructor.instructor_username=?
-        AND Class.class_code=?
-        AND Class.section_number=?
-        AND Instructor.instructor_username=Class.c_instructor_username
-        AND  Class.class_code=Dropped.d_class_code
-        AND Class.section_number=Dropped.d_section_number
-        AND Dropped.d_student_username=student_username
-        """, (instructor_username, class_code, section_number)).fetchall()
-    
-    return {"dropped": dropped}
+    return await list_response(
+        request, "dropped", DROPPED, ("student_username",),
+        lambda db, after, limit: repository.dropped(db, instructor_username, class_code, section_number, after, limit),
+        limit, after,
+    )
 
 # Task 6: Instructor can drop students administratively (e.g. if they do not show up to class)
 # Example: DELETE http://localhost:5000/instructor/drop_student/student/11111111/class/CPSC449/section/01
 @app.delete("/instructor/drop_student/student/{student_username}/class/{class_code}/section/{section_number}")
-def instructor_drop_student_from_class(student_username: str, class_code:str, section_number:str, db: sqlite3.Connection = Depends(get_db)):
-    # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-    
-    if not section_exists:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Section does not exist."
-        )   
-
-    # Check to see if student already enrolled
-    student_is_enrolled = db.execute("""
-        SELECT *
-        FROM Enroll
-        WHERE e_student_username=? 
-        AND e_class_code=? 
-        AND e_section_number=?
-    """, (student_username, class_code, section_number)).fetchall()
-
-    # If they are enrolled, unroll them
-    if student_is_enrolled:
-        db.execute("""
-        DELETE 
-        FROM Enroll 
-        Where e_student_username=?
-        AND e_class_code=?
-        AND e_section_number=?
-        """, (student_username, class_code, section_number))
-
-        # Add them to drop list
-        db.execute("""
-        INSERT INTO Dropped (d_student_username, d_class_code, d_section_number)
-        VALUES(?, ?, ?);
-        """, (student_username, class_code, section_number))
-
-        # Commit the changes
-        db.commit()
+async def instructor_drop_student_from_class(student_username: str, class_code:str, section_number:str):
+    outcome = await run_write(repository.drop, waitlist, student_username, class_code, section_number)
 
+    if outcome == enrollment_engine.DROPPED:
         return {"detail": "Student successfully dropped."}
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled."
-        )   
+    raise_for_outcome(outcome)
+
     
 # Task 7: Registrar can add new classes and sections
 # Example: POST http://localhost:5000/registrar/new_class
@@ -413,146 +469,86 @@ def instructor_drop_student_from_class(student_username: str, class_code:str, se
 #     "c_instructor_username": "100"
 # }
 @app.post("/registrar/new_class")
-def registrar_create_new_class(new_class: Class, request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def registrar_create_new_class(new_class: Class, request: Request):
 
     c = dict(new_class)
     
-    class_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=:class_code
-                AND section_number=:section_number
-            """, c).fetchall()
-    
-    if class_exists:
+    if not await run_db(repository.add_class, c):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Class already exists."
         )   
-
-    db.execute("""
-        INSERT INTO Class (class_code, section_number, class_name, department, auto_enrollment, max_enrollment, max_waitlist, c_instructor_username)
-        VALUES (:class_code, :section_number, :class_name, :department, :auto_enrollment, :max_enrollment, :max_waitlist, :c_instructor_username)
-        """, c)
-    
-    # Commit the changes
-    db.commit()
     
     return {"detail": "New class successfully added."}
 
 
+# Registrar can add or update many sections from one streamed CSV, NDJSON or JSON array body.
+# Rows are checked against the Class model and the existing instructors and written in
+# chunks, each in its own transaction, so a rejected row never holds back the others.
+# A section given more seats, or its auto enrollment back, fills them from its waitlist.
+# With dry_run=true nothing is written, the report says what would have been.
+# Example: POST http://localhost:5000/registrar/classes/bulk?dry_run=true
+# Content-Type: text/csv
+# body:
+# class_code,section_number,class_name,department,auto_enrollment,max_enrollment,max_waitlist,c_instructor_username
+# CPSC449,04,Database Systems,Computer Science,true,30,15,100
+@app.post("/registrar/classes/bulk")
+async def registrar_bulk_classes(request: Request, dry_run: bool = False):
+
+    importer = ClassImport(Class, await run_db(instructor_usernames))
+    try:
+        async for record in aiter_records(request):
+            if chunk := importer.add(record):
+                importer.upserted(await run_db(repository.upsert_classes, waitlist, chunk, dry_run))
+    except BulkFormatError as e:
+        # The chunks before the error are already written, say which
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(e), **importer.report(dry_run)}
+        )
+
+    if chunk := importer.take():
+        importer.upserted(await run_db(repository.upsert_classes, waitlist, chunk, dry_run))
+    return importer.report(dry_run)
+
+
 # Task 8: Registrar can remove existing sections
 # Example: DELETE http://localhost:5000/registrar/remove_class/code/CPSC449/section/04
 @app.delete("/registrar/remove_class/code/{class_code}/section/{section_number}")
-def registrar_remove_section(class_code: str, section_number: str, db: sqlite3.Connection = Depends(get_db)):
-    # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-    
-    if section_exists:
-        # Delete section
-        db.execute(""" 
-        DELETE FROM Class 
-        WHERE class_code=?
-        AND section_number=?
-        """, (class_code, section_number))
-
-        # Unenroll every student who was in that section
-        db.execute(""" 
-        DELETE FROM Enroll 
-        WHERE e_class_code=?
-        AND e_section_number=?
-        """, (class_code, section_number))
-
-        # Remove every student who was in that section from the waitlist
-        db.execute(""" 
-        DELETE FROM Waitlist
-        WHERE w_class_code=?
-        AND w_section_number=?
-        """, (class_code, section_number))
-
-        # Remove every student who was in that section from the droplist
-        db.execute(""" 
-        DELETE FROM Dropped
-        WHERE d_class_code=?
-        AND d_section_number=?
-        """, (class_code, section_number))
-
-        db.commit()
+async def registrar_remove_section(class_code: str, section_number: str):
+    outcome = await run_db(repository.remove_section, waitlist, class_code, section_number)
+
+    if outcome == enrollment_engine.SECTION_REMOVED:
         return {"detail": "Section successfully removed."}
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Section does not exist."
-        )   
+    raise_for_outcome(outcome)
     
 # Task 9: Registrar can change instructor for a section
 # Example: PATCH http://localhost:5000/registrar/change_instructor/class/CPSC449/section/01/new_instructor/101
 @app.patch("/registrar/change_instructor/class/{class_code}/section/{section_number}/new_instructor/{instructor_username}")
-def registrar_change_instructor_for_class(class_code: str, section_number: str, instructor_username: str, db: sqlite3.Connection = Depends(get_db)):
+async def registrar_change_instructor_for_class(class_code: str, section_number: str, instructor_username: str):
 
     # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-    
-    if not section_exists:
+    if not await run_db(repository.section_exists, class_code, section_number):
         raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, detail="Section does not exist."
                 )   
     
     # Check to see if instructor exists 
-    instructor_exists = db.execute("""
-                SELECT *
-                FROM Instructor
-                WHERE instructor_username=?
-            """, (instructor_username,)).fetchall()
-    
-    if not instructor_exists:
+    if not await run_db(instructor_exists, instructor_username):
         raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="Instructor does not exist."
                 )   
 
     # Change instructor for section
-    db.execute("""
-            UPDATE Class
-            SET c_instructor_username=?
-            WHERE class_code=?
-            AND section_number=?
-        """, (instructor_username, class_code, section_number))
-
-    db.commit()
+    await run_db(repository.set_instructor, class_code, section_number, instructor_username)
     return {"detail": "Instructor successfully changed"}
         
 
 # Task 10: Freeze automatic enrollment from waiting lists (e.g. during the second week of classes)
 # Example: PATCH http://localhost:5000/registrar/freeze_enrollment/class/CPSC449/section/01
 @app.patch("/registrar/freeze_enrollment/class/{class_code}/section/{section_number}")
-def registrar_freeze_enrollment_for_class(class_code: str, section_number: str, db: sqlite3.Connection = Depends(get_db)):
+async def registrar_freeze_enrollment_for_class(class_code: str, section_number: str):
 
-    # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-
-    if section_exists:
-        # Change class auto_enrollment to false
-        db.execute("""
-                UPDATE Class
-                SET auto_enrollment = FALSE
-                Where class_code=?
-                AND section_number=?
-            """, (class_code, section_number))
-    
-        db.commit()
+    # Change class auto_enrollment to false, if the section exists
+    if await run_db(repository.freeze_enrollment, class_code, section_number):
         return {"detail": "auto enrollment successfully frozen."}
     
     else:
@@ -561,135 +557,125 @@ def registrar_freeze_enrollment_for_class(class_code: str, section_number: str,
                 )   
     
     
+# Registrar can fill every open seat from the waitlists, after raising a section's capacity or
+# turning its auto enrollment back on. Drops fill their own seat.
+# Example: POST http://localhost:5000/registrar/promote_waitlists
+@app.post("/registrar/promote_waitlists")
+async def registrar_promote_waitlists():
+
+    promoted = await run_db(repository.promote_all, waitlist)
+    return {
+        "promoted": [
+            {"class_code": class_code, "section_number": section_number, "students": students}
+            for (class_code, section_number), students in promoted.items()
+        ]
+    }
+
 # Task 11: Student can view their current position on the waiting list
 # Example: GET http://localhost:5000/student/waitlist_position/student/ScottDavis123/class/ENGL205/section/01
 @app.get("/student/waitlist_position/student/{student_username}/class/{class_code}/section/{section_number}")
-def student_get_waitlist_position_for_class(student_username: str, class_code: str, section_number: str, db: sqlite3.Connection = Depends(get_db)):
+async def student_get_waitlist_position_for_class(student_username: str, class_code: str, section_number: str):
 
-    # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
-    
-    if not section_exists:
+    position = await run_db(waitlist.position, student_username, class_code, section_number)
+
+    if position:
+        # Return position on waitlist
+        return {"detail": f'You are number {position} on the waitlist'}
+
+    if not await run_db(repository.section_exists, class_code, section_number):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Section does not exist."
         )   
 
-    # Check to see if student on waitlist
-    student_on_waitlist = db.execute("""
-                SELECT *
-                FROM Waitlist
-                WHERE w_student_username=?
-                AND w_class_code=?
-                AND w_section_number=?
-            """, (student_username, class_code, section_number)).fetchall()
-    
-    
-    if student_on_waitlist:
-        # For all students on the wait list for the specified class, get their id and the time they joined the waitlist
-        class_waitlist = db.execute("""
-                SELECT w_student_username, timestamp
-                FROM Waitlist
-                WHERE w_class_code=?
-                AND w_section_number=?
-            """, (class_code, section_number)).fetchall()
-        
-        # Transform data so we can check the students position on the waitlist
-        waitlist = {}
-        for wait_list_item in class_waitlist:
-            waitlist_student_username = wait_list_item["w_student_username"]
-            waitlist_timestamp = wait_list_item["timestamp"]
-            waitlist[waitlist_student_username] = waitlist_timestamp
-        
-        # Return position on waitlist
-        return {"detail": f'You are number {get_position_on_waitlist(waitlist, student_username)} on the waitlist'}
-    
-    else:
-        raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="Student not on waitlist."
-                )   
+    raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Student not on waitlist."
+            )   
+
+# Student can view their position on every waitlist they are on
+# Example: GET http://localhost:5000/student/waitlist_positions/student/SamDoe123
+@app.get("/student/waitlist_positions/student/{student_username}")
+async def student_get_waitlist_positions(student_username: str):
+
+    return {"waitlists": await run_db(waitlist.positions, student_username)}
+
+# Student can follow their waitlists instead of polling their positions. Server-sent events:
+# "waitlists" with every position on connecting, then "position" when one changes, "promoted"
+# when they get a seat and "removed" when they leave a waitlist some other way.
+# Example: GET http://localhost:5000/student/waitlist_events/student/SamDoe123
+@app.get("/student/waitlist_events/student/{student_username}")
+async def student_get_waitlist_events(student_username: str):
 
-def get_position_on_waitlist(dict, student_username):
-    ordered_dict = OrderedDict({k: v for k, v in sorted(dict.items(), key=lambda item: item[1])})
-    return list(ordered_dict.keys()).index(student_username) + 1
+    subscription = notifier.subscribe(student_username)
+
+    async def events():
+        try:
+            while True:
+                events = await subscription.next_events(settings.enrollment_events_keepalive)
+                if not events:
+                    # Keeps proxies from closing an idle stream
+                    yield b": keepalive\n\n"
+                for name, data in events:
+                    yield b"event: " + name.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+        finally:
+            notifier.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 # Task 12: Student can remove themselves from a waiting list
 # Example: DELETE http://localhost:5000/student/remove_from_waitlist/student/11111111/class/ENGL205/section/01
 @app.delete("/student/remove_from_waitlist/student/{student_username}/class/{class_code}/section/{section_number}")
-def student_remove_self_from_class_waitlist(student_username: str, class_code: str, section_number: str, db: sqlite3.Connection = Depends(get_db)):
-
-    # Check to see if student on waitlist
-    student_on_waitlist = db.execute("""
-                SELECT *
-                FROM Waitlist
-                WHERE w_student_username=?
-                AND w_class_code=?
-                AND w_section_number=?
-            """, (student_username, class_code, section_number)).fetchall()
-
-    if student_on_waitlist:
-        # Remove student from waitlist
-        db.execute("""
-                DELETE FROM Waitlist
-                WHERE w_student_username=?
-                AND w_class_code=?
-                AND w_section_number=?
-            """, (student_username, class_code, section_number))
-    
-        db.commit()
+async def student_remove_self_from_class_waitlist(student_username: str, class_code: str, section_number: str):
+
+    outcome = await run_write(repository.leave_waitlist, waitlist, student_username, class_code, section_number)
+
+    if outcome == enrollment_engine.REMOVED_FROM_WAITLIST:
         return {"detail": "Successfully removed from waitlist"}
-    
-    else:
-        raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="Student not on waitlist."
-                )   
+    raise_for_outcome(outcome)
+
     
 
 # Task 13: Instructor can view the current waiting list for their course
 # Example: GET http://localhost:5000/instructor/waitlist_for_class/instructor/102/class/CHEM101/section/02
 @app.get("/instructor/waitlist_for_class/instructor/{instructor_username}/class/{class_code}/section/{section_number}")
-def instructor_get_waitlist_for_class(instructor_username: str, class_code: str, section_number: str, db: sqlite3.Connection = Depends(get_db)):
+async def instructor_get_waitlist_for_class(instructor_username: str, class_code: str, section_number: str, request: Request, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE), after: str | None = None):
 
     # Check to see if section exists 
-    section_exists = db.execute("""
-                SELECT *
-                FROM Class
-                WHERE class_code=?
-                AND section_number=?
-            """, (class_code, section_number)).fetchall()
+    section = await run_db(repository.section, class_code, section_number)
     
-    if not section_exists:
+    if not section:
         raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="Section does not exist."
                 )   
     
     # Check to see if section exists 
-    instructor_exists = db.execute("""
-                SELECT *
-                FROM Instructor
-                WHERE instructor_username=?
-            """, (instructor_username,)).fetchall()
-    
-    if not instructor_exists:
+    if not await run_db(instructor_exists, instructor_username):
         raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="Instructor does not exist."
                 )   
 
-    # Get all students on the waitlist
-    waitlist = db.execute("""
-                SELECT student_username, s_first_name, s_last_name, class_code, section_number, timestamp
-                FROM Instructor, Class, Waitlist, Student
-                WHERE Instructor.instructor_username=?
-                AND Class.class_code=?
-                AND Class.section_number=?
-                AND Instructor.instructor_username=Class.c_instructor_username
-                AND  Class.class_code=Waitlist.w_class_code
-                AND Class.section_number=Waitlist.w_section_number
-                AND Waitlist.w_student_username=student_username
-            """, (instructor_username, class_code, section_number)).fetchall()
-    
-    return {"waitlist": waitlist}
+    def rows_for(db, after, limit):
+        # Instructors only see the waitlists of their own sections, any other is an empty list
+        if section["c_instructor_username"] != instructor_username:
+            return []
+        return section_waitlist(db, class_code, section_number, after, limit)
+
+    return await list_response(
+        request, "waitlist", SECTION_WAITLIST, ("timestamp", "student_username"), rows_for, limit, after,
+    )
+
+def section_waitlist(db, class_code, section_number, after, limit):
+    # Waitlist entries in order, with the students' names looked up a batch at a time
+    entries = waitlist.entries(db, class_code, section_number, after, limit)
+    while batch := list(itertools.islice(entries, 500)):
+        names = student_names(db, [student_username for student_username, _ in batch])
+
+        for student_username, timestamp in batch:
+            if student_username in names:
+                yield {
+                    "student_username": student_username,
+                    "s_first_name": names[student_username]["s_first_name"],
+                    "s_last_name": names[student_username]["s_last_name"],
+                    "class_code": class_code,
+                    "section_number": section_number,
+                    "timestamp": timestamp,
+                }
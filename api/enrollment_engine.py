@@ -0,0 +1,341 @@
+import contextvars
+import datetime
+import json
+import random
+import sqlite3
+import time
+
+from waitlist_store import ALREADY_WAITLISTED, WAITLISTED
+
+# Outcomes of the enroll and drop decisions
+ENROLLED = "enrolled"
+DROPPED = "dropped"
+REMOVED_FROM_WAITLIST = "removed_from_waitlist"
+SECTION_REMOVED = "section_removed"
+SECTION_NOT_FOUND = "section_not_found"
+ALREADY_ENROLLED = "already_enrolled"
+NOT_ENROLLED = "not_enrolled"
+NOT_WAITLISTED = "not_waitlisted"
+NOT_ATTEMPTED = "not_attempted"
+
+MAX_WAITLISTS_PER_STUDENT = 3
+
+
+class DatabaseBusy(Exception):
+    pass
+
+
+# The connection whose open transaction is a write coalescer's batch, in the intent running on it
+_batch = contextvars.ContextVar("batch", default=None)
+
+
+def run_in_batch(db, func, *args):
+    # Runs func(db, *args) inside the batch transaction already open on db: the run_transaction
+    # calls it makes join the batch, which commits them or rolls them back to its savepoint
+    token = _batch.set(db)
+    try:
+        return func(db, *args)
+    finally:
+        _batch.reset(token)
+
+
+def run_transaction(db, body, *args, retries=3, backoff=0.02):
+    # BEGIN IMMEDIATE takes the write lock before any read, so no other worker can change
+    # the counts between our check and our insert. A transaction some caller left open fails
+    # the BEGIN rather than being joined, only run_in_batch's is.
+    if _batch.get() is db:
+        return body(db, *args)
+
+    for attempt in range(retries + 1):
+        try:
+            db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            if attempt == retries:
+                raise DatabaseBusy() from e
+            # busy_timeout already waited, back off with jitter before trying again
+            time.sleep(backoff * (2 ** attempt) * random.random())
+            continue
+
+        try:
+            result = body(db, *args)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        return result
+
+
+def timestamp():
+    return datetime.datetime.now().isoformat(" ")
+
+
+def enroll(db, waitlist, student_username, class_code, section_number):
+    params = {
+        "student": student_username,
+        "class_code": class_code,
+        "section": section_number,
+    }
+
+    if waitlist.contains(db, student_username, class_code, section_number):
+        return ALREADY_WAITLISTED
+
+    # Take a seat only while the section is under max_enrollment
+    enrolled = db.execute("""
+        INSERT INTO Enroll (e_student_username, e_class_code, e_section_number)
+        SELECT :student, class_code, section_number
+        FROM Class, SectionCounts
+        WHERE class_code=:class_code
+        AND section_number=:section
+        AND sc_class_code=class_code
+        AND sc_section_number=section_number
+        AND enrolled_count < max_enrollment
+        AND NOT EXISTS (
+            SELECT 1
+            FROM Enroll
+            WHERE e_student_username=:student
+            AND e_class_code=:class_code
+            AND e_section_number=:section
+        )
+    """, params).rowcount
+
+    if enrolled:
+        outcome = ENROLLED
+    else:
+        # Either the section is full or the student can't enroll at all
+        section = db.execute("""
+            SELECT max_waitlist, EXISTS (
+                SELECT 1
+                FROM Enroll
+                WHERE e_student_username=:student
+                AND e_class_code=:class_code
+                AND e_section_number=:section
+            ) AS enrolled
+            FROM Class
+            WHERE class_code=:class_code
+            AND section_number=:section
+        """, params).fetchone()
+
+        if section is None:
+            return SECTION_NOT_FOUND
+        if section["enrolled"]:
+            return ALREADY_ENROLLED
+
+        outcome = waitlist.add(
+            db,
+            student_username,
+            class_code,
+            section_number,
+            section["max_waitlist"],
+            MAX_WAITLISTS_PER_STUDENT,
+            timestamp(),
+        )
+        if outcome != WAITLISTED:
+            return outcome
+
+    # Remove them from the drop list if they previously dropped the class
+    db.execute("""
+        DELETE
+        FROM Dropped
+        WHERE d_student_username=:student
+        AND d_class_code=:class_code
+        AND d_section_number=:section
+    """, params)
+
+    return outcome
+
+
+def check_sections(db, student_username, sections):
+    # {(class_code, section_number): (exists, enrolled)} for many sections in one query
+    rows = db.execute("""
+        SELECT
+            json_extract(value, '$[0]') AS class_code,
+            json_extract(value, '$[1]') AS section_number,
+            EXISTS (
+                SELECT 1
+                FROM Class
+                WHERE class_code=json_extract(value, '$[0]')
+                AND section_number=json_extract(value, '$[1]')
+            ) AS section_exists,
+            EXISTS (
+                SELECT 1
+                FROM Enroll
+                WHERE e_student_username=?
+                AND e_class_code=json_extract(value, '$[0]')
+                AND e_section_number=json_extract(value, '$[1]')
+            ) AS enrolled
+        FROM json_each(?)
+    """, (student_username, json.dumps(sections))).fetchall()
+    return {(row["class_code"], row["section_number"]): (row["section_exists"], row["enrolled"]) for row in rows}
+
+
+def precheck(checked, waitlisted, section):
+    # The outcome known without trying to enroll, None if the section has to be tried
+    exists, enrolled = checked[section]
+    if not exists:
+        return SECTION_NOT_FOUND
+    if enrolled:
+        return ALREADY_ENROLLED
+    if section in waitlisted:
+        return ALREADY_WAITLISTED
+    return None
+
+
+def enroll_many(db, waitlist, student_username, sections, all_or_nothing):
+    # The enroll-or-waitlist decision for each section in turn, returning
+    # [(class_code, section_number, outcome)]. With all_or_nothing the first failure undoes
+    # every earlier section and the rest are not attempted.
+    checked = check_sections(db, student_username, sections)
+    waitlisted = {(row["class_code"], row["section_number"]) for row in waitlist.positions(db, student_username)}
+
+    db.execute("SAVEPOINT enroll_many")
+    results = []
+    failed = False
+    for class_code, section_number in sections:
+        outcome = precheck(checked, waitlisted, (class_code, section_number))
+        if outcome is None:
+            outcome = enroll(db, waitlist, student_username, class_code, section_number)
+        results.append((class_code, section_number, outcome))
+        if all_or_nothing and outcome not in (ENROLLED, WAITLISTED):
+            failed = True
+            break
+
+    if failed:
+        # Waitlists in another store don't roll back with the savepoint
+        for class_code, section_number, outcome in results:
+            if outcome == WAITLISTED:
+                waitlist.remove(db, student_username, class_code, section_number)
+        db.execute("ROLLBACK TO enroll_many")
+        results += [(class_code, section_number, NOT_ATTEMPTED) for class_code, section_number in sections[len(results):]]
+    db.execute("RELEASE enroll_many")
+    return results
+
+
+def drop(db, waitlist, student_username, class_code, section_number):
+    params = (student_username, class_code, section_number)
+
+    dropped = db.execute("""
+        DELETE
+        FROM Enroll
+        WHERE e_student_username=?
+        AND e_class_code=?
+        AND e_section_number=?
+    """, params).rowcount
+
+    if not dropped:
+        return NOT_ENROLLED if section_exists(db, class_code, section_number) else SECTION_NOT_FOUND
+
+    # Add them to drop list
+    db.execute("""
+        INSERT OR IGNORE INTO Dropped (d_student_username, d_class_code, d_section_number)
+        VALUES (?, ?, ?)
+    """, params)
+
+    # The freed seat goes to the head of the waitlist before anyone else can take it
+    promote(db, waitlist, class_code, section_number)
+
+    return DROPPED
+
+
+def promote(db, waitlist, class_code, section_number):
+    # Moves students from the head of the waitlist into the section's open seats, unless
+    # auto enrollment is frozen, and returns who was moved. Runs in the caller's transaction.
+    section = db.execute("""
+        SELECT auto_enrollment, max_enrollment - enrolled_count AS open_seats
+        FROM Class, SectionCounts
+        WHERE class_code=?
+        AND section_number=?
+        AND sc_class_code=class_code
+        AND sc_section_number=section_number
+    """, (class_code, section_number)).fetchone()
+
+    if section is None or not section["auto_enrollment"]:
+        return []
+
+    promoted = []
+    open_seats = section["open_seats"]
+    after = None
+    while open_seats > 0:
+        entries = list(waitlist.entries(db, class_code, section_number, after, open_seats))
+        if not entries:
+            break
+
+        for student_username, joined in entries:
+            waitlist.remove(db, student_username, class_code, section_number)
+            enrolled = db.execute("""
+                INSERT OR IGNORE INTO Enroll (e_student_username, e_class_code, e_section_number)
+                VALUES (?, ?, ?)
+            """, (student_username, class_code, section_number)).rowcount
+            if enrolled:
+                db.execute("""
+                    DELETE
+                    FROM Dropped
+                    WHERE d_student_username=?
+                    AND d_class_code=?
+                    AND d_section_number=?
+                """, (student_username, class_code, section_number))
+                promoted.append(student_username)
+                open_seats -= 1
+        after = (joined, student_username)
+
+    return promoted
+
+
+def promotable_sections(db):
+    # Sections that could take students from their waitlists right now
+    return db.execute("""
+        SELECT class_code, section_number
+        FROM Class, SectionCounts
+        WHERE sc_class_code=class_code
+        AND sc_section_number=section_number
+        AND auto_enrollment
+        AND enrolled_count < max_enrollment
+        ORDER BY class_code, section_number
+    """).fetchall()
+
+
+def leave_waitlist(db, waitlist, student_username, class_code, section_number):
+    removed = waitlist.remove(db, student_username, class_code, section_number)
+    return REMOVED_FROM_WAITLIST if removed else NOT_WAITLISTED
+
+
+def remove_section(db, waitlist, class_code, section_number):
+    params = (class_code, section_number)
+
+    removed = db.execute("""
+        DELETE FROM Class
+        WHERE class_code=?
+        AND section_number=?
+    """, params).rowcount
+
+    if not removed:
+        return SECTION_NOT_FOUND
+
+    # Unenroll every student who was in that section
+    db.execute("""
+        DELETE FROM Enroll
+        WHERE e_class_code=?
+        AND e_section_number=?
+    """, params)
+
+    # Remove every student who was in that section from the waitlist
+    waitlist.remove_section(db, class_code, section_number)
+
+    # Remove every student who was in that section from the droplist
+    db.execute("""
+        DELETE FROM Dropped
+        WHERE d_class_code=?
+        AND d_section_number=?
+    """, params)
+
+    return SECTION_REMOVED
+
+
+def section_exists(db, class_code, section_number):
+    return db.execute("""
+        SELECT 1
+        FROM Class
+        WHERE class_code=?
+        AND section_number=?
+    """, (class_code, section_number)).fetchone() is not None
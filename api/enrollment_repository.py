@@ -0,0 +1,1065 @@
+import decimal
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+
+try:
+    import boto3
+    from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+except ImportError:
+    boto3 = None
+
+import enrollment_engine
+from enrollment_engine import DatabaseBusy, run_transaction
+from pagination import keyset, sql_limit
+
+CLASS_COLUMNS = (
+    "class_code",
+    "section_number",
+    "class_name",
+    "department",
+    "auto_enrollment",
+    "max_enrollment",
+    "max_waitlist",
+    "c_instructor_username",
+)
+
+
+# Student and Instructor stay in SQLite whichever backend holds the rest
+
+def student(db, student_username):
+    return db.execute("""
+        SELECT *
+        FROM Student
+        WHERE student_username=?
+    """, (student_username,)).fetchone()
+
+
+def student_names(db, usernames):
+    # {student_username: row} for the ones that exist
+    students = db.execute("""
+        SELECT student_username, s_first_name, s_last_name
+        FROM Student
+        WHERE student_username IN (SELECT value FROM json_each(?))
+    """, (json.dumps(sorted(set(usernames))),)).fetchall()
+    return {student["student_username"]: student for student in students}
+
+
+def instructor_exists(db, instructor_username):
+    return bool(db.execute("""
+        SELECT *
+        FROM Instructor
+        WHERE instructor_username=?
+    """, (instructor_username,)).fetchall())
+
+
+def instructor_usernames(db):
+    return {row["instructor_username"] for row in db.execute("""
+        SELECT instructor_username
+        FROM Instructor
+    """)}
+
+
+def instructor_names(db, usernames):
+    instructors = db.execute("""
+        SELECT instructor_username, i_first_name, i_last_name
+        FROM Instructor
+        WHERE instructor_username IN (SELECT value FROM json_each(?))
+    """, (json.dumps(sorted(set(usernames))),)).fetchall()
+    return {instructor["instructor_username"]: instructor for instructor in instructors}
+
+
+def opened_sections(existing, classes):
+    # The sections in an upsert that may have open seats for their waitlists now, given their
+    # rows from before it: those with a higher max_enrollment, or auto enrollment turned back on
+    for new_class in classes:
+        old = existing.get((new_class["class_code"], new_class["section_number"]))
+        if old is None or not new_class["auto_enrollment"]:
+            continue
+        if new_class["max_enrollment"] > old["max_enrollment"] or not old["auto_enrollment"]:
+            yield new_class["class_code"], new_class["section_number"]
+
+
+class EnrollmentRepository:
+    # Class, Enroll and Dropped data. Student and Instructor stay in SQLite, so every method
+    # takes the request's SQLite connection as well.
+
+    def catalog_version(self, db):
+        # Changes whenever all_classes or available_classes could return something different
+        raise NotImplementedError
+
+    # The list methods return rows lazily in the order of the columns named in their comment,
+    # starting after the cursor `after` (a tuple of those columns) and stopping after `limit` rows
+
+    def all_classes(self, db, after=None, limit=None):
+        # Class rows, by (class_code, section_number)
+        raise NotImplementedError
+
+    def available_classes(self, db, after=None, limit=None):
+        # {class_code, section_number, class_name, i_first_name, i_last_name} with a free seat,
+        # by (class_code, section_number)
+        raise NotImplementedError
+
+    def section(self, db, class_code, section_number):
+        # The Class columns of one section, None if it doesn't exist
+        raise NotImplementedError
+
+    def section_exists(self, db, class_code, section_number):
+        return self.section(db, class_code, section_number) is not None
+
+    def student_enrollment(self, db, student_username, after=None, limit=None):
+        # {e_student_username, e_class_code, e_section_number}, by (e_class_code, e_section_number)
+        raise NotImplementedError
+
+    def instructor_enrollment(self, db, instructor_username, after=None, limit=None):
+        # {student_username, s_first_name, s_last_name, class_code, section_number, class_name},
+        # by (class_code, section_number, student_username)
+        raise NotImplementedError
+
+    def dropped(self, db, instructor_username, class_code, section_number, after=None, limit=None):
+        # {student_username, s_first_name, s_last_name, class_code, section_number}, by (student_username)
+        raise NotImplementedError
+
+    def add_class(self, db, new_class):
+        # False if the section already exists
+        raise NotImplementedError
+
+    def upsert_classes(self, db, waitlist, classes, dry_run=False):
+        # Adds each section or replaces its details, keeping its enrollment, and returns
+        # (inserted, updated). A section whose capacity was raised or whose auto enrollment was
+        # turned back on takes students from its waitlist. With dry_run only counts what would
+        # be written.
+        raise NotImplementedError
+
+    def set_instructor(self, db, class_code, section_number, instructor_username):
+        # False if the section doesn't exist
+        raise NotImplementedError
+
+    def freeze_enrollment(self, db, class_code, section_number):
+        raise NotImplementedError
+
+    # The write paths return enrollment_engine outcomes
+    def enroll(self, db, waitlist, student_username, class_code, section_number):
+        raise NotImplementedError
+
+    def enroll_many(self, db, waitlist, student_username, sections, all_or_nothing=False):
+        # enroll for each (class_code, section_number), returns [(class_code, section_number, outcome)].
+        # With all_or_nothing a failure leaves the student as they were, and later sections
+        # are NOT_ATTEMPTED.
+        raise NotImplementedError
+
+    def drop(self, db, waitlist, student_username, class_code, section_number):
+        # Gives the freed seat to the head of the waitlist in the same transaction
+        raise NotImplementedError
+
+    def leave_waitlist(self, db, waitlist, student_username, class_code, section_number):
+        raise NotImplementedError
+
+    def remove_section(self, db, waitlist, class_code, section_number):
+        raise NotImplementedError
+
+    def promote(self, db, waitlist, class_code, section_number):
+        # Fills the section's open seats from its waitlist unless auto enrollment is frozen,
+        # returns the students enrolled
+        raise NotImplementedError
+
+    def promotable_sections(self, db):
+        # (class_code, section_number) of the sections with auto enrollment on and a free seat
+        raise NotImplementedError
+
+    def promote_all(self, db, waitlist):
+        # Fills every open seat in one pass, one section at a time, for when seats open up
+        # without a drop: a section's capacity was raised or its enrollment unfrozen
+        promoted = {}
+        for class_code, section_number in self.promotable_sections(db):
+            students = self.promote(db, waitlist, class_code, section_number)
+            if students:
+                promoted[(class_code, section_number)] = students
+        return promoted
+
+
+class SQLiteEnrollmentRepository(EnrollmentRepository):
+
+    def catalog_version(self, db):
+        # Bumped by triggers on Class and Enroll
+        return db.execute("""
+            SELECT version
+            FROM DataVersion
+            WHERE name='catalog'
+        """).fetchone()["version"]
+
+    def all_classes(self, db, after=None, limit=None):
+        after_sql, after_params = keyset(("class_code", "section_number"), after)
+        return db.execute(f"""
+            SELECT *
+            FROM Class
+            WHERE {after_sql}
+            ORDER BY class_code, section_number
+            LIMIT ?
+        """, (*after_params, sql_limit(limit)))
+
+    def available_classes(self, db, after=None, limit=None):
+        after_sql, after_params = keyset(("class_code", "section_number"), after)
+        return db.execute(f"""
+            SELECT class_code, section_number, class_name, i_first_name, i_last_name
+            FROM Class, SectionCounts, Instructor
+            WHERE sc_class_code = class_code
+            AND sc_section_number = section_number
+            AND enrolled_count < max_enrollment
+            AND c_instructor_username = instructor_username
+            AND {after_sql}
+            ORDER BY class_code, section_number
+            LIMIT ?
+        """, (*after_params, sql_limit(limit)))
+
+    def section(self, db, class_code, section_number):
+        return db.execute("""
+            SELECT *
+            FROM Class
+            WHERE class_code=?
+            AND section_number=?
+        """, (class_code, section_number)).fetchone()
+
+    def section_exists(self, db, class_code, section_number):
+        return enrollment_engine.section_exists(db, class_code, section_number)
+
+    def student_enrollment(self, db, student_username, after=None, limit=None):
+        after_sql, after_params = keyset(("e_class_code", "e_section_number"), after)
+        return db.execute(f"""
+            SELECT *
+            FROM Enroll
+            WHERE e_student_username=?
+            AND {after_sql}
+            ORDER BY e_class_code, e_section_number
+            LIMIT ?
+        """, (student_username, *after_params, sql_limit(limit)))
+
+    def instructor_enrollment(self, db, instructor_username, after=None, limit=None):
+        after_sql, after_params = keyset(("class_code", "section_number", "e_student_username"), after)
+        return db.execute(f"""
+            SELECT student_username, s_first_name, s_last_name, class_code, section_number, class_name
+            FROM Instructor, Class, Enroll, Student
+            WHERE Instructor.instructor_username=?
+            AND Instructor.instructor_username=Class.c_instructor_username
+            AND  Class.class_code=Enroll.e_class_code
+            AND Class.section_number=Enroll.e_section_number
+            AND Enroll.e_student_username=student_username
+            AND {after_sql}
+            ORDER BY class_code, section_number, e_student_username
+            LIMIT ?
+        """, (instructor_username, *after_params, sql_limit(limit)))
+
+    def dropped(self, db, instructor_username, class_code, section_number, after=None, limit=None):
+        after_sql, after_params = keyset(("d_student_username",), after)
+        return db.execute(f"""
+            SELECT student_username, s_first_name, s_last_name, class_code, section_number
+            FROM Instructor, Class, Dropped, Student
+            WHERE Instructor.instructor_username=?
+            AND Class.class_code=?
+            AND Class.section_number=?
+            AND Instructor.instructor_username=Class.c_instructor_username
+            AND  Class.class_code=Dropped.d_class_code
+            AND Class.section_number=Dropped.d_section_number
+            AND Dropped.d_student_username=student_username
+            AND {after_sql}
+            ORDER BY d_student_username
+            LIMIT ?
+        """, (instructor_username, class_code, section_number, *after_params, sql_limit(limit)))
+
+    def add_class(self, db, new_class):
+        added = db.execute("""
+            INSERT OR IGNORE INTO Class (class_code, section_number, class_name, department, auto_enrollment, max_enrollment, max_waitlist, c_instructor_username)
+            VALUES (:class_code, :section_number, :class_name, :department, :auto_enrollment, :max_enrollment, :max_waitlist, :c_instructor_username)
+        """, new_class).rowcount
+        db.commit()
+        return added > 0
+
+    def upsert_classes(self, db, waitlist, classes, dry_run=False):
+        if dry_run:
+            existing = self._existing_sections(db, classes)
+            return len(classes) - len(existing), len(existing)
+        return self._run_with_waitlist(db, waitlist, self._upsert_classes, classes)
+
+    def _existing_sections(self, db, classes):
+        rows = db.execute("""
+            SELECT class_code, section_number, auto_enrollment, max_enrollment
+            FROM Class, json_each(?)
+            WHERE class_code=json_extract(value, '$[0]')
+            AND section_number=json_extract(value, '$[1]')
+        """, (json.dumps([(c["class_code"], c["section_number"]) for c in classes]),)).fetchall()
+        return {(row["class_code"], row["section_number"]): row for row in rows}
+
+    def _upsert_classes(self, db, waitlist, classes):
+        existing = self._existing_sections(db, classes)
+        db.executemany("""
+            INSERT INTO Class (class_code, section_number, class_name, department, auto_enrollment, max_enrollment, max_waitlist, c_instructor_username)
+            VALUES (:class_code, :section_number, :class_name, :department, :auto_enrollment, :max_enrollment, :max_waitlist, :c_instructor_username)
+            ON CONFLICT (class_code, section_number) DO UPDATE SET
+                class_name=excluded.class_name,
+                department=excluded.department,
+                auto_enrollment=excluded.auto_enrollment,
+                max_enrollment=excluded.max_enrollment,
+                max_waitlist=excluded.max_waitlist,
+                c_instructor_username=excluded.c_instructor_username
+        """, classes)
+        for section in opened_sections(existing, classes):
+            enrollment_engine.promote(db, waitlist, *section)
+        return len(classes) - len(existing), len(existing)
+
+    def set_instructor(self, db, class_code, section_number, instructor_username):
+        updated = db.execute("""
+            UPDATE Class
+            SET c_instructor_username=?
+            WHERE class_code=?
+            AND section_number=?
+        """, (instructor_username, class_code, section_number)).rowcount
+        db.commit()
+        return updated > 0
+
+    def freeze_enrollment(self, db, class_code, section_number):
+        updated = db.execute("""
+            UPDATE Class
+            SET auto_enrollment = FALSE
+            WHERE class_code=?
+            AND section_number=?
+        """, (class_code, section_number)).rowcount
+        db.commit()
+        return updated > 0
+
+    def _run_with_waitlist(self, db, waitlist, body, *args):
+        # A waitlist kept outside SQLite doesn't roll back with the transaction, so its changes
+        # are undone if the transaction doesn't commit
+        with waitlist.journal() as journaled:
+            return run_transaction(db, body, journaled, *args)
+
+    def enroll(self, db, waitlist, student_username, class_code, section_number):
+        return self._run_with_waitlist(db, waitlist, enrollment_engine.enroll, student_username, class_code, section_number)
+
+    def enroll_many(self, db, waitlist, student_username, sections, all_or_nothing=False):
+        return self._run_with_waitlist(db, waitlist, enrollment_engine.enroll_many, student_username, sections, all_or_nothing)
+
+    def drop(self, db, waitlist, student_username, class_code, section_number):
+        return self._run_with_waitlist(db, waitlist, enrollment_engine.drop, student_username, class_code, section_number)
+
+    def leave_waitlist(self, db, waitlist, student_username, class_code, section_number):
+        return self._run_with_waitlist(db, waitlist, enrollment_engine.leave_waitlist, student_username, class_code, section_number)
+
+    def remove_section(self, db, waitlist, class_code, section_number):
+        return self._run_with_waitlist(db, waitlist, enrollment_engine.remove_section, class_code, section_number)
+
+    def promote(self, db, waitlist, class_code, section_number):
+        return self._run_with_waitlist(db, waitlist, enrollment_engine.promote, class_code, section_number)
+
+    def promotable_sections(self, db):
+        return [tuple(section) for section in enrollment_engine.promotable_sections(db)]
+
+
+class DynamoDBEnrollmentRepository(EnrollmentRepository):
+    # Single table. Each section is a partition holding its Class item, one item per enrolled
+    # student and one per dropped student:
+    #
+    #   PK                       SK                GSI1PK                GSI1SK
+    #   SECTION#CPSC449#01       #SECTION          INSTRUCTOR#IreneDoe   SECTION#CPSC449#01
+    #   SECTION#CPSC449#01       ENROLL#SamDoe     STUDENT#SamDoe        ENROLL#CPSC449#01
+    #   SECTION#CPSC449#01       DROPPED#SamDoe    STUDENT#SamDoe        DROPPED#CPSC449#01
+    #
+    # A roster is one Query on the section partition, a student's classes and an instructor's
+    # sections one Query on GSI1, and the catalog one Query on GSI2, which holds Class items only.
+    # The Class item carries enrolled_count, so seat limits are a condition on a single item.
+
+    SECTION_SK = "#SECTION"
+    CATALOG_VERSION_KEY = {"PK": "VERSION#catalog", "SK": "#VERSION"}
+    # TransactWriteItems and BatchGetItem limits
+    MAX_TRANSACTION_ITEMS = 100
+    MAX_BATCH_GET_KEYS = 100
+    MAX_BATCH_WRITE_ITEMS = 25
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+
+    @staticmethod
+    def section_pk(class_code, section_number):
+        return f"SECTION#{class_code}#{section_number}"
+
+    @staticmethod
+    def _section_of(key):
+        # "SECTION#CPSC449#01" or "ENROLL#CPSC449#01" -> ("CPSC449", "01")
+        _, class_code, section_number = key.split("#", 2)
+        return class_code, section_number
+
+    def _section_key(self, class_code, section_number):
+        return {"PK": self.section_pk(class_code, section_number), "SK": self.SECTION_SK}
+
+    def _enroll_key(self, student_username, class_code, section_number):
+        return {"PK": self.section_pk(class_code, section_number), "SK": f"ENROLL#{student_username}"}
+
+    def _dropped_key(self, student_username, class_code, section_number):
+        return {"PK": self.section_pk(class_code, section_number), "SK": f"DROPPED#{student_username}"}
+
+    def _section_item(self, new_class, enrolled_count=0):
+        pk = self.section_pk(new_class["class_code"], new_class["section_number"])
+        return {
+            "PK": pk,
+            "SK": self.SECTION_SK,
+            "GSI1PK": f"INSTRUCTOR#{new_class['c_instructor_username']}",
+            "GSI1SK": pk,
+            "GSI2PK": "CATALOG",
+            "GSI2SK": pk,
+            **{column: new_class[column] for column in CLASS_COLUMNS},
+            "auto_enrollment": bool(new_class["auto_enrollment"]),
+            "enrolled_count": enrolled_count,
+        }
+
+    def _student_item(self, kind, student_username, class_code, section_number):
+        return {
+            "PK": self.section_pk(class_code, section_number),
+            "SK": f"{kind}#{student_username}",
+            "GSI1PK": f"STUDENT#{student_username}",
+            "GSI1SK": f"{kind}#{class_code}#{section_number}",
+        }
+
+    def _serialize(self, item):
+        return {name: self._serializer.serialize(value) for name, value in item.items()}
+
+    def _deserialize(self, item):
+        item = {name: self._deserializer.deserialize(value) for name, value in item.items()}
+        # Numbers come back as Decimal, every number we store is an int
+        return {name: int(value) if isinstance(value, decimal.Decimal) else value for name, value in item.items()}
+
+    @staticmethod
+    def _class_row(item):
+        return {column: item[column] for column in CLASS_COLUMNS}
+
+    def _get(self, key, consistent_read=False):
+        item = self.client.get_item(
+            TableName=self.table_name, Key=self._serialize(key), ConsistentRead=consistent_read
+        ).get("Item")
+        return self._deserialize(item) if item else None
+
+    def _query_pages(self, limit=None, **kwargs):
+        # Reads a page at a time as the caller iterates, limit is the page size
+        kwargs["TableName"] = self.table_name
+        if limit:
+            kwargs["Limit"] = limit
+        while True:
+            response = self.client.query(**kwargs)
+            yield [self._deserialize(item) for item in response["Items"]]
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _query(self, **kwargs):
+        return [item for page in self._query_pages(**kwargs) for item in page]
+
+    def _batch_get(self, keys, consistent_read=False):
+        items = []
+        keys = [self._serialize(key) for key in keys]
+        for i in range(0, len(keys), self.MAX_BATCH_GET_KEYS):
+            request = {self.table_name: {"Keys": keys[i:i + self.MAX_BATCH_GET_KEYS], "ConsistentRead": consistent_read}}
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                items.extend(self._deserialize(item) for item in response["Responses"].get(self.table_name, []))
+                request = response.get("UnprocessedKeys")
+        return items
+
+    def _batch_write(self, items):
+        requests = [{"PutRequest": {"Item": self._serialize(item)}} for item in items]
+        for i in range(0, len(requests), self.MAX_BATCH_WRITE_ITEMS):
+            request = {self.table_name: requests[i:i + self.MAX_BATCH_WRITE_ITEMS]}
+            while request:
+                request = self.client.batch_write_item(RequestItems=request).get("UnprocessedItems")
+
+    def _transact(self, actions):
+        # False if a condition failed. Another transaction touching the same items is reported
+        # like a busy SQLite database, so the client retries.
+        for action in actions:
+            for request in action.values():
+                request["TableName"] = self.table_name
+        try:
+            self.client.transact_write_items(TransactItems=actions)
+        except self.client.exceptions.TransactionCanceledException as e:
+            reasons = [reason.get("Code") for reason in e.response.get("CancellationReasons", [])]
+            if "TransactionConflict" in reasons:
+                raise DatabaseBusy() from e
+            return False
+        return True
+
+    def catalog_version(self, db):
+        item = self._get(self.CATALOG_VERSION_KEY, consistent_read=True)
+        return item["version"] if item else 0
+
+    def _bump_catalog_version(self):
+        # Bumped after the write rather than inside its transaction: every enrollment touches
+        # this item, and putting it in the transactions would make them all conflict
+        self.client.update_item(
+            TableName=self.table_name,
+            Key=self._serialize(self.CATALOG_VERSION_KEY),
+            UpdateExpression="ADD version :one",
+            ExpressionAttributeValues=self._serialize({":one": 1}),
+        )
+
+    def _rosters(self, kind, class_code, section_number, after=None, limit=None):
+        # Pages of student usernames in one section, after the username `after`
+        pk = self.section_pk(class_code, section_number)
+        kwargs = {}
+        if after is not None:
+            kwargs["ExclusiveStartKey"] = self._serialize({"PK": pk, "SK": f"{kind}#{after}"})
+        for page in self._query_pages(
+            limit=limit,
+            KeyConditionExpression="PK = :pk AND begins_with(SK, :kind)",
+            ExpressionAttributeValues=self._serialize({":pk": pk, ":kind": f"{kind}#"}),
+            ProjectionExpression="SK",
+            **kwargs,
+        ):
+            yield [item["SK"].split("#", 1)[1] for item in page]
+
+    def _catalog_pages(self, after, limit, **kwargs):
+        if after is not None:
+            pk = self.section_pk(*after)
+            kwargs["ExclusiveStartKey"] = self._serialize({"GSI2PK": "CATALOG", "GSI2SK": pk, "PK": pk, "SK": self.SECTION_SK})
+        return self._query_pages(
+            limit=limit,
+            IndexName="GSI2",
+            KeyConditionExpression="GSI2PK = :catalog",
+            ExpressionAttributeValues=self._serialize({":catalog": "CATALOG"}),
+            **kwargs,
+        )
+
+    def all_classes(self, db, after=None, limit=None):
+        rows = (self._class_row(item) for page in self._catalog_pages(after, limit) for item in page)
+        return itertools.islice(rows, limit)
+
+    def available_classes(self, db, after=None, limit=None):
+        return itertools.islice(self._available_classes(db, after, limit), limit)
+
+    def _available_classes(self, db, after, limit):
+        for items in self._catalog_pages(after, limit, FilterExpression="enrolled_count < max_enrollment"):
+            instructors = instructor_names(db, [item["c_instructor_username"] for item in items])
+            for item in items:
+                instructor = instructors.get(item["c_instructor_username"])
+                if instructor is not None:
+                    yield {
+                        "class_code": item["class_code"],
+                        "section_number": item["section_number"],
+                        "class_name": item["class_name"],
+                        "i_first_name": instructor["i_first_name"],
+                        "i_last_name": instructor["i_last_name"],
+                    }
+
+    def section(self, db, class_code, section_number):
+        item = self._get(self._section_key(class_code, section_number))
+        return self._class_row(item) if item else None
+
+    def student_enrollment(self, db, student_username, after=None, limit=None):
+        return itertools.islice(self._student_enrollment(student_username, after, limit), limit)
+
+    def _student_enrollment(self, student_username, after, limit):
+        kwargs = {}
+        if after is not None:
+            pk = self.section_pk(*after)
+            kwargs["ExclusiveStartKey"] = self._serialize({
+                "GSI1PK": f"STUDENT#{student_username}",
+                "GSI1SK": f"ENROLL#{after[0]}#{after[1]}",
+                "PK": pk,
+                "SK": f"ENROLL#{student_username}",
+            })
+        for page in self._query_pages(
+            limit=limit,
+            IndexName="GSI1",
+            KeyConditionExpression="GSI1PK = :student AND begins_with(GSI1SK, :enroll)",
+            ExpressionAttributeValues=self._serialize({":student": f"STUDENT#{student_username}", ":enroll": "ENROLL#"}),
+            **kwargs,
+        ):
+            for item in page:
+                class_code, section_number = self._section_of(item["GSI1SK"])
+                yield {
+                    "e_student_username": student_username,
+                    "e_class_code": class_code,
+                    "e_section_number": section_number,
+                }
+
+    def instructor_enrollment(self, db, instructor_username, after=None, limit=None):
+        return itertools.islice(self._instructor_enrollment(db, instructor_username, after, limit), limit)
+
+    def _instructor_enrollment(self, db, instructor_username, after, limit):
+        # GSI1 only projects keys, the Class items themselves come from one BatchGetItem
+        keys = self._query(
+            IndexName="GSI1",
+            KeyConditionExpression="GSI1PK = :instructor",
+            ExpressionAttributeValues=self._serialize({":instructor": f"INSTRUCTOR#{instructor_username}"}),
+        )
+        sections = self._batch_get([{"PK": key["PK"], "SK": key["SK"]} for key in keys])
+        sections.sort(key=lambda item: (item["class_code"], item["section_number"]))
+
+        for section in sections:
+            position = (section["class_code"], section["section_number"])
+            if after is not None and position < tuple(after[:2]):
+                continue
+            student_after = after[2] if after is not None and position == tuple(after[:2]) else None
+            for roster in self._rosters("ENROLL", *position, student_after, limit):
+                students = student_names(db, roster)
+                for student_username in roster:
+                    if student_username in students:
+                        yield {
+                            "student_username": student_username,
+                            "s_first_name": students[student_username]["s_first_name"],
+                            "s_last_name": students[student_username]["s_last_name"],
+                            "class_code": section["class_code"],
+                            "section_number": section["section_number"],
+                            "class_name": section["class_name"],
+                        }
+
+    def dropped(self, db, instructor_username, class_code, section_number, after=None, limit=None):
+        return itertools.islice(self._dropped(db, instructor_username, class_code, section_number, after, limit), limit)
+
+    def _dropped(self, db, instructor_username, class_code, section_number, after, limit):
+        section = self.section(db, class_code, section_number)
+        if section is None or section["c_instructor_username"] != instructor_username:
+            return
+        for roster in self._rosters("DROPPED", class_code, section_number, after[0] if after else None, limit):
+            students = student_names(db, roster)
+            for student_username in roster:
+                if student_username in students:
+                    yield {
+                        "student_username": student_username,
+                        "s_first_name": students[student_username]["s_first_name"],
+                        "s_last_name": students[student_username]["s_last_name"],
+                        "class_code": class_code,
+                        "section_number": section_number,
+                    }
+
+    def add_class(self, db, new_class):
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=self._serialize(self._section_item(new_class)),
+                ConditionExpression="attribute_not_exists(PK)",
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        self._bump_catalog_version()
+        return True
+
+    def upsert_classes(self, db, waitlist, classes, dry_run=False):
+        existing = {
+            (item["class_code"], item["section_number"]): item
+            for item in self._batch_get([self._section_key(c["class_code"], c["section_number"]) for c in classes])
+        }
+        if not dry_run and classes:
+            # DynamoDB has no batched update, and a put would reset enrolled_count
+            for new_class in classes:
+                item = self._section_item(new_class)
+                del item["PK"], item["SK"], item["enrolled_count"]
+                names = {f"#{name}": name for name in item}
+                values = {f":{name}": value for name, value in item.items()}
+                self.client.update_item(
+                    TableName=self.table_name,
+                    Key=self._serialize(self._section_key(new_class["class_code"], new_class["section_number"])),
+                    UpdateExpression="SET " + ", ".join(f"#{name} = :{name}" for name in item)
+                        + ", enrolled_count = if_not_exists(enrolled_count, :zero)",
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=self._serialize({**values, ":zero": 0}),
+                )
+            self._bump_catalog_version()
+            for section in opened_sections(existing, classes):
+                self.promote(db, waitlist, *section)
+        return len(classes) - len(existing), len(existing)
+
+    def _update_section(self, class_code, section_number, update, values):
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=self._serialize(self._section_key(class_code, section_number)),
+                UpdateExpression=update,
+                ConditionExpression="attribute_exists(PK)",
+                ExpressionAttributeValues=self._serialize(values),
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        self._bump_catalog_version()
+        return True
+
+    def set_instructor(self, db, class_code, section_number, instructor_username):
+        return self._update_section(
+            class_code,
+            section_number,
+            "SET c_instructor_username = :instructor, GSI1PK = :instructor_key",
+            {":instructor": instructor_username, ":instructor_key": f"INSTRUCTOR#{instructor_username}"},
+        )
+
+    def freeze_enrollment(self, db, class_code, section_number):
+        return self._update_section(class_code, section_number, "SET auto_enrollment = :false", {":false": False})
+
+    def enroll(self, db, waitlist, student_username, class_code, section_number, retries=3):
+        if waitlist.contains(db, student_username, class_code, section_number):
+            return enrollment_engine.ALREADY_WAITLISTED
+
+        section_key = self._section_key(class_code, section_number)
+        enroll_key = self._enroll_key(student_username, class_code, section_number)
+
+        for _ in range(retries + 1):
+            # Take a seat only while the section is under max_enrollment, in the same transaction
+            # as the enrollment item and the cleanup of an earlier drop
+            enrolled = self._transact([
+                {"Update": {
+                    "Key": self._serialize(section_key),
+                    "UpdateExpression": "SET enrolled_count = enrolled_count + :one",
+                    "ConditionExpression": "attribute_exists(PK) AND enrolled_count < max_enrollment",
+                    "ExpressionAttributeValues": self._serialize({":one": 1}),
+                }},
+                {"Put": {
+                    "Item": self._serialize(self._student_item("ENROLL", student_username, class_code, section_number)),
+                    "ConditionExpression": "attribute_not_exists(PK)",
+                }},
+                {"Delete": {"Key": self._serialize(self._dropped_key(student_username, class_code, section_number))}},
+            ])
+            if enrolled:
+                self._bump_catalog_version()
+                return enrollment_engine.ENROLLED
+
+            # Find out which condition failed
+            items = {item["SK"]: item for item in self._batch_get([section_key, enroll_key], consistent_read=True)}
+            section = items.get(self.SECTION_SK)
+            if section is None:
+                return enrollment_engine.SECTION_NOT_FOUND
+            if enroll_key["SK"] in items:
+                return enrollment_engine.ALREADY_ENROLLED
+            # A seat freed up since the transaction was rejected, try again
+            if section["enrolled_count"] >= section["max_enrollment"]:
+                break
+        else:
+            raise DatabaseBusy()
+
+        outcome = waitlist.add(
+            db,
+            student_username,
+            class_code,
+            section_number,
+            section["max_waitlist"],
+            enrollment_engine.MAX_WAITLISTS_PER_STUDENT,
+            enrollment_engine.timestamp(),
+        )
+        if outcome == enrollment_engine.WAITLISTED:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key=self._serialize(self._dropped_key(student_username, class_code, section_number)),
+            )
+        return outcome
+
+    def enroll_many(self, db, waitlist, student_username, sections, all_or_nothing=False):
+        # Checked up front with one BatchGetItem. A waitlist can't join a DynamoDB transaction,
+        # so sections are enrolled one at a time, and with all_or_nothing the ones already done
+        # are undone if a later one fails.
+        keys = []
+        for class_code, section_number in sections:
+            keys += [
+                self._section_key(class_code, section_number),
+                self._enroll_key(student_username, class_code, section_number),
+                self._dropped_key(student_username, class_code, section_number),
+            ]
+        items = {(item["PK"], item["SK"]) for item in self._batch_get(keys, consistent_read=True)}
+        checked = {
+            (class_code, section_number): (
+                (self.section_pk(class_code, section_number), self.SECTION_SK) in items,
+                (self.section_pk(class_code, section_number), f"ENROLL#{student_username}") in items,
+            )
+            for class_code, section_number in sections
+        }
+        dropped = {
+            (class_code, section_number)
+            for class_code, section_number in sections
+            if (self.section_pk(class_code, section_number), f"DROPPED#{student_username}") in items
+        }
+        waitlisted = {(row["class_code"], row["section_number"]) for row in waitlist.positions(db, student_username)}
+
+        results = []
+        try:
+            for class_code, section_number in sections:
+                outcome = enrollment_engine.precheck(checked, waitlisted, (class_code, section_number))
+                if outcome is None:
+                    outcome = self.enroll(db, waitlist, student_username, class_code, section_number)
+                results.append((class_code, section_number, outcome))
+                if all_or_nothing and outcome not in (enrollment_engine.ENROLLED, enrollment_engine.WAITLISTED):
+                    break
+            else:
+                return results
+        except DatabaseBusy:
+            if all_or_nothing:
+                self._undo_enrollments(db, waitlist, student_username, results, dropped)
+            raise
+
+        self._undo_enrollments(db, waitlist, student_username, results, dropped)
+        not_attempted = [(*section, enrollment_engine.NOT_ATTEMPTED) for section in sections[len(results):]]
+        return results + not_attempted
+
+    def _undo_enrollments(self, db, waitlist, student_username, results, dropped):
+        # Puts back the seat, the waitlist entry and the earlier drop of each section enrolled
+        for class_code, section_number, outcome in reversed(results):
+            restore_drop = []
+            if (class_code, section_number) in dropped:
+                restore_drop = [{"Put": {"Item": self._serialize(
+                    self._student_item("DROPPED", student_username, class_code, section_number)
+                )}}]
+            if outcome == enrollment_engine.ENROLLED:
+                self._transact([
+                    {"Delete": {"Key": self._serialize(self._enroll_key(student_username, class_code, section_number))}},
+                    {"Update": {
+                        "Key": self._serialize(self._section_key(class_code, section_number)),
+                        "UpdateExpression": "SET enrolled_count = enrolled_count - :one",
+                        "ExpressionAttributeValues": self._serialize({":one": 1}),
+                    }},
+                    *restore_drop,
+                ])
+                self._bump_catalog_version()
+            elif outcome == enrollment_engine.WAITLISTED:
+                waitlist.remove(db, student_username, class_code, section_number)
+                if restore_drop:
+                    self._transact(restore_drop)
+
+    @staticmethod
+    def _waitlist_head(db, waitlist, class_code, section_number):
+        for student_username, _ in waitlist.entries(db, class_code, section_number, None, 1):
+            return student_username
+        return None
+
+    def _promotion_actions(self, student_username, class_code, section_number):
+        # Enroll a student from the waitlist, clearing an earlier drop
+        return [
+            {"Put": {
+                "Item": self._serialize(self._student_item("ENROLL", student_username, class_code, section_number)),
+                "ConditionExpression": "attribute_not_exists(PK)",
+            }},
+            {"Delete": {"Key": self._serialize(self._dropped_key(student_username, class_code, section_number))}},
+        ]
+
+    def drop(self, db, waitlist, student_username, class_code, section_number, retries=3):
+        section_key = self._section_key(class_code, section_number)
+        enroll_key = self._enroll_key(student_username, class_code, section_number)
+
+        for _ in range(retries + 1):
+            section = self._get(section_key, consistent_read=True)
+            if section is None:
+                return enrollment_engine.SECTION_NOT_FOUND
+            # Dropping opens a seat unless the section was over capacity
+            head = None
+            if section["auto_enrollment"] and section["enrolled_count"] <= section["max_enrollment"]:
+                head = self._waitlist_head(db, waitlist, class_code, section_number)
+
+            actions = [
+                {"Delete": {"Key": self._serialize(enroll_key), "ConditionExpression": "attribute_exists(PK)"}},
+                {"Put": {"Item": self._serialize(self._student_item("DROPPED", student_username, class_code, section_number))}},
+            ]
+            if head is None:
+                actions.append({"Update": {
+                    "Key": self._serialize(section_key),
+                    "UpdateExpression": "SET enrolled_count = enrolled_count - :one",
+                    "ConditionExpression": "attribute_exists(PK)",
+                    "ExpressionAttributeValues": self._serialize({":one": 1}),
+                }})
+            else:
+                # The seat passes straight to the head of the waitlist, so enrolled_count stays
+                # as it is, provided enrollment wasn't frozen or the section shrunk meanwhile
+                actions.append({"ConditionCheck": {
+                    "Key": self._serialize(section_key),
+                    "ConditionExpression": "auto_enrollment = :true AND enrolled_count <= max_enrollment",
+                    "ExpressionAttributeValues": self._serialize({":true": True}),
+                }})
+                actions += self._promotion_actions(head, class_code, section_number)
+
+            if self._transact(actions):
+                self._bump_catalog_version()
+                if head is not None:
+                    waitlist.remove(db, head, class_code, section_number)
+                return enrollment_engine.DROPPED
+
+            # Find out which condition failed
+            keys = [section_key, enroll_key]
+            if head is not None:
+                keys.append(self._enroll_key(head, class_code, section_number))
+            items = {item["SK"]: item for item in self._batch_get(keys, consistent_read=True)}
+            if self.SECTION_SK not in items:
+                return enrollment_engine.SECTION_NOT_FOUND
+            if enroll_key["SK"] not in items:
+                return enrollment_engine.NOT_ENROLLED
+            # The head of the waitlist is enrolled already, it only has to leave the waitlist
+            if head is not None and f"ENROLL#{head}" in items:
+                waitlist.remove(db, head, class_code, section_number)
+        raise DatabaseBusy()
+
+    def leave_waitlist(self, db, waitlist, student_username, class_code, section_number):
+        return enrollment_engine.leave_waitlist(db, waitlist, student_username, class_code, section_number)
+
+    def promote(self, db, waitlist, class_code, section_number, retries=3):
+        section_key = self._section_key(class_code, section_number)
+        promoted = []
+        conflicts = 0
+        while True:
+            section = self._get(section_key, consistent_read=True)
+            if section is None or not section["auto_enrollment"] or section["enrolled_count"] >= section["max_enrollment"]:
+                return promoted
+            head = self._waitlist_head(db, waitlist, class_code, section_number)
+            if head is None:
+                return promoted
+
+            # One seat per transaction, each under the same conditions as a student enrolling
+            promoted_head = self._transact([
+                {"Update": {
+                    "Key": self._serialize(section_key),
+                    "UpdateExpression": "SET enrolled_count = enrolled_count + :one",
+                    "ConditionExpression": "auto_enrollment = :true AND enrolled_count < max_enrollment",
+                    "ExpressionAttributeValues": self._serialize({":one": 1, ":true": True}),
+                }},
+                *self._promotion_actions(head, class_code, section_number),
+            ])
+            if promoted_head:
+                promoted.append(head)
+                self._bump_catalog_version()
+            else:
+                conflicts += 1
+                if conflicts > retries:
+                    raise DatabaseBusy()
+            # Enrolled now, or found to be enrolled already: either way they are done waiting
+            if promoted_head or self._get(self._enroll_key(head, class_code, section_number), consistent_read=True):
+                waitlist.remove(db, head, class_code, section_number)
+
+    def promotable_sections(self, db):
+        pages = self._catalog_pages(
+            None,
+            None,
+            FilterExpression="enrolled_count < max_enrollment",
+            ProjectionExpression="class_code, section_number, auto_enrollment",
+        )
+        return [
+            (item["class_code"], item["section_number"])
+            for page in pages
+            for item in page
+            if item["auto_enrollment"]
+        ]
+
+    def remove_section(self, db, waitlist, class_code, section_number):
+        pk = self.section_pk(class_code, section_number)
+        section_key = self._section_key(class_code, section_number)
+
+        # The Class item goes in the first transaction, so no one can enroll once it has started.
+        # A big section takes several transactions, and anything written between our Query and
+        # the first one is picked up by the next pass.
+        first = True
+        while True:
+            keys = self._query(
+                KeyConditionExpression="PK = :pk",
+                ExpressionAttributeValues=self._serialize({":pk": pk}),
+                ProjectionExpression="PK, SK",
+                ConsistentRead=True,
+            )
+            if first and section_key not in keys:
+                return enrollment_engine.SECTION_NOT_FOUND
+            if not keys:
+                break
+
+            keys.sort(key=lambda key: key != section_key)
+            for i in range(0, len(keys), self.MAX_TRANSACTION_ITEMS):
+                deletes = [{"Delete": {"Key": self._serialize(key)}} for key in keys[i:i + self.MAX_TRANSACTION_ITEMS]]
+                if first:
+                    deletes[0]["Delete"]["ConditionExpression"] = "attribute_exists(PK)"
+                    if not self._transact(deletes):
+                        return enrollment_engine.SECTION_NOT_FOUND
+                    first = False
+                else:
+                    self._transact(deletes)
+
+        self._bump_catalog_version()
+        waitlist.remove_section(db, class_code, section_number)
+        return enrollment_engine.SECTION_REMOVED
+
+    def create_table(self):
+        self.client.create_table(
+            TableName=self.table_name,
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": name, "AttributeType": "S"}
+                for name in ("PK", "SK", "GSI1PK", "GSI1SK", "GSI2PK", "GSI2SK")
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": "GSI1",
+                    "KeySchema": [
+                        {"AttributeName": "GSI1PK", "KeyType": "HASH"},
+                        {"AttributeName": "GSI1SK", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "KEYS_ONLY"},
+                },
+                {
+                    "IndexName": "GSI2",
+                    "KeySchema": [
+                        {"AttributeName": "GSI2PK", "KeyType": "HASH"},
+                        {"AttributeName": "GSI2SK", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                },
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.client.get_waiter("table_exists").wait(TableName=self.table_name)
+
+    def load(self, db):
+        # Copy Class, Enroll and Dropped out of an enrollment database
+        enrolled_counts = {}
+        items = []
+        for row in db.execute("SELECT * FROM Enroll"):
+            section = (row["e_class_code"], row["e_section_number"])
+            enrolled_counts[section] = enrolled_counts.get(section, 0) + 1
+            items.append(self._student_item("ENROLL", row["e_student_username"], *section))
+        for row in db.execute("SELECT * FROM Dropped"):
+            items.append(self._student_item("DROPPED", row["d_student_username"], row["d_class_code"], row["d_section_number"]))
+        for row in db.execute("SELECT * FROM Class"):
+            section = (row["class_code"], row["section_number"])
+            items.append(self._section_item(dict(row), enrolled_counts.get(section, 0)))
+        # Start from a random point, like the SQLite DataVersion row
+        items.append({**self.CATALOG_VERSION_KEY, "version": random.randrange(10 ** 12)})
+        self._batch_write(items)
+        return len(items)
+
+
+def dynamodb_client(endpoint_url, region="us-east-1"):
+    if boto3 is None:
+        raise RuntimeError("The dynamodb enrollment backend needs the boto3 package (pip install boto3)")
+    return boto3.client("dynamodb", endpoint_url=endpoint_url or None, region_name=region)
+
+
+def make_repository(backend, dynamodb_endpoint=None, dynamodb_table=None, dynamodb_region="us-east-1"):
+    if backend == "sqlite":
+        return SQLiteEnrollmentRepository()
+    if backend == "dynamodb":
+        return DynamoDBEnrollmentRepository(dynamodb_client(dynamodb_endpoint, dynamodb_region), dynamodb_table)
+    raise ValueError(f"Unknown enrollment backend: {backend}")
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} ENDPOINT_URL TABLE DATABASE", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        usage()
+        sys.exit(1)
+
+    endpoint_url, table_name, database = sys.argv[1:]
+    repository = DynamoDBEnrollmentRepository(dynamodb_client(endpoint_url), table_name)
+    try:
+        repository.create_table()
+    except repository.client.exceptions.ResourceInUseException:
+        pass
+
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    print(f"Loaded {repository.load(db)} items into {table_name}")
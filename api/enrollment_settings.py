@@ -0,0 +1,46 @@
+from pydantic_settings import BaseSettings
+
+from enrollment_repository import make_repository
+from waitlist_store import make_waitlist_store
+
+
+class Settings(BaseSettings, env_file=".env", extra="ignore"):
+    # Shared by the enrollment service and its command line tools
+    enrollment_database: str
+    enrollment_logging_config: str
+    enrollment_db_pool_size: int = 8
+    enrollment_db_pool_timeout: float = 5.0
+    enrollment_waitlist_backend: str = "sqlite"
+    enrollment_redis_url: str = "redis://localhost:6379/0"
+    enrollment_repository_backend: str = "sqlite"
+    enrollment_dynamodb_endpoint: str = "http://localhost:8000"
+    enrollment_dynamodb_table: str = "Enrollment"
+    enrollment_dynamodb_region: str = "us-east-1"
+    enrollment_response_cache_size: int = 256
+    enrollment_db_mode: str = "threadpool"
+    enrollment_db_executor_threads: int = 8
+    enrollment_db_executor_queue: int = 1024
+    enrollment_db_query_timeout: float = 5.0
+    enrollment_events_poll_interval: float = 0.5
+    enrollment_events_keepalive: float = 15.0
+    enrollment_metrics: bool = False
+    enrollment_slow_query_ms: float = 0.0
+    enrollment_log_queue_size: int = 10000
+    enrollment_log_debug_sample_rate: float = 1.0
+    enrollment_group_commit: bool = False
+    enrollment_group_commit_window: float = 0.002
+    enrollment_group_commit_max_batch: int = 64
+    enrollment_group_commit_queue: int = 1024
+
+    def waitlist_store(self):
+        # Where waitlists live: the Waitlist table, or one Redis sorted set per section
+        return make_waitlist_store(self.enrollment_waitlist_backend, self.enrollment_redis_url)
+
+    def repository(self):
+        # Where Class, Enroll and Dropped live: the enrollment database, or one DynamoDB table
+        return make_repository(
+            self.enrollment_repository_backend,
+            self.enrollment_dynamodb_endpoint,
+            self.enrollment_dynamodb_table,
+            self.enrollment_dynamodb_region,
+        )
@@ -0,0 +1,100 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+import hash
+import metrics
+
+
+class HashQueueFull(Exception):
+    pass
+
+
+def hash_passwords(passwords):
+    # Runs in a worker process, one round trip for a whole chunk
+    return [hash.hash_password(password) for password in passwords]
+
+
+class HashExecutor:
+    def __init__(self, workers=0, max_pending=64, bulk_workers=0):
+        # workers caps how many hashes run at once, max_pending bounds running + queued, and
+        # bulk_workers how many of the workers bulk chunks may hold, half of them by default
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.bulk_workers = bulk_workers or max(1, self.workers // 2)
+        self._executor = None
+        self._pending = 0
+        self._bulk_slots = asyncio.Semaphore(self.bulk_workers)
+
+        self.completed = 0
+        self.rejected = 0
+        self.bulk_completed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn, so the workers don't inherit the server's threads and open connections
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def run(self, func, *args):
+        # Only ever touched from the event loop thread, so no lock is needed
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HashQueueFull()
+
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._pending -= 1
+            elapsed = time.perf_counter() - start
+            metrics.hash_done(func.__name__, elapsed)
+            self.completed += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    async def hash_password(self, password):
+        return await self.run(hash.hash_password, password)
+
+    async def verify_password(self, password, password_hash):
+        return await self.run(hash.verify_password, password, password_hash)
+
+    async def hash_passwords(self, passwords, chunk_size=32):
+        # Bulk path: one job per chunk, admitted by run() like any other, so a full queue is
+        # answered with HashQueueFull. Bulk chunks from every request share bulk_workers slots,
+        # which leaves the rest of the workers to logins.
+        async def run_chunk(chunk):
+            async with self._bulk_slots:
+                return await self.run(hash_passwords, chunk)
+
+        chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+        results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+        self.bulk_completed += len(passwords)
+        return [hashed for chunk in results for hashed in chunk]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "bulk_workers": self.bulk_workers,
+            "pending": self._pending,
+            "queued": max(0, self._pending - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "bulk_completed": self.bulk_completed,
+            "avg_time": round(self.total_time / self.completed, 6) if self.completed else 0.0,
+            "max_time": round(self.max_time, 6),
+        }
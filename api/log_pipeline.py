@@ -0,0 +1,227 @@
+import atexit
+import configparser
+import contextvars
+import json
+import logging
+import logging.config
+import queue
+import random
+import time
+import uuid
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+# Records waiting for the listener thread. Past this they are dropped, a request never waits on logging.
+QUEUE_SIZE = 10000
+
+# Seconds between the listener's warnings about records dropped on a full queue
+DROP_REPORT_INTERVAL = 10.0
+
+REQUEST_ID_HEADER = b"x-request-id"
+MAX_REQUEST_ID_LENGTH = 64
+
+# The ID of the request being handled, copied into threadpool and executor threads with the
+# rest of the context
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has. Anything else on a record came from extra= and is logged as a
+# field of its own, except uvicorn's colored copy of the message.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "request_id", "route", "color_message"}
+
+_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None) is not None:
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    # Keeps this share of DEBUG records. Inside a request the choice follows its ID, so a
+    # request's DEBUG records are kept or dropped together.
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        current = request_id.get()
+        if current is None:
+            keep = random.random() < self.rate
+        else:
+            keep = zlib.crc32(current.encode()) < self.rate * 2**32
+        if not keep:
+            metrics.log_records_dropped.inc("sampled", record.levelname)
+        return keep
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Stands in for one logger's handlers. The calling thread only renders the message, the
+    # listener thread formats and writes it.
+    def __init__(self, queue, route):
+        super().__init__(queue)
+        self.route = route
+
+    def prepare(self, record):
+        # Whatever needs the caller's state is settled here: the request ID, the arguments,
+        # which may change once the caller moves on, and the traceback
+        record.request_id = request_id.get()
+        record.route = self.route
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_records_dropped.inc("queue_full", record.levelname)
+
+
+class RoutingListener(QueueListener):
+    # One thread for every logger's handlers, each record goes to those of the logger it was
+    # logged to
+    def __init__(self, queue, routes):
+        super().__init__(queue)
+        self.routes = routes
+        self.reported_drops = 0
+        self.next_report = time.monotonic() + DROP_REPORT_INTERVAL
+
+    def handle(self, record):
+        for handler in self.routes[record.route]:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        if time.monotonic() >= self.next_report:
+            self.report_drops()
+
+    def report_drops(self):
+        self.next_report = time.monotonic() + DROP_REPORT_INTERVAL
+        dropped = dropped_records("queue_full")
+        if dropped > self.reported_drops:
+            record = logging.makeLogRecord({
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+                "msg": f"Dropped {dropped - self.reported_drops} log records, the log queue was full",
+                "route": "root",
+                "request_id": None,
+            })
+            self.reported_drops = dropped
+            self.handle(record)
+
+    def enqueue_sentinel(self):
+        # Waits for room, so stopping on a full queue still writes out what's queued
+        self.queue.put(self._sentinel)
+
+
+listener = None
+sampler = None
+
+
+def dropped_records(reason):
+    return sum(count for (why, _), count in metrics.log_records_dropped.values().items() if why == reason)
+
+
+def configured_loggers(path):
+    # The loggers a logging .ini configures, root included
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(path)
+    names = []
+    for key in parser["loggers"]["keys"].split(","):
+        names.append(None if key == "root" else parser[f"logger_{key}"]["qualname"])
+    return names
+
+
+def configure(path, debug_sample_rate=1.0, queue_size=QUEUE_SIZE):
+    # Loads a logging .ini, then moves the handlers of each logger it configures behind one
+    # bounded queue, drained by one listener thread
+    global listener, sampler
+    stop()
+    logging.config.fileConfig(path, disable_existing_loggers=False)
+
+    records = queue.Queue(queue_size)
+    sampler = DebugSampler(debug_sample_rate)
+    routes = {}
+    for name in configured_loggers(path):
+        logger = logging.getLogger(name)
+        route = name or "root"
+        routes[route] = list(logger.handlers)
+        for handler in routes[route]:
+            logger.removeHandler(handler)
+        handler = DroppingQueueHandler(records, route)
+        handler.addFilter(sampler)
+        logger.addHandler(handler)
+
+    listener = RoutingListener(records, routes)
+    listener.start()
+
+
+def stop():
+    # Writes out whatever is queued, then stops the listener thread
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(stop)
+
+
+def stats():
+    return {
+        "queued": listener.queue.qsize() if listener else 0,
+        "queue_size": listener.queue.maxsize if listener else 0,
+        "debug_sample_rate": sampler.rate if sampler else 1.0,
+        "sampled_out": dropped_records("sampled"),
+        "dropped": dropped_records("queue_full"),
+    }
+
+
+class RequestIdMiddleware:
+    # Gives every request an ID, the caller's X-Request-ID or a new one, sets it for the records
+    # logged while handling it and returns it in the response. Plain ASGI, like MetricsMiddleware.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope["headers"]).get(REQUEST_ID_HEADER)
+        value = incoming.decode("latin-1")[:MAX_REQUEST_ID_LENGTH] if incoming else uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def send_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER, value.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_request_id)
+        finally:
+            request_id.reset(token)
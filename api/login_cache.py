@@ -0,0 +1,83 @@
+import collections
+import hashlib
+import hmac
+import secrets
+import sys
+import threading
+import time
+
+
+class VerificationCache:
+    def __init__(self, max_entries=10000, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # Per-process key, so cached MACs are useless outside this worker
+        self._key = secrets.token_bytes(32)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._memory = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _cache_key(self, username, password):
+        mac = hmac.new(self._key, password.encode("utf-8"), hashlib.sha256).digest()
+        return (username, mac)
+
+    @staticmethod
+    def _entry_size(key, value):
+        return sys.getsizeof(key) + sum(map(sys.getsizeof, key)) + sys.getsizeof(value) + sum(map(sys.getsizeof, value))
+
+    def _remove(self, key):
+        value = self._entries.pop(key)
+        self._memory -= self._entry_size(key, value)
+
+    def check(self, username, password, password_hash):
+        # True only if this password was verified against this exact stored hash recently
+        key = self._cache_key(username, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False
+
+            cached_hash, expires = entry
+            if expires < time.monotonic() or not secrets.compare_digest(cached_hash, password_hash):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def add(self, username, password, password_hash):
+        key = self._cache_key(username, password)
+        value = (password_hash, time.monotonic() + self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value
+            self._memory += self._entry_size(key, value)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "memory_bytes": self._memory,
+        }
@@ -0,0 +1,232 @@
+import contextvars
+import threading
+import time
+
+import sql_timing
+
+# Off until an app calls enable(), and then never turned off. Every hook checks this first,
+# so with metrics off requests skip the middleware and connections aren't traced.
+enabled = False
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 1.0)
+# Statements per request
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, le=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for labels, counts in values:
+            # Buckets are cumulative in the exposition format
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, _number(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labels, labels, '+Inf')} {counts[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(counts[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {counts[-1]}")
+        return lines
+
+
+requests_total = Counter(
+    "http_requests_total", "Requests handled, by route and status.", ("method", "route", "status")
+)
+request_seconds = Histogram(
+    "http_request_duration_seconds", "Time from the request arriving to its last body byte sent.", ("method", "route")
+)
+request_statements = Histogram(
+    "http_request_sql_statements", "SQL statements run for one request.", ("method", "route"), COUNT_BUCKETS
+)
+request_sql_seconds = Histogram(
+    "http_request_sql_seconds", "Time a request spent in SQL statements.", ("method", "route"), SQL_BUCKETS
+)
+statements_total = Counter(
+    "sqlite_statements_total", "Statements SQLite ran, each trigger fired counted once as TRIGGER.", ("kind",)
+)
+statement_seconds = Histogram(
+    "sqlite_statement_duration_seconds", "Time spent running a statement and reading its rows.", ("kind",), SQL_BUCKETS
+)
+connect_seconds = Histogram(
+    "sqlite_connection_open_seconds", "Time to open a connection and apply its PRAGMAs.", ("database",), SQL_BUCKETS
+)
+hash_seconds = Histogram(
+    "password_hash_duration_seconds", "Time for a password hash, including the wait for a hashing process.", ("operation",)
+)
+log_records_dropped = Counter(
+    "log_records_dropped_total", "Log records dropped: DEBUG sampled out, or the log queue full.", ("reason", "level")
+)
+
+REGISTRY = [
+    requests_total, request_seconds, request_statements, request_sql_seconds,
+    statements_total, statement_seconds, connect_seconds, hash_seconds, log_records_dropped,
+]
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_time")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_time = 0.0
+
+
+# The stats of the request being handled. Copied into threadpool threads with the rest of the
+# context, and into the database executor's threads by its jobs.
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def _kind(sql):
+    # First keyword, so the label set stays small
+    word = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "WITH") else "OTHER"
+
+
+def _trace(sql):
+    if sql.startswith("--"):
+        # "-- TRIGGER name", once per trigger fired, none for the statements inside it
+        statements_total.inc("TRIGGER")
+        return
+    statements_total.inc(_kind(sql))
+    stats = current_request.get()
+    if stats is not None:
+        stats.statements += 1
+
+
+def _statement_done(db, sql, parameters, elapsed, rows):
+    statement_seconds.observe(elapsed, _kind(sql))
+    stats = current_request.get()
+    if stats is not None:
+        stats.sql_time += elapsed
+
+
+def connection_opened(db, path, elapsed):
+    if enabled:
+        db.set_trace_callback(_trace)
+        connect_seconds.observe(elapsed, path)
+
+
+def hash_done(operation, elapsed):
+    if enabled:
+        hash_seconds.observe(elapsed, operation)
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware, so streamed responses pass straight through
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            # The route template, never the path, so there is one series per endpoint
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            requests_total.inc(method, route, str(status))
+            request_seconds.observe(elapsed, method, route)
+            request_statements.observe(stats.statements, method, route)
+            request_sql_seconds.observe(stats.sql_time, method, route)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def enable(app):
+    # Call before the app opens any connection, connections opened earlier aren't traced
+    from fastapi import Response
+
+    global enabled
+    enabled = True
+    sql_timing.add_listener(_statement_done)
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        return Response(render(), media_type=CONTENT_TYPE)
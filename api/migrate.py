@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import sys
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "share", "migrations")
+SCHEMAS = ("enrollment", "auth")
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} {'|'.join(SCHEMAS)} DATABASE", file=sys.stderr)
+
+
+def migrations(schema):
+    # share/migrations/<schema>/NNNN_description.sql, applied in version order
+    directory = os.path.join(MIGRATIONS, schema)
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".sql"):
+            found.append((int(name.split("_", 1)[0]), os.path.join(directory, name)))
+    return found
+
+
+def migrate(db, schema):
+    # The schema version lives in the database header, so a live database upgrades in place
+    current = db.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+    for version, path in migrations(schema):
+        if version <= current:
+            continue
+        with open(path) as f:
+            script = f.read()
+        # Each migration and its version bump commit together, or not at all
+        try:
+            db.executescript(f"BEGIN IMMEDIATE;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        applied.append(os.path.basename(path))
+    return applied
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in SCHEMAS:
+        usage()
+        sys.exit(1)
+
+    schema, path = sys.argv[1:]
+    db = sqlite3.connect(path)
+    try:
+        applied = migrate(db, schema)
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        db.close()
+
+    for name in applied:
+        print(f"Applied {name}")
+    print(f"{path} is at {schema} schema version {version}")
@@ -0,0 +1,59 @@
+import base64
+import itertools
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(key):
+    # Opaque to clients: the sort key of the last row on the page
+    text = json.dumps(list(key), separators=(",", ":"))
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        key = json.loads(text)
+    except ValueError:
+        raise InvalidCursor() from None
+    # A key column may be NULL
+    if not isinstance(key, list) or len(key) != size or not all(value is None or isinstance(value, (str, int)) for value in key):
+        raise InvalidCursor()
+    return tuple(key)
+
+
+def page(rows, columns, limit):
+    # rows must be in (columns) order. Reads one row past the limit to know whether another page follows.
+    rows = list(itertools.islice(rows, limit + 1)) if limit else list(rows)
+    if not limit or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][column] for column in columns)
+
+
+def keyset(columns, after):
+    # SQL condition for the rows after a cursor, and its parameters
+    if after is None:
+        return "TRUE", ()
+    after = tuple(after)
+    if None not in after:
+        return f"({', '.join(columns)}) > ({', '.join('?' * len(columns))})", after
+
+    # A row value comparison with a NULL in it is never true, so compare a column at a time.
+    # NULL sorts first, as in ORDER BY.
+    terms = []
+    params = []
+    for i, (column, value) in enumerate(zip(columns, after)):
+        equal = [f"{previous} IS ?" for previous in columns[:i]]
+        greater = f"{column} IS NOT NULL" if value is None else f"{column} > ?"
+        terms.append(f"({' AND '.join([*equal, greater])})")
+        params += [*after[:i], *([] if value is None else [value])]
+    return f"({' OR '.join(terms)})", tuple(params)
+
+
+def sql_limit(limit):
+    # LIMIT -1 is no limit in SQLite
+    return -1 if limit is None else limit
@@ -0,0 +1,27 @@
+import os
+import sys
+
+from db_pool import connect
+from enrollment_settings import Settings
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program}", file=sys.stderr)
+    print("Fills every open seat from the waitlists, using the backends configured in .env", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 1:
+        usage()
+        sys.exit(1)
+
+    settings = Settings()
+    db = connect(settings.enrollment_database)
+    try:
+        promoted = settings.repository().promote_all(db, settings.waitlist_store())
+    finally:
+        db.close()
+
+    for (class_code, section_number), students in promoted.items():
+        print(f"{class_code} {section_number}: {', '.join(students)}")
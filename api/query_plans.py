@@ -0,0 +1,182 @@
+import contextlib
+import os
+import re
+import sqlite3
+import sys
+
+import migrate
+import sql_timing
+from enrollment_repository import SQLiteEnrollmentRepository, instructor_exists, instructor_usernames, student_names
+from waitlist_store import SQLiteWaitlistStore
+
+# Every statement is checked the way the code runs it: each step below calls the SQLite
+# repository, waitlist store and Student/Instructor helpers against a copy of the database, and
+# the statements they execute are explained with the parameters they ran with. The steps run in
+# order on a one-seat section with a one-place waitlist, so every branch is reached: a seat
+# taken, a student waitlisted, a full waitlist, a drop that promotes the head of the waitlist.
+
+INSTRUCTOR = "PlanInstructor"
+CLASS = "PLAN001"
+SECTION = "01"
+STUDENTS = ("PlanStudent1", "PlanStudent2", "PlanStudent3")
+FIRST, SECOND, THIRD = STUDENTS
+
+repository = SQLiteEnrollmentRepository()
+waitlist = SQLiteWaitlistStore()
+
+
+def section_class(**changes):
+    return {
+        "class_code": CLASS,
+        "section_number": SECTION,
+        "class_name": "Query Plans",
+        "department": "Computer Science",
+        "auto_enrollment": True,
+        "max_enrollment": 1,
+        "max_waitlist": 1,
+        "c_instructor_username": INSTRUCTOR,
+        **changes,
+    }
+
+
+# (name, tables the step may scan in full, step). Only the endpoints that list a whole table and
+# the registrar's batch jobs may scan one.
+STEPS = [
+    ("catalog_version", set(), lambda db: repository.catalog_version(db)),
+    ("add_class", set(), lambda db: repository.add_class(db, section_class())),
+    ("all_classes", {"Class"}, lambda db: list(repository.all_classes(db))),
+    ("all_classes_page", set(), lambda db: list(repository.all_classes(db, (CLASS, ""), 100))),
+    ("available_classes", {"Class", "SectionCounts"}, lambda db: list(repository.available_classes(db))),
+    ("available_classes_page", set(), lambda db: list(repository.available_classes(db, (CLASS, ""), 100))),
+    ("section", set(), lambda db: repository.section(db, CLASS, SECTION)),
+    ("instructor_exists", set(), lambda db: instructor_exists(db, INSTRUCTOR)),
+    ("instructor_usernames", {"Instructor"}, lambda db: instructor_usernames(db)),
+    ("enroll", set(), lambda db: repository.enroll(db, waitlist, FIRST, CLASS, SECTION)),
+    ("enroll_already_enrolled", set(), lambda db: repository.enroll(db, waitlist, FIRST, CLASS, SECTION)),
+    ("enroll_waitlisted", set(), lambda db: repository.enroll(db, waitlist, SECOND, CLASS, SECTION)),
+    ("enroll_waitlist_full", set(), lambda db: repository.enroll(db, waitlist, THIRD, CLASS, SECTION)),
+    ("enroll_many", {"json_each"}, lambda db: repository.enroll_many(
+        db, waitlist, THIRD, [(CLASS, SECTION), (CLASS, "99")], all_or_nothing=True,
+    )),
+    ("student_enrollment", set(), lambda db: (
+        list(repository.student_enrollment(db, FIRST)),
+        list(repository.student_enrollment(db, FIRST, (CLASS, ""), 100)),
+    )),
+    ("instructor_enrollment", set(), lambda db: list(repository.instructor_enrollment(db, INSTRUCTOR, (CLASS, "", ""), 100))),
+    ("waitlist_contains", set(), lambda db: waitlist.contains(db, SECOND, CLASS, SECTION)),
+    ("waitlist_position", set(), lambda db: waitlist.position(db, SECOND, CLASS, SECTION)),
+    ("waitlist_positions", set(), lambda db: waitlist.positions(db, SECOND)),
+    ("section_waitlist", {"json_each"}, lambda db: student_names(
+        db, [student_username for student_username, _ in waitlist.entries(db, CLASS, SECTION, ("", ""), 100)],
+    )),
+    ("waitlist", {"Waitlist"}, lambda db: list(waitlist.all_entries(db))),
+    ("waitlist_page", set(), lambda db: list(waitlist.all_entries(db, (CLASS, SECTION, "", ""), 100))),
+    ("waitlist_changes", set(), lambda db: waitlist.changes(db, waitlist.last_change(db) - 10, 100)),
+    ("drop", set(), lambda db: repository.drop(db, waitlist, FIRST, CLASS, SECTION)),
+    ("drop_not_enrolled", set(), lambda db: repository.drop(db, waitlist, FIRST, CLASS, SECTION)),
+    ("dropped", set(), lambda db: list(repository.dropped(db, INSTRUCTOR, CLASS, SECTION, ("",), 100))),
+    ("leave_waitlist", set(), lambda db: repository.leave_waitlist(db, waitlist, THIRD, CLASS, SECTION)),
+    ("upsert_classes", {"json_each"}, lambda db: (
+        repository.upsert_classes(db, waitlist, [section_class(max_enrollment=3)], dry_run=True),
+        repository.upsert_classes(db, waitlist, [section_class(max_enrollment=3)]),
+    )),
+    ("promote_all", {"Class", "SectionCounts"}, lambda db: repository.promote_all(db, waitlist)),
+    ("set_instructor", set(), lambda db: repository.set_instructor(db, CLASS, SECTION, INSTRUCTOR)),
+    ("freeze_enrollment", set(), lambda db: repository.freeze_enrollment(db, CLASS, SECTION)),
+    ("remove_section", set(), lambda db: repository.remove_section(db, waitlist, CLASS, SECTION)),
+]
+
+# "SCAN Class", "SCAN Class USING INDEX ...", but not "SEARCH" or "SCAN CONSTANT ROW"
+SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+# Keyset pages have to come out of an index in order, a sort reads the whole list first
+# ("RIGHT PART OF ORDER BY" only sorts the rows of one section at a time, which is fine)
+SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+# :name placeholders, not the ones inside string literals such as '$[0]'
+NAMED = re.compile(r":(\w+)")
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} [DATABASE]", file=sys.stderr)
+
+
+def schema_database(factory=sqlite3.Connection):
+    # Fresh in-memory copy of the enrollment schema with every migration applied
+    db = sqlite3.connect(":memory:", factory=factory)
+    share = os.path.join(os.path.dirname(os.path.abspath(__file__)), "share")
+    with open(os.path.join(share, "enrollmentDatabase.sql")) as f:
+        db.executescript(f.read())
+    migrate.migrate(db, "enrollment")
+    return db
+
+
+def seed(db):
+    db.execute("INSERT INTO Instructor VALUES (?, 'Query', 'Plans')", (INSTRUCTOR,))
+    db.executemany("INSERT INTO Student VALUES ('Query', 'Plans', ?)", [(student,) for student in STUDENTS])
+    db.commit()
+
+
+def null_parameters(sql):
+    # executemany doesn't report its parameters, the plan doesn't depend on them
+    names = NAMED.findall(sql)
+    if names:
+        return dict.fromkeys(names)
+    return (None,) * sql.count("?")
+
+
+def run_steps(db):
+    # [(step, sql, parameters)] of every statement the steps executed on db, each once per step
+    statements = {}
+    step = None
+
+    def capture(connection, sql, parameters, elapsed, rows):
+        if connection is db and step is not None:
+            statements.setdefault((step, sql), parameters)
+
+    sql_timing.listeners.append(capture)
+    try:
+        for step, _, run in STEPS:
+            run(db)
+        step = None
+    finally:
+        sql_timing.listeners.remove(capture)
+    return [(step, sql, parameters) for (step, sql), parameters in statements.items()]
+
+
+def table_scans(db, statements):
+    allowed = {name: tables for name, tables, _ in STEPS}
+    failures = []
+    for step, sql, parameters in statements:
+        if parameters is None:
+            parameters = null_parameters(sql)
+        for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", parameters):
+            match = SCAN.match(row[3])
+            if match and match.group(1) not in allowed[step] or row[3] == SORT:
+                failures.append((step, row[3], " ".join(sql.split())))
+    return failures
+
+
+def check(path=None):
+    # Runs the steps on an in-memory copy, so the database itself is never written
+    if path is None:
+        db = schema_database(sql_timing.TimedConnection)
+    else:
+        db = sqlite3.connect(":memory:", factory=sql_timing.TimedConnection)
+        with contextlib.closing(sqlite3.connect(path)) as source:
+            source.backup(db)
+    db.row_factory = sqlite3.Row
+    seed(db)
+    return table_scans(db, run_steps(db))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        usage()
+        sys.exit(1)
+
+    failures = check(sys.argv[1] if len(sys.argv) == 2 else None)
+    for step, detail, sql in failures:
+        print(f"{step}: {detail}\n    {sql}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,108 @@
+import contextlib
+import os
+import threading
+import time
+
+
+def read_litefs_txid(db_path):
+    # LiteFS exposes the replication position next to the database as "<txid hex>/<checksum>"
+    try:
+        with open(f"{db_path}-pos") as f:
+            return int(f.read().split("/", 1)[0], 16)
+    except (OSError, ValueError):
+        return None
+
+
+class Replica:
+    def __init__(self, path):
+        self.path = path
+        self.exists = False
+        self.txid = None
+        self.checked_at = 0.0
+        self.outstanding = 0
+        self.selected = 0
+
+
+class ReplicaRouter:
+    def __init__(self, primary_path, replica_paths, max_lag=10, check_interval=1.0):
+        self.primary = Replica(primary_path)
+        self.replicas = [Replica(path) for path in replica_paths]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        # The primary has to be reachable anyway, so know its position before serving
+        self._check(self.primary)
+        # One checker per mount, a stalled FUSE mount only blocks its own thread
+        for replica in [self.primary, *self.replicas]:
+            threading.Thread(target=self._check_loop, args=(replica,), daemon=True).start()
+
+    def _check(self, replica):
+        replica.exists = os.path.exists(replica.path)
+        replica.txid = read_litefs_txid(replica.path)
+        replica.checked_at = time.monotonic()
+
+    def _check_loop(self, replica):
+        while True:
+            self._check(replica)
+            time.sleep(self.check_interval)
+
+    def txid(self, path):
+        # The last position seen for a mount, None without LiteFS
+        for replica in [self.primary, *self.replicas]:
+            if replica.path == path:
+                return replica.txid
+        return None
+
+    def lag(self, replica):
+        if self.primary.txid is None or replica.txid is None:
+            return None
+        return max(0, self.primary.txid - replica.txid)
+
+    def _eligible(self, replica, now):
+        # A checker that hasn't reported for a few intervals is stuck on its mount
+        if not replica.exists or now - replica.checked_at > 3 * self.check_interval:
+            return False
+        # Without LiteFS positions there's nothing to compare, existence is all we can check
+        if self.primary.txid is None:
+            return True
+        lag = self.lag(replica)
+        return lag is not None and lag <= self.max_lag
+
+    @contextlib.contextmanager
+    def route(self):
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            candidates = [replica for replica in self.replicas if self._eligible(replica, now)]
+            # Least outstanding requests, falling back to the primary when no replica qualifies
+            chosen = min(candidates, key=lambda r: (r.outstanding, r.selected)) if candidates else self.primary
+            chosen.outstanding += 1
+            chosen.selected += 1
+        try:
+            yield chosen.path
+        finally:
+            with self._lock:
+                chosen.outstanding -= 1
+
+    def stats(self):
+        now = time.monotonic()
+        return [
+            {
+                "path": replica.path,
+                "primary": replica is self.primary,
+                "eligible": replica is self.primary or self._eligible(replica, now),
+                "txid": replica.txid,
+                "lag": self.lag(replica),
+                "outstanding": replica.outstanding,
+                "selected": replica.selected,
+            }
+            for replica in [self.primary, *self.replicas]
+        ]
@@ -0,0 +1,66 @@
+import collections
+import threading
+
+
+class ResponseCache:
+    # Serialized response bodies keyed by endpoint and parameters, each tagged with the data
+    # version it was built from. An entry from any other version is never returned.
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._memory = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        _, body = self._entries.pop(key)
+        self._memory -= len(body)
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            cached_version, body = entry
+            if cached_version != version:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, version, body):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, body)
+            self._memory += len(body)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "memory_bytes": self._memory,
+        }
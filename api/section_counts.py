@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import sys
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "share", "migrations", "enrollment", "0001_section_counts.sql")
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} check|rebuild DATABASE", file=sys.stderr)
+
+
+def check(db):
+    # Sections whose counters disagree with the Enroll and Waitlist rows
+    return db.execute("""
+        SELECT class_code, section_number,
+            enrolled_count, actual_enrolled,
+            waitlist_count, actual_waitlist
+        FROM (
+            SELECT class_code, section_number,
+                enrolled_count, waitlist_count,
+                (SELECT COUNT(*) FROM Enroll WHERE e_class_code = class_code AND e_section_number = section_number) AS actual_enrolled,
+                (SELECT COUNT(*) FROM Waitlist WHERE w_class_code = class_code AND w_section_number = section_number) AS actual_waitlist
+            FROM Class
+            LEFT JOIN SectionCounts ON sc_class_code = class_code AND sc_section_number = section_number
+        )
+        WHERE enrolled_count IS NOT actual_enrolled
+        OR waitlist_count IS NOT actual_waitlist
+    """).fetchall()
+
+
+def rebuild(db):
+    # Creates the table and triggers if missing, then recounts every section
+    with open(SCHEMA) as f:
+        db.executescript(f.read())
+    db.execute("""
+        DELETE FROM SectionCounts
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM Class
+            WHERE class_code = sc_class_code
+            AND section_number = sc_section_number
+        )
+    """)
+    db.commit()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("check", "rebuild"):
+        usage()
+        sys.exit(1)
+
+    command, path = sys.argv[1:]
+    with sqlite3.connect(path) as db:
+        if command == "rebuild":
+            rebuild(db)
+        mismatches = check(db)
+
+    for class_code, section_number, enrolled, actual_enrolled, waitlist, actual_waitlist in mismatches:
+        print(
+            f"{class_code} {section_number}: enrolled {enrolled} (actual {actual_enrolled}), "
+            f"waitlist {waitlist} (actual {actual_waitlist})"
+        )
+    sys.exit(1 if mismatches else 0)
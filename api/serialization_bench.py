@@ -0,0 +1,84 @@
+import os
+import sys
+import sqlite3
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import row_json
+from enrollment_api import CLASS, ENROLLMENT, ROSTER
+from query_plans import schema_database
+
+
+def usage():
+    program = os.path.basename(sys.argv[0])
+    print(f"Usage: {program} [ROWS]", file=sys.stderr)
+
+
+def sample_database(count):
+    # count sections with one enrolled student each, so every list has count rows
+    db = schema_database()
+    db.row_factory = sqlite3.Row
+    db.execute("INSERT INTO Instructor VALUES ('100', 'Ada', 'Lovelace')")
+    for i in range(count):
+        db.execute("INSERT INTO Student VALUES (?, ?, ?)", (f"First{i}", f"Last{i}", f"s{i:07d}"))
+        db.execute(
+            "INSERT INTO Class VALUES (?, ?, ?, 'Computer Science', 1, 30, 15, '100')",
+            (f"C{i // 100:06d}", f"{i % 100:02d}", f"Class número {i}"),
+        )
+        db.execute("INSERT INTO Enroll VALUES (?, ?, ?)", (f"s{i:07d}", f"C{i // 100:06d}", f"{i % 100:02d}"))
+    return db
+
+
+def per_row(encode, rows, rounds=5):
+    # Best of a few rounds, in microseconds per row
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        encode(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(rows) * 1e6
+
+
+def benchmark(count):
+    db = sample_database(count)
+    cases = [
+        ("classes", CLASS, "SELECT * FROM Class"),
+        ("enrollment", ENROLLMENT, "SELECT * FROM Enroll"),
+        ("enrollment", ROSTER, """
+            SELECT student_username, s_first_name, s_last_name, class_code, section_number, class_name
+            FROM Class, Enroll, Student
+            WHERE class_code = e_class_code AND section_number = e_section_number AND student_username = e_student_username
+        """),
+    ]
+
+    encoder = "orjson" if row_json.orjson is not None else "json"
+    print(f"{count} rows, encoder: {encoder}")
+    print(f"{'shape':<12}{'before us/row':>16}{'after us/row':>16}{'speedup':>10}")
+    for name, shape, sql in cases:
+        rows = db.execute(sql).fetchall()
+
+        def before(rows):
+            return JSONResponse(jsonable_encoder({name: rows, "next": None})).body
+
+        def after(rows):
+            return row_json.dumps({name: list(shape.dicts(rows)), "next": None})
+
+        # The fast path has to produce the same response body
+        if before(rows) != after(rows):
+            print(f"{name}: response bodies differ", file=sys.stderr)
+            sys.exit(1)
+
+        old, new = per_row(before, rows), per_row(after, rows)
+        label = f"{name}/{len(shape.columns)}"
+        print(f"{label:<12}{old:>16.2f}{new:>16.2f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 or len(sys.argv) == 2 and not sys.argv[1].isdigit():
+        usage()
+        sys.exit(1)
+
+    benchmark(int(sys.argv[1]) if len(sys.argv) == 2 else 5000)
@@ -0,0 +1,61 @@
+-- Per-section seat and waitlist counters, kept in sync by triggers on every write path
+CREATE TABLE IF NOT EXISTS SectionCounts (
+    sc_class_code CHAR(7),
+    sc_section_number CHAR(2),
+    enrolled_count INTEGER NOT NULL DEFAULT 0,
+    waitlist_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sc_class_code, sc_section_number),
+    FOREIGN KEY (sc_class_code, sc_section_number) REFERENCES Class(class_code, section_number)
+);
+
+CREATE TRIGGER IF NOT EXISTS class_insert_counts AFTER INSERT ON Class
+BEGIN
+    INSERT OR IGNORE INTO SectionCounts (sc_class_code, sc_section_number)
+    VALUES (NEW.class_code, NEW.section_number);
+END;
+
+CREATE TRIGGER IF NOT EXISTS class_delete_counts AFTER DELETE ON Class
+BEGIN
+    DELETE FROM SectionCounts
+    WHERE sc_class_code = OLD.class_code
+    AND sc_section_number = OLD.section_number;
+END;
+
+CREATE TRIGGER IF NOT EXISTS enroll_insert_counts AFTER INSERT ON Enroll
+BEGIN
+    UPDATE SectionCounts
+    SET enrolled_count = enrolled_count + 1
+    WHERE sc_class_code = NEW.e_class_code
+    AND sc_section_number = NEW.e_section_number;
+END;
+
+CREATE TRIGGER IF NOT EXISTS enroll_delete_counts AFTER DELETE ON Enroll
+BEGIN
+    UPDATE SectionCounts
+    SET enrolled_count = enrolled_count - 1
+    WHERE sc_class_code = OLD.e_class_code
+    AND sc_section_number = OLD.e_section_number;
+END;
+
+CREATE TRIGGER IF NOT EXISTS waitlist_insert_counts AFTER INSERT ON Waitlist
+BEGIN
+    UPDATE SectionCounts
+    SET waitlist_count = waitlist_count + 1
+    WHERE sc_class_code = NEW.w_class_code
+    AND sc_section_number = NEW.w_section_number;
+END;
+
+CREATE TRIGGER IF NOT EXISTS waitlist_delete_counts AFTER DELETE ON Waitlist
+BEGIN
+    UPDATE SectionCounts
+    SET waitlist_count = waitlist_count - 1
+    WHERE sc_class_code = OLD.w_class_code
+    AND sc_section_number = OLD.w_section_number;
+END;
+
+-- Seed the counters from the rows already in the database
+INSERT OR REPLACE INTO SectionCounts (sc_class_code, sc_section_number, enrolled_count, waitlist_count)
+SELECT class_code, section_number,
+    (SELECT COUNT(*) FROM Enroll WHERE e_class_code = class_code AND e_section_number = section_number),
+    (SELECT COUNT(*) FROM Waitlist WHERE w_class_code = class_code AND w_section_number = section_number)
+FROM Class;
@@ -0,0 +1,18 @@
+-- Secondary indexes for the lookups in enrollment_api.py that only had primary keys.
+-- Lookups by student on Enroll, Waitlist and Dropped are already served by their primary keys.
+
+-- Section rosters, seat checks and section removal
+CREATE INDEX IF NOT EXISTS enroll_section_idx
+ON Enroll (e_class_code, e_section_number, e_student_username);
+
+-- Section waitlists, in the order students joined them
+CREATE INDEX IF NOT EXISTS waitlist_section_idx
+ON Waitlist (w_class_code, w_section_number, timestamp, w_student_username);
+
+-- Instructor drop lists and section removal
+CREATE INDEX IF NOT EXISTS dropped_section_idx
+ON Dropped (d_class_code, d_section_number, d_student_username);
+
+-- Instructor views
+CREATE INDEX IF NOT EXISTS class_instructor_idx
+ON Class (c_instructor_username, class_code, section_number);
@@ -0,0 +1,36 @@
+-- Version counters shared by every worker, bumped by triggers in the same transaction as the
+-- write, so a cached response built from an older version is never served as current
+CREATE TABLE IF NOT EXISTS DataVersion (
+    name VARCHAR(255) PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+-- Start from a random point, so ETags handed out before the database was recreated don't match
+INSERT OR IGNORE INTO DataVersion (name, version)
+VALUES ('catalog', abs(random() % 1000000000000));
+
+-- The catalog endpoints read Class and the seat counts, so any Class change or enrollment counts
+CREATE TRIGGER IF NOT EXISTS class_insert_version AFTER INSERT ON Class
+BEGIN
+    UPDATE DataVersion SET version = version + 1 WHERE name = 'catalog';
+END;
+
+CREATE TRIGGER IF NOT EXISTS class_update_version AFTER UPDATE ON Class
+BEGIN
+    UPDATE DataVersion SET version = version + 1 WHERE name = 'catalog';
+END;
+
+CREATE TRIGGER IF NOT EXISTS class_delete_version AFTER DELETE ON Class
+BEGIN
+    UPDATE DataVersion SET version = version + 1 WHERE name = 'catalog';
+END;
+
+CREATE TRIGGER IF NOT EXISTS enroll_insert_version AFTER INSERT ON Enroll
+BEGIN
+    UPDATE DataVersion SET version = version + 1 WHERE name = 'catalog';
+END;
+
+CREATE TRIGGER IF NOT EXISTS enroll_delete_version AFTER DELETE ON Enroll
+BEGIN
+    UPDATE DataVersion SET version = version + 1 WHERE name = 'catalog';
+END;
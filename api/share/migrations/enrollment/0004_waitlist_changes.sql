@@ -0,0 +1,27 @@
+-- One row per waitlist insert or delete, written by triggers in the same transaction as the
+-- change. Every worker reads it from its last id to tell subscribed students about sections
+-- that changed, whichever worker made the change.
+CREATE TABLE IF NOT EXISTS WaitlistChange (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    class_code CHAR(7) NOT NULL,
+    section_number CHAR(2) NOT NULL,
+    student_username VARCHAR(8) NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS waitlist_insert_change AFTER INSERT ON Waitlist
+BEGIN
+    INSERT INTO WaitlistChange (class_code, section_number, student_username)
+    VALUES (NEW.w_class_code, NEW.w_section_number, NEW.w_student_username);
+END;
+
+CREATE TRIGGER IF NOT EXISTS waitlist_delete_change AFTER DELETE ON Waitlist
+BEGIN
+    INSERT INTO WaitlistChange (class_code, section_number, student_username)
+    VALUES (OLD.w_class_code, OLD.w_section_number, OLD.w_student_username);
+END;
+
+-- Readers are never far behind, so only the most recent changes are kept
+CREATE TRIGGER IF NOT EXISTS waitlist_change_prune AFTER INSERT ON WaitlistChange
+BEGIN
+    DELETE FROM WaitlistChange WHERE id <= NEW.id - 10000;
+END;
@@ -0,0 +1,167 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import sql_timing
+
+# Configured in etc/*_logging.ini
+logger = logging.getLogger("slow_queries")
+
+# After a shape's first slow run is logged in full, further slow runs of it are only counted
+# and logged as one summary line per shape per interval
+SUMMARY_INTERVAL = 60.0
+
+# Shapes tracked at once, slow runs of any other shape are only counted
+MAX_SHAPES = 1000
+
+# Statements EXPLAIN QUERY PLAN can describe
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+MAX_PARAMETERS_LENGTH = 200
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|:\w+")
+_IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+def normalize(sql):
+    # Literals and named parameters become ?, and IN lists of them one (?), so every run of a
+    # query has the same shape whatever its values
+    sql = _LITERALS.sub("?", sql)
+    sql = _IN_LISTS.sub("IN (?)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def redacted(parameters):
+    if isinstance(parameters, dict):
+        return {name: "<redacted>" for name in parameters}
+    return ["<redacted>"] * len(parameters)
+
+
+def query_plan(db, sql, parameters):
+    # Runs on a plain cursor, so the EXPLAIN isn't timed and reported itself
+    if parameters is None or sql.lstrip().split(None, 1)[0].upper() not in EXPLAINABLE:
+        return None
+    try:
+        rows = sqlite3.Cursor(db).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error as e:
+        return f"unavailable: {e}"
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append("  " * (depth[node_id] - 1) + detail)
+    return "\n".join(lines)
+
+
+class ShapeStats:
+    __slots__ = ("count", "total", "max", "rows", "window_count", "window_total", "window_max", "logged_at")
+
+    def __init__(self, now):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.window_count = 0
+        self.window_total = 0.0
+        self.window_max = 0.0
+        self.logged_at = now
+
+    def add(self, elapsed, rows):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.rows += rows
+        self.window_count += 1
+        self.window_total += elapsed
+        self.window_max = max(self.window_max, elapsed)
+
+    def take_window(self, now):
+        window = (self.window_count, self.window_total, self.window_max, now - self.logged_at)
+        self.window_count = 0
+        self.window_total = 0.0
+        self.window_max = 0.0
+        self.logged_at = now
+        return window
+
+
+class SlowQueryLog:
+    def __init__(self, interval=SUMMARY_INTERVAL, max_shapes=MAX_SHAPES):
+        self.interval = interval
+        self.max_shapes = max_shapes
+        # database path -> (threshold in seconds, redact parameters)
+        self.databases = {}
+        self.shapes = {}
+        self.untracked = 0
+        self._lock = threading.Lock()
+
+    def watch(self, path, threshold, redact=False):
+        # Call before the database's connections are opened, earlier ones aren't timed
+        self.databases[path] = (threshold, redact)
+        sql_timing.add_listener(self.statement_done)
+
+    def statement_done(self, db, sql, parameters, elapsed, rows):
+        watched = self.databases.get(db.path)
+        if watched is None or elapsed < watched[0]:
+            return
+        threshold, redact = watched
+
+        shape = normalize(sql)
+        now = time.monotonic()
+        window = None
+        with self._lock:
+            stats = self.shapes.get(shape)
+            first = stats is None
+            if first:
+                if len(self.shapes) >= self.max_shapes:
+                    self.untracked += 1
+                    return
+                stats = self.shapes[shape] = ShapeStats(now)
+            stats.add(elapsed, rows)
+            if first:
+                stats.take_window(now)
+            elif now - stats.logged_at >= self.interval:
+                window = stats.take_window(now)
+
+        if first:
+            if parameters is None:
+                shown = None
+            else:
+                shown = repr(redacted(parameters) if redact else parameters)[:MAX_PARAMETERS_LENGTH]
+            plan = query_plan(db, sql, parameters)
+            logger.warning(
+                "Slow query on %s: %.1f ms, %d rows\n  %s\n  parameters: %s\n  plan:\n    %s",
+                db.path, elapsed * 1000, rows, shape, shown, (plan or "none").replace("\n", "\n    "),
+                extra={"database": db.path, "shape": shape, "elapsed_ms": round(elapsed * 1000, 3), "rows": rows},
+            )
+        elif window is not None:
+            count, total, maximum, period = window
+            logger.warning(
+                "Slow query on %s: %d more in %.0f s, avg %.1f ms, max %.1f ms\n  %s",
+                db.path, count, period, total / count * 1000, maximum * 1000, shape,
+                extra={"database": db.path, "shape": shape, "count": count, "max_ms": round(maximum * 1000, 3)},
+            )
+
+    def stats(self, top=10):
+        with self._lock:
+            shapes = sorted(self.shapes.items(), key=lambda item: item[1].total, reverse=True)[:top]
+            return {
+                "thresholds_ms": {path: threshold * 1000 for path, (threshold, _) in self.databases.items()},
+                "shapes": len(self.shapes),
+                "untracked": self.untracked,
+                "slowest": [
+                    {
+                        "shape": shape,
+                        "count": stats.count,
+                        "total_ms": round(stats.total * 1000, 3),
+                        "max_ms": round(stats.max * 1000, 3),
+                        "avg_rows": round(stats.rows / stats.count, 1),
+                    }
+                    for shape, stats in shapes
+                ],
+            }
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,126 @@
+import sqlite3
+import time
+
+# Called as listener(db, sql, parameters, elapsed, rows) once each statement is done. Filled by
+# metrics.enable() and slow_queries.watch(); while it's empty connections aren't wrapped at all.
+listeners = []
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Adds up the time spent inside this cursor's own calls, so a stream read slowly by its
+    # client doesn't count, and reports the statement once its last row is read, or when the
+    # cursor is closed or dropped with rows left unread
+
+    _sql = None
+
+    def _start(self, sql, parameters):
+        self._done()
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _done(self):
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        for listener in listeners:
+            listener(self.connection, sql, self._parameters, self._elapsed, self._rows)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            self._elapsed += time.perf_counter() - start
+            self._done()
+            raise
+        self._elapsed += time.perf_counter() - start
+        # No result columns: a write, already finished
+        if self.description is None:
+            self._rows = max(self.rowcount, 0)
+            self._done()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        # The parameters may be a generator, consumed by now
+        self._start(sql, None)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed += time.perf_counter() - start
+            self._rows = max(self.rowcount, 0)
+            self._done()
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except BaseException:
+            self._elapsed += time.perf_counter() - start
+            self._done()
+            raise
+        self._elapsed += time.perf_counter() - start
+        self._rows += 1
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._done()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        if len(rows) < (self.arraysize if size is None else size):
+            self._done()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        self._done()
+        return rows
+
+    def close(self):
+        self._done()
+        super().close()
+
+    def __del__(self):
+        self._done()
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute doesn't go through cursor(), so both are replaced here
+    path = None
+
+    def execute(self, sql, parameters=()):
+        return self.cursor(TimedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(TimedCursor).executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    return TimedConnection if listeners else sqlite3.Connection
+
+
+def connection_opened(db, path):
+    if isinstance(db, TimedConnection):
+        db.path = path
+
+
+def add_listener(listener):
+    if listener not in listeners:
+        listeners.append(listener)
@@ -0,0 +1,35 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The api modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_plans import schema_database  # noqa: E402
+
+# A section of our own next to the sample data: one seat and two waitlist places
+CLASS_CODE = "TEST101"
+SECTION = "01"
+
+
+@pytest.fixture
+def db():
+    db = schema_database()
+    db.row_factory = sqlite3.Row
+    db.execute("""
+        INSERT INTO Class (class_code, section_number, class_name, department, auto_enrollment, max_enrollment, max_waitlist, c_instructor_username)
+        VALUES (?, ?, 'Testing', 'Computer Science', TRUE, 1, 2, 'IreneDoe100')
+    """, (CLASS_CODE, SECTION))
+    db.commit()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def waitlist():
+    fakeredis = pytest.importorskip("fakeredis")
+    from waitlist_store import RedisWaitlistStore
+
+    return RedisWaitlistStore(fakeredis.FakeRedis(decode_responses=True))
@@ -0,0 +1,180 @@
+import pytest
+
+import enrollment_engine
+from conftest import CLASS_CODE, SECTION
+from waitlist_store import ALREADY_WAITLISTED, WAITLIST_FULL, WAITLISTED
+
+# The DynamoDB repository on moto, loaded from the sample database, with the Redis waitlist on
+# fakeredis
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+
+@pytest.fixture
+def repository(db, monkeypatch):
+    from enrollment_repository import DynamoDBEnrollmentRepository
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        repository = DynamoDBEnrollmentRepository(boto3.client("dynamodb", region_name="us-east-1"), "Enrollment")
+        repository.create_table()
+        repository.load(db)
+        yield repository
+
+
+def enrolled(repository, db):
+    return sorted(
+        row["student_username"]
+        for row in repository.instructor_enrollment(db, "IreneDoe100")
+        if (row["class_code"], row["section_number"]) == (CLASS_CODE, SECTION)
+    )
+
+
+def sections(repository, db, student_username):
+    return [(row["e_class_code"], row["e_section_number"]) for row in repository.student_enrollment(db, student_username)]
+
+
+def sample_sections(db, student_username):
+    # The student's sections in the SQLite sample the table was loaded from
+    return [tuple(row) for row in db.execute(
+        "SELECT e_class_code, e_section_number FROM Enroll WHERE e_student_username=? ORDER BY e_class_code, e_section_number",
+        (student_username,),
+    )]
+
+
+def students(waitlist):
+    return [student_username for student_username, _ in waitlist.entries(None, CLASS_CODE, SECTION)]
+
+
+def enrolled_count(repository):
+    return repository._get(repository._section_key(CLASS_CODE, SECTION), consistent_read=True)["enrolled_count"]
+
+
+def test_load_copies_the_sample_data(repository, db):
+    assert [(row["class_code"], row["section_number"]) for row in repository.all_classes(db)] == [
+        (row["class_code"], row["section_number"])
+        for row in db.execute("SELECT class_code, section_number FROM Class ORDER BY class_code, section_number")
+    ]
+    assert sections(repository, db, "SamDoe123") == sample_sections(db, "SamDoe123")
+    assert repository.section(db, CLASS_CODE, SECTION)["max_enrollment"] == 1
+    assert repository.section(db, CLASS_CODE, "99") is None
+
+
+def test_enroll_takes_the_seat_then_waitlists(repository, db, waitlist):
+    enroll = repository.enroll
+    assert enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.ENROLLED
+    # The section is full now, so the seat condition fails before the duplicate is found
+    assert enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.ALREADY_ENROLLED
+    assert enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION) == WAITLISTED
+    assert enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION) == ALREADY_WAITLISTED
+    assert enroll(db, waitlist, "ScottDavis123", CLASS_CODE, SECTION) == WAITLISTED
+    assert enroll(db, waitlist, "SylviaWilson123", CLASS_CODE, SECTION) == WAITLIST_FULL
+    assert enroll(db, waitlist, "SamDoe123", CLASS_CODE, "99") == enrollment_engine.SECTION_NOT_FOUND
+
+    assert enrolled(repository, db) == ["SamDoe123"]
+    assert enrolled_count(repository) == 1
+    assert students(waitlist) == ["SteveBrown123", "ScottDavis123"]
+
+
+def test_enroll_clears_an_earlier_drop(repository, db, waitlist):
+    assert [row["student_username"] for row in repository.dropped(db, "IsabellaJohnson102", "CHEM101", "01")] == [
+        "SamDoe123", "SylviaWilson123",
+    ]
+    assert repository.enroll(db, waitlist, "SamDoe123", "CHEM101", "01") == enrollment_engine.ENROLLED
+    assert [row["student_username"] for row in repository.dropped(db, "IsabellaJohnson102", "CHEM101", "01")] == [
+        "SylviaWilson123",
+    ]
+
+
+def test_drop_passes_the_seat_to_the_head_of_the_waitlist(repository, db, waitlist):
+    for student_username in ("SamDoe123", "SteveBrown123", "ScottDavis123"):
+        repository.enroll(db, waitlist, student_username, CLASS_CODE, SECTION)
+
+    assert repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.DROPPED
+    assert enrolled(repository, db) == ["SteveBrown123"]
+    assert enrolled_count(repository) == 1
+    assert students(waitlist) == ["ScottDavis123"]
+    assert [row["student_username"] for row in repository.dropped(db, "IreneDoe100", CLASS_CODE, SECTION)] == ["SamDoe123"]
+
+    assert repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.NOT_ENROLLED
+    assert repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, "99") == enrollment_engine.SECTION_NOT_FOUND
+
+
+def test_frozen_section_keeps_its_waitlist(repository, db, waitlist):
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    repository.enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION)
+    assert repository.freeze_enrollment(db, CLASS_CODE, SECTION)
+
+    # The ConditionCheck on auto_enrollment fails, so the seat is released instead
+    assert repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.DROPPED
+    assert enrolled(repository, db) == []
+    assert enrolled_count(repository) == 0
+    assert students(waitlist) == ["SteveBrown123"]
+    assert repository.promote(db, waitlist, CLASS_CODE, SECTION) == []
+
+
+def test_upsert_fills_the_seats_it_adds(repository, db, waitlist):
+    for student_username in ("SamDoe123", "SteveBrown123", "ScottDavis123"):
+        repository.enroll(db, waitlist, student_username, CLASS_CODE, SECTION)
+    section = dict(repository.section(db, CLASS_CODE, SECTION), max_enrollment=2)
+    assert repository.upsert_classes(db, waitlist, [section], dry_run=True) == (0, 1)
+    assert enrolled_count(repository) == 1
+
+    assert repository.upsert_classes(db, waitlist, [section]) == (0, 1)
+    assert enrolled(repository, db) == ["SamDoe123", "SteveBrown123"]
+    assert enrolled_count(repository) == 2
+    assert students(waitlist) == ["ScottDavis123"]
+
+    # Seats added behind the upsert's back are still filled by promote
+    repository.client.update_item(
+        TableName=repository.table_name,
+        Key=repository._serialize(repository._section_key(CLASS_CODE, SECTION)),
+        UpdateExpression="SET max_enrollment = :n",
+        ExpressionAttributeValues={":n": {"N": "3"}},
+    )
+    assert (CLASS_CODE, SECTION) in repository.promotable_sections(db)
+    assert repository.promote(db, waitlist, CLASS_CODE, SECTION) == ["ScottDavis123"]
+    assert enrolled_count(repository) == 3
+    assert students(waitlist) == []
+
+
+def test_all_or_nothing_undoes_earlier_sections(repository, db, waitlist):
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    results = repository.enroll_many(
+        db, waitlist, "SteveBrown123", [("CPSC449", "01"), (CLASS_CODE, SECTION), (CLASS_CODE, "99"), ("MATH101", "01")],
+        all_or_nothing=True,
+    )
+    assert results == [
+        ("CPSC449", "01", enrollment_engine.ENROLLED),
+        (CLASS_CODE, SECTION, WAITLISTED),
+        (CLASS_CODE, "99", enrollment_engine.SECTION_NOT_FOUND),
+        ("MATH101", "01", enrollment_engine.NOT_ATTEMPTED),
+    ]
+    assert sections(repository, db, "SteveBrown123") == sample_sections(db, "SteveBrown123")
+    assert repository._get(repository._section_key("CPSC449", "01"), consistent_read=True)["enrolled_count"] == 2
+    assert students(waitlist) == []
+
+
+def test_add_class_and_remove_section(repository, db, waitlist):
+    section = dict(repository.section(db, CLASS_CODE, SECTION))
+    assert not repository.add_class(db, section)
+    assert repository.add_class(db, dict(section, section_number="02"))
+
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    repository.enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION)
+    assert repository.remove_section(db, waitlist, CLASS_CODE, SECTION) == enrollment_engine.SECTION_REMOVED
+    assert repository.section(db, CLASS_CODE, SECTION) is None
+    assert students(waitlist) == []
+    assert sections(repository, db, "SamDoe123") == sample_sections(db, "SamDoe123")
+    assert repository.remove_section(db, waitlist, CLASS_CODE, SECTION) == enrollment_engine.SECTION_NOT_FOUND
+
+
+def test_enroll_gives_up_when_its_transaction_keeps_failing(repository, db, waitlist, monkeypatch):
+    # A seat is free every time the transaction is rejected, as if others kept taking and
+    # freeing it: after its retries the caller is told to try again later
+    monkeypatch.setattr(repository, "_transact", lambda actions: False)
+    with pytest.raises(enrollment_engine.DatabaseBusy):
+        repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    assert students(waitlist) == []
@@ -0,0 +1,57 @@
+import contextlib
+import os
+import sqlite3
+
+import pytest
+
+from query_plans import schema_database
+
+# The enrollment service on a migrated copy of the sample database, in a directory of its own so
+# neither the .env nor the logs of the checkout are used
+
+API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    from fastapi.testclient import TestClient
+
+    directory = tmp_path_factory.mktemp("enrollment_api")
+    (directory / "var" / "log").mkdir(parents=True)
+    path = str(directory / "enrollment.db")
+    with contextlib.closing(schema_database()) as db, contextlib.closing(sqlite3.connect(path)) as copy:
+        db.backup(copy)
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(directory)
+        monkeypatch.setenv("ENROLLMENT_DATABASE", path)
+        monkeypatch.setenv("ENROLLMENT_LOGGING_CONFIG", os.path.join(API, "etc", "enrollment_logging.ini"))
+        import enrollment_api
+
+        with TestClient(enrollment_api.app) as client:
+            yield client
+
+
+def test_student_details(client):
+    response = client.get("/student_details/SamDoe123")
+    assert response.status_code == 200
+    assert response.json()["student"]["student_username"] == "SamDoe123"
+
+    response = client.get("/student_details/NoSuchStudent")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Student does not exist."}
+
+
+def test_waitlist_of_another_instructors_section_is_an_empty_page(client):
+    url = "/instructor/waitlist_for_class/instructor/{}/class/ENGL205/section/01"
+
+    response = client.get(url.format("IreneDoe100"), params={"limit": 2})
+    assert [row["student_username"] for row in response.json()["waitlist"]] == ["SamDoe123", "SteveBrown123"]
+    assert response.json()["next"] is not None
+
+    response = client.get(url.format("IsabellaJohnson102"))
+    assert response.json() == {"waitlist": [], "next": None}
+
+    response = client.get(url.format("IsabellaJohnson102"), headers={"Accept": "application/x-ndjson"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text == ""
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor, keyset, page
+
+ROWS = [
+    ("A", None, "x"),
+    ("A", None, "y"),
+    ("A", "1", "x"),
+    ("A", "2", None),
+    ("A", "2", "x"),
+    ("B", None, None),
+    ("B", "1", "x"),
+]
+
+
+@pytest.fixture
+def table():
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE T (a, b, c)")
+    db.executemany("INSERT INTO T VALUES (?, ?, ?)", ROWS)
+    yield db
+    db.close()
+
+
+def test_cursor_round_trip():
+    for key in (("CPSC449", "01"), ("CPSC449", None), (None, 3)):
+        assert decode_cursor(encode_cursor(key), 2) == key
+
+
+@pytest.mark.parametrize("cursor", ["garbage", encode_cursor(("CPSC449",)), encode_cursor((["01"], "x"))])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, 2)
+
+
+def test_keyset_walks_every_row_once_with_nulls_in_the_key(table):
+    # Two rows a page, each after the last row of the one before
+    seen = []
+    after = None
+    while True:
+        condition, params = keyset(("a", "b", "c"), after)
+        rows = table.execute(f"SELECT a, b, c FROM T WHERE {condition} ORDER BY a, b, c LIMIT 3", params).fetchall()
+        rows, cursor = page([dict(zip("abc", row)) for row in rows], ("a", "b", "c"), 2)
+        seen += [tuple(row.values()) for row in rows]
+        if cursor is None:
+            break
+        after = decode_cursor(cursor, 3)
+    assert seen == sorted(ROWS, key=lambda row: [(value is not None, value) for value in row])
@@ -0,0 +1,204 @@
+import pytest
+
+import enrollment_engine
+from conftest import CLASS_CODE, SECTION
+from enrollment_repository import SQLiteEnrollmentRepository
+from waitlist_store import ALREADY_WAITLISTED, WAITLIST_FULL, WAITLIST_LIMIT, WAITLISTED
+
+# The Redis waitlist on fakeredis, on its own and behind the SQLite repository
+
+repository = SQLiteEnrollmentRepository()
+
+
+def add(waitlist, student_username, section=(CLASS_CODE, SECTION), max_waitlist=2, max_waitlists=3, timestamp="2023-09-15 10:00:00"):
+    return waitlist.add(None, student_username, *section, max_waitlist, max_waitlists, timestamp)
+
+
+def students(waitlist, db=None):
+    return [student_username for student_username, _ in waitlist.entries(db, CLASS_CODE, SECTION)]
+
+
+def enrolled(db):
+    return [row["e_student_username"] for row in db.execute(
+        "SELECT e_student_username FROM Enroll WHERE e_class_code=? AND e_section_number=? ORDER BY e_student_username",
+        (CLASS_CODE, SECTION),
+    )]
+
+
+def test_add_checks_each_limit(waitlist):
+    assert add(waitlist, "SamDoe123") == WAITLISTED
+    assert add(waitlist, "SamDoe123") == ALREADY_WAITLISTED
+    assert add(waitlist, "SteveBrown123") == WAITLISTED
+    assert add(waitlist, "ScottDavis123") == WAITLIST_FULL
+
+    for i in range(3):
+        assert add(waitlist, "SylviaWilson123", section=(f"OTHER{i}", "01")) == WAITLISTED
+    assert add(waitlist, "SylviaWilson123", section=("OTHER3", "01")) == WAITLIST_LIMIT
+
+
+def test_entries_keep_join_order_with_ties_by_name(waitlist):
+    add(waitlist, "SteveBrown123", timestamp="2023-09-15 11:00:00")
+    add(waitlist, "SamDoe123", timestamp="2023-09-15 11:00:00")
+    assert list(waitlist.entries(None, CLASS_CODE, SECTION)) == [
+        ("SamDoe123", "2023-09-15 11:00:00"),
+        ("SteveBrown123", "2023-09-15 11:00:00"),
+    ]
+    assert students(waitlist) == ["SamDoe123", "SteveBrown123"]
+    assert list(waitlist.entries(None, CLASS_CODE, SECTION, ("2023-09-15 11:00:00", "SamDoe123"))) == [
+        ("SteveBrown123", "2023-09-15 11:00:00"),
+    ]
+    assert waitlist.position(None, "SteveBrown123", CLASS_CODE, SECTION) == 2
+    assert waitlist.positions(None, "SteveBrown123") == [
+        {"class_code": CLASS_CODE, "section_number": SECTION, "position": 2},
+    ]
+
+
+def test_remove_logs_only_removals(waitlist):
+    add(waitlist, "SamDoe123")
+    start = waitlist.last_change(None)
+
+    assert not waitlist.remove(None, "SteveBrown123", CLASS_CODE, SECTION)
+    assert waitlist.changes(None, start) == []
+
+    assert waitlist.remove(None, "SamDoe123", CLASS_CODE, SECTION)
+    assert [change[1:] for change in waitlist.changes(None, start)] == [(CLASS_CODE, SECTION, "SamDoe123")]
+    assert waitlist.positions(None, "SamDoe123") == []
+
+
+def test_remove_section(waitlist):
+    add(waitlist, "SamDoe123")
+    add(waitlist, "SteveBrown123")
+    waitlist.remove_section(None, CLASS_CODE, SECTION)
+    assert students(waitlist) == []
+    assert waitlist.positions(None, "SamDoe123") == []
+
+
+def test_journal_undoes_changes_when_the_block_raises(waitlist):
+    add(waitlist, "SamDoe123", timestamp="2023-09-15 10:00:00")
+    with pytest.raises(RuntimeError):
+        with waitlist.journal() as journaled:
+            journaled.remove(None, "SamDoe123", CLASS_CODE, SECTION)
+            add(journaled, "SteveBrown123")
+            raise RuntimeError()
+    assert list(waitlist.entries(None, CLASS_CODE, SECTION)) == [("SamDoe123", "2023-09-15 10:00:00")]
+    assert waitlist.positions(None, "SteveBrown123") == []
+
+    with waitlist.journal() as journaled:
+        add(journaled, "SteveBrown123")
+    assert students(waitlist) == ["SamDoe123", "SteveBrown123"]
+
+
+def test_enroll_takes_the_seat_then_waitlists(db, waitlist):
+    enroll = repository.enroll
+    assert enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.ENROLLED
+    assert enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.ALREADY_ENROLLED
+    assert enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION) == WAITLISTED
+    assert enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION) == ALREADY_WAITLISTED
+    assert enroll(db, waitlist, "ScottDavis123", CLASS_CODE, SECTION) == WAITLISTED
+    assert enroll(db, waitlist, "SylviaWilson123", CLASS_CODE, SECTION) == WAITLIST_FULL
+    assert enroll(db, waitlist, "SamDoe123", CLASS_CODE, "99") == enrollment_engine.SECTION_NOT_FOUND
+
+    assert enrolled(db) == ["SamDoe123"]
+    assert students(waitlist) == ["SteveBrown123", "ScottDavis123"]
+
+
+def test_drop_promotes_the_head_of_the_waitlist(db, waitlist):
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    repository.enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION)
+    repository.enroll(db, waitlist, "ScottDavis123", CLASS_CODE, SECTION)
+
+    assert repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.DROPPED
+    assert enrolled(db) == ["SteveBrown123"]
+    assert students(waitlist) == ["ScottDavis123"]
+    assert waitlist.position(db, "ScottDavis123", CLASS_CODE, SECTION) == 1
+
+    assert repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, SECTION) == enrollment_engine.NOT_ENROLLED
+    assert repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, "99") == enrollment_engine.SECTION_NOT_FOUND
+
+
+def test_frozen_section_keeps_its_waitlist(db, waitlist):
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    repository.enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION)
+    repository.freeze_enrollment(db, CLASS_CODE, SECTION)
+
+    repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    assert enrolled(db) == []
+    assert students(waitlist) == ["SteveBrown123"]
+
+
+def test_promote_fills_new_seats(db, waitlist):
+    for student_username in ("SamDoe123", "SteveBrown123", "ScottDavis123"):
+        repository.enroll(db, waitlist, student_username, CLASS_CODE, SECTION)
+    db.execute("UPDATE Class SET max_enrollment=3 WHERE class_code=? AND section_number=?", (CLASS_CODE, SECTION))
+    db.commit()
+
+    assert repository.promote_all(db, waitlist) == {(CLASS_CODE, SECTION): ["SteveBrown123", "ScottDavis123"]}
+    assert enrolled(db) == ["SamDoe123", "ScottDavis123", "SteveBrown123"]
+    assert students(waitlist) == []
+
+
+def test_upsert_fills_the_seats_it_adds(db, waitlist):
+    for student_username in ("SamDoe123", "SteveBrown123", "ScottDavis123"):
+        repository.enroll(db, waitlist, student_username, CLASS_CODE, SECTION)
+    section = dict(repository.section(db, CLASS_CODE, SECTION), max_enrollment=2)
+    assert repository.upsert_classes(db, waitlist, [section], dry_run=True) == (0, 1)
+    assert enrolled(db) == ["SamDoe123"]
+
+    assert repository.upsert_classes(db, waitlist, [section]) == (0, 1)
+    assert enrolled(db) == ["SamDoe123", "SteveBrown123"]
+    assert students(waitlist) == ["ScottDavis123"]
+
+    # Frozen, then opened again with the same seats: the last one is filled
+    repository.freeze_enrollment(db, CLASS_CODE, SECTION)
+    repository.upsert_classes(db, waitlist, [dict(section, max_enrollment=3, auto_enrollment=False)])
+    assert students(waitlist) == ["ScottDavis123"]
+    repository.upsert_classes(db, waitlist, [dict(section, max_enrollment=3)])
+    assert enrolled(db) == ["SamDoe123", "ScottDavis123", "SteveBrown123"]
+    assert students(waitlist) == []
+
+
+def test_leave_waitlist(db, waitlist):
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    repository.enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION)
+    leave = repository.leave_waitlist
+    assert leave(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION) == enrollment_engine.REMOVED_FROM_WAITLIST
+    assert leave(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION) == enrollment_engine.NOT_WAITLISTED
+
+
+def test_all_or_nothing_leaves_no_waitlist_entries(db, waitlist):
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    results = repository.enroll_many(
+        db, waitlist, "SteveBrown123", [(CLASS_CODE, SECTION), (CLASS_CODE, "99"), ("CPSC449", "01")], all_or_nothing=True,
+    )
+    assert results == [
+        (CLASS_CODE, SECTION, WAITLISTED),
+        (CLASS_CODE, "99", enrollment_engine.SECTION_NOT_FOUND),
+        ("CPSC449", "01", enrollment_engine.NOT_ATTEMPTED),
+    ]
+    assert students(waitlist) == []
+    assert waitlist.positions(db, "SteveBrown123") == []
+
+
+def test_failed_transaction_puts_the_waitlist_back(db, waitlist, monkeypatch):
+    repository.enroll(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    repository.enroll(db, waitlist, "SteveBrown123", CLASS_CODE, SECTION)
+    entries = list(waitlist.entries(db, CLASS_CODE, SECTION))
+
+    def fail_after(body):
+        def run(*args):
+            body(*args)
+            raise RuntimeError()
+        return run
+
+    # The drop promotes SteveBrown123 in Redis, then the SQLite transaction fails
+    monkeypatch.setattr(enrollment_engine, "drop", fail_after(enrollment_engine.drop))
+    with pytest.raises(RuntimeError):
+        repository.drop(db, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+    assert enrolled(db) == ["SamDoe123"]
+    assert list(waitlist.entries(db, CLASS_CODE, SECTION)) == entries
+
+    monkeypatch.setattr(enrollment_engine, "enroll", fail_after(enrollment_engine.enroll))
+    with pytest.raises(RuntimeError):
+        repository.enroll(db, waitlist, "ScottDavis123", CLASS_CODE, SECTION)
+    assert list(waitlist.entries(db, CLASS_CODE, SECTION)) == entries
+    assert waitlist.positions(db, "ScottDavis123") == []
@@ -0,0 +1,84 @@
+import asyncio
+import contextlib
+import sqlite3
+import threading
+
+import pytest
+
+import enrollment_engine
+from conftest import CLASS_CODE, SECTION
+from db_executor import QueryTimeout
+from enrollment_repository import SQLiteEnrollmentRepository
+from waitlist_store import WAITLISTED, SQLiteWaitlistStore
+from write_coalescer import WriteCoalescer
+
+# The group commit writer on a copy of the test database, with the SQLite waitlist
+
+repository = SQLiteEnrollmentRepository()
+waitlist = SQLiteWaitlistStore()
+
+
+@pytest.fixture
+def path(db, tmp_path):
+    path = str(tmp_path / "enrollment.db")
+    with contextlib.closing(sqlite3.connect(path)) as copy:
+        db.backup(copy)
+    return path
+
+
+@pytest.fixture
+def coalescer(path):
+    coalescer = WriteCoalescer(path, window=0.05, timeout=0.5)
+    yield coalescer
+    coalescer.shutdown()
+
+
+def enrolled(path):
+    with contextlib.closing(sqlite3.connect(path)) as db:
+        return [row[0] for row in db.execute(
+            "SELECT e_student_username FROM Enroll WHERE e_class_code=? AND e_section_number=? ORDER BY e_student_username",
+            (CLASS_CODE, SECTION),
+        )]
+
+
+def test_run_transaction_does_not_join_a_transaction_left_open(db):
+    db.execute("BEGIN")
+    with pytest.raises(sqlite3.OperationalError):
+        enrollment_engine.run_transaction(db, lambda db: None)
+
+
+def test_batch_commits_each_intent(coalescer, path):
+    async def main():
+        return await asyncio.gather(
+            coalescer.run(repository.enroll, waitlist, "SamDoe123", CLASS_CODE, SECTION),
+            coalescer.run(repository.enroll, waitlist, "SteveBrown123", CLASS_CODE, SECTION),
+            coalescer.run(repository.enroll, waitlist, "SamDoe123", CLASS_CODE, "99"),
+        )
+
+    assert asyncio.run(main()) == [enrollment_engine.ENROLLED, WAITLISTED, enrollment_engine.SECTION_NOT_FOUND]
+    assert enrolled(path) == ["SamDoe123"]
+    assert coalescer.stats()["batches"] == 1
+
+
+def test_timed_out_intent_still_queued_is_not_applied(coalescer, path):
+    release = threading.Event()
+
+    def slow(db):
+        release.wait()
+
+    async def main():
+        # The first batch holds the writer past the timeout of the intent queued behind it
+        first = asyncio.ensure_future(coalescer.run(slow))
+        await asyncio.sleep(0.1)
+        with pytest.raises(QueryTimeout):
+            await coalescer.run(repository.enroll, waitlist, "SamDoe123", CLASS_CODE, SECTION)
+        release.set()
+        with pytest.raises(QueryTimeout):
+            await first
+        # Applied after the intent that timed out, had that one been kept
+        await coalescer.run(lambda db: None)
+
+    asyncio.run(main())
+    assert enrolled(path) == []
+    assert coalescer.stats()["timeouts"] == 2
+    assert coalescer.stats()["cancelled"] == 1
@@ -0,0 +1,161 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+class DataVersionWatch:
+    # PRAGMA data_version only changes when another connection commits, so keep one connection to ask
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self._db is None:
+                self._db = sqlite3.connect(self.path, check_same_thread=False)
+            return ("data_version", self._db.execute("PRAGMA data_version").fetchone()[0])
+
+
+def is_newer(version, than):
+    # Versions of different kinds, LiteFS positions and data_version counters, don't compare
+    return version is not None and than is not None and version[0] == than[0] and version[1] >= than[1]
+
+
+class UserDirectory:
+    def __init__(self, version, check_interval=1.0):
+        # version() returns a (kind, number) token that grows whenever the auth database
+        # changes. It's polled every check_interval seconds by a thread of its own, so logins
+        # never ask for it, and an entry can be that much out of date.
+        self._version_source = version
+        self.check_interval = check_interval
+        self._version = None
+        self._users = {}
+        self._role_sets = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._check_version()
+        threading.Thread(target=self._check_loop, daemon=True).start()
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            self._check_version()
+
+    def _check_version(self):
+        version = self._version_source()
+        if version != self._version:
+            with self._lock:
+                if self._users:
+                    self.invalidations += 1
+                self._users = {}
+                self._version = version
+        return version
+
+    def _entry(self, password_hash, roles):
+        # Most users share one of a handful of role lists, store each distinct list once
+        roles = tuple(sys.intern(role) for role in roles)
+        return (password_hash, self._role_sets.setdefault(roles, roles))
+
+    def cached(self, username):
+        # No SQL, safe to call on the event loop
+        self.start()
+        entry = self._users.get(username)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def load(self, db, username, read_version):
+        # A miss. read_version is what the database read from is known to be at least as new
+        # as, or None if that can't be told, and only rows at least as new as the directory's
+        # own version are cached: a lagging replica's row is returned but not kept.
+        rows = db.execute("""
+                SELECT password, role
+                FROM User LEFT JOIN Roles ON r_username=username
+                WHERE username=?
+            """, (username,)).fetchall()
+        with self._lock:
+            self.misses += 1
+        if not rows:
+            return None
+
+        entry = self._entry(rows[0]["password"], [row["role"] for row in rows if row["role"] is not None])
+        with self._lock:
+            if is_newer(read_version, self._version):
+                self._users[username] = entry
+        return entry
+
+    def load_all(self, db):
+        version = self._version_source()
+        users = {}
+        roles = {}
+        for row in db.execute("SELECT r_username, role FROM Roles"):
+            roles.setdefault(row["r_username"], []).append(row["role"])
+        for row in db.execute("SELECT username, password FROM User"):
+            users[row["username"]] = self._entry(row["password"], roles.get(row["username"], ()))
+        with self._lock:
+            self._users = users
+            self._version = version
+
+    def save_snapshot(self, path):
+        with self._lock:
+            snapshot = {"version": self._version, "users": self._users}
+        tmp_path = f"{path}.tmp"
+        # Holds password hashes, so readable by the owner only
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def load_snapshot(self, path):
+        # Only trusted if the database hasn't moved on since the snapshot was taken
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        version = self._version_source()
+        if snapshot.get("version") != list(version):
+            return False
+        users = {username: self._entry(password_hash, roles) for username, (password_hash, roles) in snapshot["users"].items()}
+        with self._lock:
+            self._users = users
+            self._version = version
+        return True
+
+    def warm(self, db, snapshot_path):
+        if self.load_snapshot(snapshot_path):
+            return "snapshot"
+        self.load_all(db)
+        # data_version means nothing to another process, only LiteFS positions survive a restart
+        if self._version[0] != "data_version":
+            self.save_snapshot(snapshot_path)
+        return "database"
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "role_sets": len(self._role_sets),
+            "version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import threading
+
+
+class Subscription:
+    # One open event stream. Kept small, a worker may hold thousands of idle ones.
+    __slots__ = ("student_username", "loop", "positions", "pending", "wakeup")
+
+    def __init__(self, student_username, loop):
+        self.student_username = student_username
+        self.loop = loop
+        # {(class_code, section_number): position} as last sent, None until the first snapshot
+        self.positions = None
+        self.pending = []
+        self.wakeup = asyncio.Event()
+
+    def _push(self, events):
+        # Runs on the event loop
+        self.pending.extend(events)
+        self.wakeup.set()
+
+    async def next_events(self, timeout):
+        # The (name, data) events since the last call, or [] if none arrive within timeout
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.wakeup.clear()
+        events, self.pending = self.pending, []
+        return events
+
+
+class WaitlistNotifier:
+    # Every worker runs one thread that follows the waitlist store's change log, so a change made
+    # by any worker reaches the subscribers of all of them. Only sections that changed and have a
+    # subscriber waiting in them are read, once per batch of changes however many subscribers.
+
+    def __init__(self, waitlist, repository, connect, poll_interval=0.5, batch_size=1000):
+        self.waitlist = waitlist
+        self.repository = repository
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+
+        # Everything below is shared by the event loop and the notifier thread, under _lock
+        self._lock = threading.Lock()
+        self._students = {}
+        self._sections = {}
+        self._new = []
+
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self.changes_read = 0
+        self.events_sent = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="waitlist-notifier", daemon=True)
+                self._thread.start()
+
+    def subscribe(self, student_username):
+        # Called on the event loop. The first event is a snapshot of every position.
+        self._start()
+        subscription = Subscription(student_username, asyncio.get_running_loop())
+        with self._lock:
+            self._students.setdefault(student_username, set()).add(subscription)
+            self._new.append(subscription)
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._students.get(subscription.student_username, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._students.pop(subscription.student_username, None)
+            for section in subscription.positions or ():
+                self._unwatch(section, subscription)
+            subscription.positions = None
+            if subscription in self._new:
+                self._new.remove(subscription)
+
+    def _unwatch(self, section, subscription):
+        watchers = self._sections.get(section)
+        if watchers is not None:
+            watchers.discard(subscription)
+            if not watchers:
+                del self._sections[section]
+
+    def _run(self):
+        db = self.connect()
+        after = self.waitlist.last_change(db)
+        while True:
+            try:
+                with self._lock:
+                    new, self._new = self._new, []
+                for subscription in new:
+                    self._snapshot(db, subscription)
+
+                changes = self.waitlist.changes(db, after, self.batch_size)
+                if changes:
+                    after = changes[-1][0]
+                    self.changes_read += len(changes)
+                    self._dispatch(db, changes)
+                elif not new:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+            except Exception:
+                logging.getLogger(__name__).exception("Reading waitlist changes failed")
+                self._wakeup.wait(self.poll_interval)
+
+    def _snapshot(self, db, subscription):
+        positions = {
+            (row["class_code"], row["section_number"]): row["position"]
+            for row in self.waitlist.positions(db, subscription.student_username)
+        }
+        with self._lock:
+            if subscription not in self._students.get(subscription.student_username, ()):
+                return
+            subscription.positions = positions
+            for section in positions:
+                self._sections.setdefault(section, set()).add(subscription)
+
+        waitlists = [
+            {"class_code": class_code, "section_number": section_number, "position": position}
+            for (class_code, section_number), position in sorted(positions.items())
+        ]
+        self._send(subscription, [("waitlists", {"waitlists": waitlists})])
+
+    def _dispatch(self, db, changes):
+        # Sections that changed, with the students who joined or left them
+        sections = {}
+        for _, class_code, section_number, student_username in changes:
+            sections.setdefault((class_code, section_number), set()).add(student_username)
+
+        for section, students in sections.items():
+            with self._lock:
+                watchers = set(self._sections.get(section, ()))
+                for student_username in students:
+                    watchers.update(
+                        subscription
+                        for subscription in self._students.get(student_username, ())
+                        if subscription.positions is not None
+                    )
+            if not watchers:
+                continue
+
+            ranks = {
+                student_username: position
+                for position, (student_username, _) in enumerate(self.waitlist.entries(db, *section), 1)
+            }
+            for subscription in watchers:
+                self._update(db, subscription, section, ranks.get(subscription.student_username))
+
+    def _update(self, db, subscription, section, position):
+        with self._lock:
+            if subscription.positions is None or subscription.positions.get(section) == position:
+                return
+            if position is None:
+                del subscription.positions[section]
+                self._unwatch(section, subscription)
+            else:
+                subscription.positions[section] = position
+                self._sections.setdefault(section, set()).add(subscription)
+
+        class_code, section_number = section
+        data = {"class_code": class_code, "section_number": section_number}
+        if position is not None:
+            event = ("position", {**data, "position": position})
+        elif self._enrolled(db, subscription.student_username, section):
+            event = ("promoted", data)
+        else:
+            event = ("removed", data)
+        self._send(subscription, [event])
+
+    def _enrolled(self, db, student_username, section):
+        return any(
+            (row["e_class_code"], row["e_section_number"]) == section
+            for row in self.repository.student_enrollment(db, student_username)
+        )
+
+    def _send(self, subscription, events):
+        self.events_sent += len(events)
+        try:
+            subscription.loop.call_soon_threadsafe(subscription._push, events)
+        except RuntimeError:
+            # The subscriber's event loop has closed
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscriptions": sum(len(subscriptions) for subscriptions in self._students.values()),
+                "watched_sections": len(self._sections),
+                "changes_read": self.changes_read,
+                "events_sent": self.events_sent,
+            }
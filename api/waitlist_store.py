@@ -0,0 +1,425 @@
+import contextlib
+import copy
+import datetime
+import itertools
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from pagination import keyset, sql_limit
+
+# Outcomes of adding a student to a waitlist, shared with enrollment_engine
+WAITLISTED = "waitlisted"
+ALREADY_WAITLISTED = "already_waitlisted"
+WAITLIST_FULL = "waitlist_full"
+WAITLIST_LIMIT = "waitlist_limit"
+
+
+class WaitlistStore:
+    # Every method takes the request's SQLite connection. The SQLite store works inside
+    # its transaction, other backends ignore it.
+
+    def add(self, db, student_username, class_code, section_number, max_waitlist, max_waitlists, timestamp):
+        raise NotImplementedError
+
+    def contains(self, db, student_username, class_code, section_number):
+        raise NotImplementedError
+
+    def remove(self, db, student_username, class_code, section_number):
+        raise NotImplementedError
+
+    def remove_section(self, db, class_code, section_number):
+        raise NotImplementedError
+
+    def position(self, db, student_username, class_code, section_number):
+        raise NotImplementedError
+
+    def positions(self, db, student_username):
+        raise NotImplementedError
+
+    def entries(self, db, class_code, section_number, after=None, limit=None):
+        # (student_username, timestamp) in waitlist order, after the (timestamp, student_username) cursor
+        raise NotImplementedError
+
+    def all_entries(self, db, after=None, limit=None):
+        # Every entry ordered by (w_class_code, w_section_number, timestamp, w_student_username)
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def journal(self):
+        # The store to hand to a SQLite transaction's body. Changes to the SQLite store roll back
+        # with the transaction; a store kept elsewhere undoes them if the block raises.
+        yield self
+
+    # Every add and remove is also appended to a change log shared by all workers
+
+    def last_change(self, db):
+        # Cursor for changes() that skips everything logged so far
+        raise NotImplementedError
+
+    def changes(self, db, after, limit=None):
+        # (cursor, class_code, section_number, student_username) logged after the cursor, oldest first
+        raise NotImplementedError
+
+
+class SQLiteWaitlistStore(WaitlistStore):
+
+    def add(self, db, student_username, class_code, section_number, max_waitlist, max_waitlists, timestamp):
+        params = {
+            "student": student_username,
+            "class_code": class_code,
+            "section": section_number,
+            "max_waitlist": max_waitlist,
+            "max_waitlists": max_waitlists,
+            "timestamp": timestamp,
+        }
+
+        added = db.execute("""
+            INSERT INTO Waitlist (w_student_username, w_class_code, w_section_number, timestamp)
+            SELECT :student, :class_code, :section, :timestamp
+            FROM SectionCounts
+            WHERE sc_class_code=:class_code
+            AND sc_section_number=:section
+            AND waitlist_count < :max_waitlist
+            AND (
+                SELECT COUNT(*)
+                FROM Waitlist
+                WHERE w_student_username=:student
+            ) < :max_waitlists
+            AND NOT EXISTS (
+                SELECT 1
+                FROM Waitlist
+                WHERE w_student_username=:student
+                AND w_class_code=:class_code
+                AND w_section_number=:section
+            )
+        """, params).rowcount
+
+        if added:
+            return WAITLISTED
+
+        # Work out which condition stopped the insert
+        reasons = db.execute("""
+            SELECT
+                EXISTS (
+                    SELECT 1
+                    FROM Waitlist
+                    WHERE w_student_username=:student
+                    AND w_class_code=:class_code
+                    AND w_section_number=:section
+                ) AS waitlisted,
+                waitlist_count >= :max_waitlist AS waitlist_full
+            FROM SectionCounts
+            WHERE sc_class_code=:class_code
+            AND sc_section_number=:section
+        """, params).fetchone()
+
+        if reasons["waitlisted"]:
+            return ALREADY_WAITLISTED
+        if reasons["waitlist_full"]:
+            return WAITLIST_FULL
+        return WAITLIST_LIMIT
+
+    def contains(self, db, student_username, class_code, section_number):
+        return db.execute("""
+            SELECT 1
+            FROM Waitlist
+            WHERE w_student_username=?
+            AND w_class_code=?
+            AND w_section_number=?
+        """, (student_username, class_code, section_number)).fetchone() is not None
+
+    def remove(self, db, student_username, class_code, section_number):
+        return db.execute("""
+            DELETE
+            FROM Waitlist
+            WHERE w_student_username=?
+            AND w_class_code=?
+            AND w_section_number=?
+        """, (student_username, class_code, section_number)).rowcount > 0
+
+    def remove_section(self, db, class_code, section_number):
+        db.execute("""
+            DELETE FROM Waitlist
+            WHERE w_class_code=?
+            AND w_section_number=?
+        """, (class_code, section_number))
+
+    def position(self, db, student_username, class_code, section_number):
+        # Rank by counting the entries ahead in the section's (timestamp, username) index order,
+        # the username breaks ties between students who joined at the same instant
+        row = db.execute("""
+            SELECT (
+                SELECT COUNT(*)
+                FROM Waitlist AS ahead
+                WHERE ahead.w_class_code=me.w_class_code
+                AND ahead.w_section_number=me.w_section_number
+                AND (ahead.timestamp, ahead.w_student_username) < (me.timestamp, me.w_student_username)
+            ) + 1 AS position
+            FROM Waitlist AS me
+            WHERE me.w_student_username=?
+            AND me.w_class_code=?
+            AND me.w_section_number=?
+        """, (student_username, class_code, section_number)).fetchone()
+        return row["position"] if row else None
+
+    def positions(self, db, student_username):
+        return db.execute("""
+            SELECT me.w_class_code AS class_code, me.w_section_number AS section_number, (
+                SELECT COUNT(*)
+                FROM Waitlist AS ahead
+                WHERE ahead.w_class_code=me.w_class_code
+                AND ahead.w_section_number=me.w_section_number
+                AND (ahead.timestamp, ahead.w_student_username) < (me.timestamp, me.w_student_username)
+            ) + 1 AS position
+            FROM Waitlist AS me
+            WHERE me.w_student_username=?
+        """, (student_username,)).fetchall()
+
+    def entries(self, db, class_code, section_number, after=None, limit=None):
+        after_sql, after_params = keyset(("timestamp", "w_student_username"), after)
+        return db.execute(f"""
+            SELECT w_student_username, timestamp
+            FROM Waitlist
+            WHERE w_class_code=?
+            AND w_section_number=?
+            AND {after_sql}
+            ORDER BY timestamp, w_student_username
+            LIMIT ?
+        """, (class_code, section_number, *after_params, sql_limit(limit)))
+
+    def all_entries(self, db, after=None, limit=None):
+        after_sql, after_params = keyset(("w_class_code", "w_section_number", "timestamp", "w_student_username"), after)
+        return db.execute(f"""
+            SELECT *
+            FROM Waitlist
+            WHERE {after_sql}
+            ORDER BY w_class_code, w_section_number, timestamp, w_student_username
+            LIMIT ?
+        """, (*after_params, sql_limit(limit)))
+
+    def last_change(self, db):
+        # Written by triggers on Waitlist
+        return db.execute("SELECT COALESCE(MAX(id), 0) FROM WaitlistChange").fetchone()[0]
+
+    def changes(self, db, after, limit=None):
+        return db.execute("""
+            SELECT id, class_code, section_number, student_username
+            FROM WaitlistChange
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (after, sql_limit(limit))).fetchall()
+
+
+class RedisWaitlistStore(WaitlistStore):
+    # One sorted set per section scored by join time, so rank and length are O(log n),
+    # plus one set per student of the sections they wait for to enforce the per-student limit
+
+    # Entries read per round trip when listing a waitlist
+    BATCH_SIZE = 500
+    EPOCH = datetime.datetime(1970, 1, 1)
+    # The change log is a stream trimmed to about this many entries
+    CHANGES_KEY = "waitlist_changes"
+    MAX_CHANGES = 10000
+
+    # The undo actions of the journal() block this copy of the store belongs to
+    _undo = None
+
+    def __init__(self, client):
+        # Any redis-py compatible client created with decode_responses=True, e.g. fakeredis
+        self.client = client
+
+    @contextlib.contextmanager
+    def journal(self):
+        journaled = copy.copy(self)
+        journaled._undo = []
+        try:
+            yield journaled
+        except BaseException:
+            for undo in reversed(journaled._undo):
+                undo()
+            raise
+
+    def _journal(self, undo, *args):
+        if self._undo is not None:
+            self._undo.append(lambda: undo(*args))
+
+    @staticmethod
+    def section_key(class_code, section_number):
+        return f"waitlist:{class_code}:{section_number}"
+
+    @staticmethod
+    def student_key(student_username):
+        return f"student_waitlists:{student_username}"
+
+    def _log_change(self, pipe, student_username, class_code, section_number):
+        pipe.xadd(
+            self.CHANGES_KEY,
+            {"class_code": class_code, "section_number": section_number, "student_username": student_username},
+            maxlen=self.MAX_CHANGES,
+            approximate=True,
+        )
+
+    @classmethod
+    def _score(cls, timestamp):
+        # Whole microseconds, so a timestamp survives the round trip through a double exactly
+        return (datetime.datetime.fromisoformat(timestamp) - cls.EPOCH) // datetime.timedelta(microseconds=1)
+
+    @classmethod
+    def _timestamp(cls, score):
+        return (cls.EPOCH + datetime.timedelta(microseconds=int(score))).isoformat(" ")
+
+    def add(self, db, student_username, class_code, section_number, max_waitlist, max_waitlists, timestamp):
+        section_key = self.section_key(class_code, section_number)
+        student_key = self.student_key(student_username)
+
+        def add_if_allowed(pipe):
+            # Reads happen under WATCH, the writes only commit if neither key changed meanwhile
+            if pipe.zscore(section_key, student_username) is not None:
+                return ALREADY_WAITLISTED
+            if pipe.zcard(section_key) >= max_waitlist:
+                return WAITLIST_FULL
+            if pipe.scard(student_key) >= max_waitlists:
+                return WAITLIST_LIMIT
+            pipe.multi()
+            pipe.zadd(section_key, {student_username: self._score(timestamp)})
+            pipe.sadd(student_key, f"{class_code}:{section_number}")
+            self._log_change(pipe, student_username, class_code, section_number)
+            return WAITLISTED
+
+        outcome = self.client.transaction(add_if_allowed, section_key, student_key, value_from_callable=True)
+        if outcome == WAITLISTED:
+            self._journal(self._remove, student_username, class_code, section_number)
+        return outcome
+
+    def contains(self, db, student_username, class_code, section_number):
+        return self.client.zscore(self.section_key(class_code, section_number), student_username) is not None
+
+    def remove(self, db, student_username, class_code, section_number):
+        score = self._remove(student_username, class_code, section_number)
+        if score is None:
+            return False
+        self._journal(self._restore, student_username, class_code, section_number, score)
+        return True
+
+    def _remove(self, student_username, class_code, section_number):
+        # The entry's score, None if there was no entry, in which case nothing is logged either
+        section_key = self.section_key(class_code, section_number)
+
+        def remove_if_waitlisted(pipe):
+            score = pipe.zscore(section_key, student_username)
+            if score is None:
+                return None
+            pipe.multi()
+            pipe.zrem(section_key, student_username)
+            pipe.srem(self.student_key(student_username), f"{class_code}:{section_number}")
+            self._log_change(pipe, student_username, class_code, section_number)
+            return score
+
+        return self.client.transaction(remove_if_waitlisted, section_key, value_from_callable=True)
+
+    def _restore(self, student_username, class_code, section_number, score):
+        # Puts back a removed entry in its old place, whatever the limits say now
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zadd(self.section_key(class_code, section_number), {student_username: score})
+        pipe.sadd(self.student_key(student_username), f"{class_code}:{section_number}")
+        self._log_change(pipe, student_username, class_code, section_number)
+        pipe.execute()
+
+    def remove_section(self, db, class_code, section_number):
+        section_key = self.section_key(class_code, section_number)
+
+        def remove_all(pipe):
+            entries = pipe.zrange(section_key, 0, -1, withscores=True)
+            pipe.multi()
+            for student_username, _ in entries:
+                pipe.srem(self.student_key(student_username), f"{class_code}:{section_number}")
+                self._log_change(pipe, student_username, class_code, section_number)
+            pipe.delete(section_key)
+            return entries
+
+        entries = self.client.transaction(remove_all, section_key, value_from_callable=True)
+        for student_username, score in entries:
+            self._journal(self._restore, student_username, class_code, section_number, score)
+
+    def position(self, db, student_username, class_code, section_number):
+        rank = self.client.zrank(self.section_key(class_code, section_number), student_username)
+        return None if rank is None else rank + 1
+
+    def positions(self, db, student_username):
+        sections = sorted(self.client.smembers(self.student_key(student_username)))
+        pipe = self.client.pipeline(transaction=False)
+        for section in sections:
+            pipe.zrank(self.section_key(*section.split(":", 1)), student_username)
+        positions = []
+        for section, rank in zip(sections, pipe.execute()):
+            if rank is not None:
+                class_code, section_number = section.split(":", 1)
+                positions.append({"class_code": class_code, "section_number": section_number, "position": rank + 1})
+        return positions
+
+    def entries(self, db, class_code, section_number, after=None, limit=None):
+        return itertools.islice(self._entries(class_code, section_number, after), limit)
+
+    def _entries(self, class_code, section_number, after):
+        # Members with the same score are ordered by name, like the SQLite tie-breaker
+        section_key = self.section_key(class_code, section_number)
+        # Every entry here has a timestamp, so all of them come after a NULL one
+        after_key = (self._score(after[0]), after[1]) if after and after[0] is not None else None
+        offset = 0
+        while True:
+            batch = self.client.zrangebyscore(
+                section_key, after_key[0] if after_key else "-inf", "+inf",
+                start=offset, num=self.BATCH_SIZE, withscores=True,
+            )
+            for student_username, score in batch:
+                if after_key is None or (score, student_username) > after_key:
+                    yield (student_username, self._timestamp(score))
+            if len(batch) < self.BATCH_SIZE:
+                return
+            offset += len(batch)
+
+    def all_entries(self, db, after=None, limit=None):
+        return itertools.islice(self._all_entries(after), limit)
+
+    def _all_entries(self, after):
+        sections = sorted(
+            tuple(section_key.split(":", 2)[1:]) for section_key in self.client.scan_iter(match="waitlist:*")
+        )
+        for class_code, section_number in sections:
+            if after and (class_code, section_number) < tuple(after[:2]):
+                continue
+            section_after = after[2:] if after and (class_code, section_number) == tuple(after[:2]) else None
+            for student_username, timestamp in self._entries(class_code, section_number, section_after):
+                yield {
+                    "w_student_username": student_username,
+                    "w_class_code": class_code,
+                    "w_section_number": section_number,
+                    "timestamp": timestamp,
+                }
+
+    def last_change(self, db):
+        latest = self.client.xrevrange(self.CHANGES_KEY, count=1)
+        return latest[0][0] if latest else "0-0"
+
+    def changes(self, db, after, limit=None):
+        # XREAD returns the entries after an id, without blocking
+        streams = self.client.xread({self.CHANGES_KEY: after}, count=limit)
+        return [
+            (change_id, fields["class_code"], fields["section_number"], fields["student_username"])
+            for _, entries in streams
+            for change_id, fields in entries
+        ]
+
+
+def make_waitlist_store(backend, redis_url=None):
+    if backend == "sqlite":
+        return SQLiteWaitlistStore()
+    if backend == "redis":
+        if redis is None:
+            raise RuntimeError("The redis waitlist backend needs the redis package (pip install redis)")
+        return RedisWaitlistStore(redis.Redis.from_url(redis_url, decode_responses=True))
+    raise ValueError(f"Unknown waitlist backend: {backend}")
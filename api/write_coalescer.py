@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+
+from db_executor import DatabaseQueueFull, QueryTimeout, _settle
+from db_pool import DEFAULT_PRAGMAS, connect
+from enrollment_engine import DatabaseBusy, run_in_batch, run_transaction
+
+
+class _Intent:
+    def __init__(self, loop, func, args):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.func = func
+        self.args = args
+        # Run in the caller's context, so per-request state follows the intent onto the writer
+        self.context = contextvars.copy_context()
+        self.queued_at = time.perf_counter()
+        self.result = None
+        self.error = None
+
+        # Once the writer has taken it into a batch the intent is committed with the others,
+        # before that a caller that gives up takes it back
+        self.started = False
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            self.started = not self.cancelled
+            return self.started
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = not self.started
+
+
+class WriteCoalescer:
+    # One writer thread and connection per worker, fed from a bounded queue. Intents that arrive
+    # within a window of the first one, up to max_batch, are applied in one transaction with one
+    # commit, each in a savepoint of its own: an intent that fails is rolled back alone, and every
+    # caller gets its own result or error once the batch is committed.
+    def __init__(self, path, window=0.002, max_batch=64, max_queue=1024, timeout=5.0, pragmas=None, cached_statements=256):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.cached_statements = cached_statements
+
+        self._intents = queue.Queue(max_queue)
+        self._writer = None
+        self._lock = threading.Lock()
+
+        self.intents = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.failed_batches = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.queue_time = 0.0
+        self.commit_time = 0.0
+
+    def _start(self):
+        # The thread is started on first use, in the worker process that uses it
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is not None:
+                return
+            self._writer = threading.Thread(target=self._write, name="write-coalescer", daemon=True)
+            self._writer.start()
+
+    def _collect(self, first):
+        # Returns the batch, and whether shutdown was asked for while collecting it
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                intent = self._intents.get(timeout=remaining) if remaining > 0 else self._intents.get_nowait()
+            except queue.Empty:
+                break
+            if intent is None:
+                return batch, True
+            batch.append(intent)
+        return batch, False
+
+    def _apply(self, db, batch):
+        for intent in batch:
+            db.execute("SAVEPOINT intent")
+            try:
+                intent.result = intent.context.run(run_in_batch, db, intent.func, *intent.args)
+            except Exception as e:
+                db.execute("ROLLBACK TO intent")
+                intent.error = e
+            db.execute("RELEASE intent")
+
+    def _commit(self, db, batch):
+        # The error that failed the whole transaction, None once it is committed
+        for intent in batch:
+            intent.result, intent.error = None, None
+        try:
+            run_transaction(db, self._apply, batch)
+        except Exception as e:
+            return e
+        return None
+
+    def _write(self):
+        db = connect(self.path, self.pragmas, self.cached_statements)
+        stopping = False
+        while not stopping and (first := self._intents.get()) is not None:
+            batch, stopping = self._collect(first)
+            started = [intent for intent in batch if intent.start()]
+            with self._lock:
+                self.cancelled += len(batch) - len(started)
+            batch = started
+            if not batch:
+                continue
+            start = time.perf_counter()
+            error = self._commit(db, batch)
+            if error is not None and len(batch) > 1 and not isinstance(error, DatabaseBusy):
+                # Something broke the transaction itself rather than one savepoint. Apply the
+                # intents one per transaction, so only the one at fault fails.
+                for intent in batch:
+                    intent.error = self._commit(db, [intent]) or intent.error
+            elif error is not None:
+                for intent in batch:
+                    intent.result, intent.error = None, error
+            end = time.perf_counter()
+
+            with self._lock:
+                self.intents += len(batch)
+                self.batches += 1
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.failed_batches += error is not None
+                self.queue_time += sum(start - intent.queued_at for intent in batch)
+                self.commit_time += end - start
+
+            for intent in batch:
+                try:
+                    intent.loop.call_soon_threadsafe(_settle, intent.future, intent.result, intent.error)
+                except RuntimeError:
+                    # The event loop is gone, nobody is waiting
+                    pass
+        db.close()
+
+    async def run(self, func, *args):
+        # func(db, *args) runs inside the batch's transaction, so it must leave committing to
+        # the batch: run_transaction joins it, a direct db.commit() would not. Like the executor's
+        # jobs it returns plain values, and the timeout covers time spent queued as well as
+        # running. A caller that times out or goes away takes its intent back if it is still
+        # queued; one already in a batch is committed with it.
+        self._start()
+        intent = _Intent(asyncio.get_running_loop(), func, args)
+        try:
+            self._intents.put_nowait(intent)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise DatabaseQueueFull() from None
+        try:
+            return await asyncio.wait_for(intent.future, self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise QueryTimeout() from None
+        finally:
+            if intent.future.cancelled():
+                intent.cancel()
+
+    def shutdown(self):
+        # Intents already queued are still applied
+        if self._writer is not None:
+            self._intents.put(None)
+            self._writer = None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "window": self.window,
+            "max_batch": self.max_batch,
+            "max_queue": self.max_queue,
+            "queued": self._intents.qsize(),
+            "intents": self.intents,
+            "batches": self.batches,
+            "avg_batch": round(self.intents / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "failed_batches": self.failed_batches,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "avg_queue_time": round(self.queue_time / self.intents, 6) if self.intents else 0.0,
+            "avg_commit_time": round(self.commit_time / self.batches, 6) if self.batches else 0.0,
+        }